@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""Cold start import benchmark, run from the repository root (requires the function deployment dependencies):
+
+  python benchmarks/cold_start.py --runs 5
+  python benchmarks/cold_start.py --service jira
+
+Each sample is taken in a fresh interpreter, comparing loading main (lazy) with importing every connector module
+up front (how main.py used to load them).
+
+Importing the connectors needs secops_common and reads their secrets, where those aren't available
+
+  python benchmarks/cold_start.py --sdk-only
+
+times only the third party imports (parsed from the sources) of the same scenarios instead.
+"""
+
+import os
+import ast
+import sys
+import json
+import subprocess
+from statistics import median
+
+import click
+
+IMPORT_MAIN = 'import main'
+
+IMPORT_ALL = '''
+import importlib
+import main
+for module, _, _ in main.CONNECTORS.values():
+    importlib.import_module(module)
+'''
+
+DISPATCH = '''
+import main
+main.load_connector(main.into_service({service!r}))
+'''
+
+MEASURE = '''
+import time
+start = time.perf_counter()
+{code}
+print(time.perf_counter() - start)
+'''
+
+
+def source_path(module):
+    path = os.path.join(*module.split('.'))
+    if (os.path.isdir(path)):
+        return os.path.join(path, '__init__.py')
+    return f'{path}.py'
+
+
+def sdk_imports(module, found=None, seen=None):
+    """The third party import statements of a local module and the local modules it imports,
+       secops_common (and so its own imports) excluded"""
+    found = [] if found == None else found
+    seen = set() if seen == None else seen
+    if (module in seen):
+        return found
+    seen.add(module)
+    with open(source_path(module)) as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if (isinstance(node, ast.Import)):
+            names = [alias.name for alias in node.names]
+        elif (isinstance(node, ast.ImportFrom) and node.level == 0):
+            names = [node.module]
+        else:
+            continue
+        for name in names:
+            top = name.split('.')[0]
+            if (top in ('main', 'pipeline')):
+                sdk_imports(name, found, seen)
+            elif (top != 'secops_common'
+                  and top not in sys.stdlib_module_names):
+                statement = ast.unparse(node)
+                if (statement not in found):
+                    found.append(statement)
+    return found
+
+
+def connector_modules():
+    """The connector modules of main.CONNECTORS (without importing main)"""
+    with open('main.py') as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if (isinstance(node, ast.Assign)
+                and node.targets[0].id == 'CONNECTORS'):
+            return sorted(
+                set(value.elts[0].value for value in node.value.values))
+
+
+def sdk_scenarios(service):
+    connectors = dict(
+        (module.split('.')[-1], module) for module in connector_modules())
+    module = connectors.get(service, f'pipeline.{service}')
+    main = sdk_imports('main')
+    one = sdk_imports(module, list(main))
+    every = list(main)
+    for connector in connectors.values():
+        sdk_imports(connector, every)
+    return {
+        'import_main': '\n'.join(main),
+        f'load_{service}': '\n'.join(one),
+        'import_all_connectors': '\n'.join(every),
+    }
+
+
+def sample(code):
+    out = subprocess.run(
+        [sys.executable, '-c', MEASURE.format(code=code)],
+        check=True,
+        capture_output=True,
+        text=True).stdout
+    return float(out.strip().splitlines()[-1])
+
+
+def measure(code, runs):
+    return median(sample(code) for _ in range(runs))
+
+
+@click.command()
+@click.option('--runs', default=5, help='Fresh interpreters per scenario')
+@click.option('--service',
+              default='jira',
+              help='Service to time a single connector load for')
+@click.option('--sdk-only',
+              is_flag=True,
+              help='Time the third party imports only')
+def run(runs, service, sdk_only):
+    if (sdk_only):
+        scenarios = sdk_scenarios(service)
+    else:
+        scenarios = {
+            'import_main': IMPORT_MAIN,
+            f'load_{service}': DISPATCH.format(service=service),
+            'import_all_connectors': IMPORT_ALL,
+        }
+    results = dict(
+        (name, measure(code, runs)) for name, code in scenarios.items())
+    for name, seconds in results.items():
+        print(f'{name:<24} {seconds * 1000:10.1f} ms')
+    print(json.dumps(results))
+
+
+if __name__ == '__main__':
+    run()
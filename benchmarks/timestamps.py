@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""Timestamp parsing microbenchmark, run from the repository root:
+
+  python benchmarks/timestamps.py --events 100000
+
+Compares the per event cost of the connectors' previous timestamp parsing (dateutil, strptime and pytz localize)
+with pipeline.common.time, checking both produce the same millis.
+"""
+
+import sys
+import json
+import timeit
+from datetime import datetime, timedelta, timezone
+
+import click
+import pytz
+from dateutil import parser
+
+sys.path.insert(0, '.')
+
+from pipeline.common.time import parse_millis
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+SINGAPORE = pytz.timezone('Asia/Singapore')
+
+
+def previous_unix_time_millis(dt):
+    epoch = datetime.utcfromtimestamp(0)
+    aware = pytz.utc.localize(epoch)
+    return int((dt - aware).total_seconds() * 1000.0)
+
+
+def previous_workspace(value):
+    return previous_unix_time_millis(parser.parse(value))
+
+
+def previous_lastpass(value):
+    dt = datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+    local_dt = SINGAPORE.localize(dt, is_dst=None)
+    return previous_unix_time_millis(local_dt.astimezone(timezone.utc))
+
+
+def previous_atlassian(value):
+    return previous_unix_time_millis(
+        datetime.strptime(value,
+                          '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc))
+
+
+def workspace(value):
+    return parse_millis(value)
+
+
+def lastpass(value):
+    return parse_millis(value, '%Y-%m-%d %H:%M:%S', SINGAPORE)
+
+
+def atlassian(value):
+    return parse_millis(value, '%Y-%m-%dT%H:%M:%SZ')
+
+
+def stamps(events, fmt, step):
+    start = datetime(2022, 5, 1, tzinfo=timezone.utc)
+    return [(start + step * i).strftime(fmt) for i in range(events)]
+
+
+def per_event(fn, values, repeat):
+    seconds = min(
+        timeit.repeat(lambda: list(map(fn, values)), number=1, repeat=repeat))
+    return seconds / len(values) * 1e9
+
+
+@click.command()
+@click.option('--events', default=100000)
+@click.option('--repeat', default=3)
+def run(events, repeat):
+    # Workspace times carry millis (microseconds trimmed the way the API formats them), the others are
+    # second resolution
+    workspace_stamps = [
+        value[:-3] + 'Z' for value in stamps(events, '%Y-%m-%dT%H:%M:%S.%f',
+                                             timedelta(milliseconds=7))
+    ]
+    cases = {
+        'workspace': (previous_workspace, workspace, workspace_stamps),
+        'lastpass': (previous_lastpass, lastpass,
+                     stamps(events, '%Y-%m-%d %H:%M:%S',
+                            timedelta(seconds=1))),
+        'atlassian': (previous_atlassian, atlassian,
+                      stamps(events, '%Y-%m-%dT%H:%M:%SZ',
+                             timedelta(seconds=1))),
+    }
+
+    results = {}
+    for name, (previous, current, values) in cases.items():
+        if list(map(previous, values)) != list(map(current, values)):
+            raise Exception(f'{name} millis differ')
+        results[name] = {
+            'before_ns': per_event(previous, values, repeat),
+            'after_ns': per_event(current, values, repeat),
+        }
+
+    for name, result in results.items():
+        print(
+            f"{name:<16} {result['before_ns']:10.0f} ns {result['after_ns']:10.0f} ns {result['before_ns'] / result['after_ns']:6.1f}x"
+        )
+    print(json.dumps(results))
+
+
+if __name__ == '__main__':
+    run()
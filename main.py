@@ -8,50 +8,18 @@ import base64
 # Routing
 from enum import Enum, auto
 
+# Lazy connector loading
+import importlib
+import functools
+
 # Main server listener
 # from dataflow.common.listener import listen
 
 # Logging
 from secops_common.logsetup import logger, enable_logfile
 
-# Confluence
-from pipeline.confluence import _publish_confluence_logs
-
-# Jira
-from pipeline.jira import _publish_jira_logs
-
-# Spreadsheet
-from pipeline.spreadsheet import _publish_spreadsheet
-
-# Google workspace
-from pipeline.workspaces import _publish_workspace_logs
-
-# Gmail
-from pipeline.gmail import _publish_gmail_logs
-
-# Atlassian admin console
-from pipeline.atlassian_org import _publish_atlassian_logs
-
-# Lastpass
-from pipeline.lastpass import _publish_lastpass_logs
-
-# Maxmind
-from pipeline.maxmind import _publish_and_download_maxmind
-
-# Bamboo
-from pipeline.bamboo import _publish_and_download_bamboo
-
-# Intune_AZ
-from pipeline.ms_graph_inventory import _publish_and_download_intune
-
-# Aliyun
-from pipeline.aliyun.sas import _publish_sas
-
-# SnipeIT
-from pipeline.snipeit.snipeit import _publish_snipeit
-
-# FleetDM
-from pipeline.fleetdm import _publish_fleetdm_logs
+# Secret cache hit/miss counters
+from pipeline.common.secrets import log_stats
 
 
 class Service(Enum):
@@ -75,40 +43,71 @@ def into_service(string):
     return Service[string]
 
 
+def listed(payload, plural, single):
+    if (plural in payload):
+        return payload[plural]
+    return [payload[single]]
+
+
+def sas_args(payload):
+    """Either a single type and account or types, accounts (and regions) lists"""
+    return (30, 'days', listed(payload, 'types', 'type'),
+            listed(payload, 'accounts', 'account'), payload.get('regions'))
+
+
+# Connector modules read their secrets and load their SDKs at import time, we only
+# import the one being dispatched (once per warm instance)
+CONNECTORS = {
+    Service.confluence: ('pipeline.confluence', '_publish_confluence_logs',
+                         lambda payload: (-1, 'minutes')),
+    Service.jira: ('pipeline.jira', '_publish_jira_logs', lambda payload:
+                   (-1, 'minutes')),
+    Service.spreadsheet: ('pipeline.spreadsheet', '_publish_spreadsheet',
+                          lambda payload: (payload['id'], payload['range'])),
+    Service.atlassian: ('pipeline.atlassian_org', '_publish_atlassian_logs',
+                        lambda payload: (-1, 'minutes')),
+    Service.lastpass: ('pipeline.lastpass', '_publish_lastpass_logs',
+                       lambda payload: (-1, 'minutes')),
+    Service.google_workspace:
+    ('pipeline.workspaces', '_publish_workspace_logs_many', lambda payload:
+     (-1, 'minutes', listed(payload, 'types', 'type'))),
+    Service.gmail: ('pipeline.gmail', '_publish_gmail_logs', lambda payload:
+                    (-1, 'minutes')),
+    Service.maxmind:
+    ('pipeline.maxmind', '_publish_and_download_maxmind', lambda payload: ()),
+    Service.bamboo_kv: ('pipeline.bamboo', '_publish_and_download_bamboo',
+                        lambda payload: ('kv_store', )),
+    Service.bamboo_hec: ('pipeline.bamboo', '_publish_and_download_bamboo',
+                         lambda payload: ('hec', )),
+    Service.ms_graph_inventory:
+    ('pipeline.ms_graph_inventory', '_publish_and_download_intune',
+     lambda payload: ()),
+    Service.aliyun_sas: ('pipeline.aliyun.sas', '_publish_sas_many', sas_args),
+    Service.snipeit:
+    ('pipeline.snipeit.snipeit', '_publish_snipeit', lambda payload: ()),
+    Service.fleetdm: ('pipeline.fleetdm', '_publish_fleetdm_logs',
+                      lambda payload: (-1, )),
+}
+
+
+@functools.lru_cache(maxsize=None)
+def load_connector(service):
+    module, name, _ = CONNECTORS[service]
+    logger.debug(f'Loading {module} connector')
+    return getattr(importlib.import_module(module), name)
+
+
 def trigger_processing(payload):
     service = into_service(payload['service'])
-    if service == Service.confluence:
-        _publish_confluence_logs(-1, 'minutes')
-    elif service == Service.jira:
-        _publish_jira_logs(-1, 'minutes')
-    elif service == Service.spreadsheet:
-        _publish_spreadsheet(payload['id'], payload['range'])
-    elif service == Service.atlassian:
-        _publish_atlassian_logs(-1, 'minutes')
-    elif service == Service.lastpass:
-        _publish_lastpass_logs(-1, 'minutes')
-    elif service == Service.google_workspace:
-        _publish_workspace_logs(-1, 'minutes', payload['type'])
-    elif service == Service.gmail:
-        _publish_gmail_logs(-1, 'minutes')
-    elif service == Service.maxmind:
-        _publish_and_download_maxmind()
-    elif service == Service.bamboo_kv:
-        _publish_and_download_bamboo('kv_store')
-    elif service == Service.bamboo_hec:
-        _publish_and_download_bamboo('hec')
-    elif service == Service.ms_graph_inventory:
-        _publish_and_download_intune()
-    elif service == Service.aliyun_sas:
-        _publish_sas(30, 'days', payload['type'], payload['account'])
-    elif service == Service.snipeit:
-        _publish_snipeit()
-    elif service == Service.fleetdm:
-        _publish_fleetdm_logs()
+    _, _, into_args = CONNECTORS[service]
+    load_connector(service)(*into_args(payload))
+    log_stats()
 
 
 """ Processing messages in the cloud function:
-      The payload has the following structure {"service":"aliyun", "asset":"disks", "dest":"biquery"} """
+      The payload has the following structure {"service":"aliyun", "asset":"disks", "dest":"biquery"}
+      Aliyun SAS payloads may list several types and accounts {"service":"aliyun_sas", "types":["alerts","leaks"], "accounts":["INT","CN"]}
+      Google workspace payloads may list several applications (or all) {"service":"google_workspace", "types":["login","drive"]} """
 
 
 def process_message(event, context):
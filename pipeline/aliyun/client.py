@@ -1,15 +1,32 @@
 import configparser
 from aliyunsdkcore.client import AcsClient
 from secops_common.misc import deserialize
-from secops_common.secrets import read_config
+from pipeline.common.secrets import read_config
 from pipeline.common.config import CONFIG
 from pathlib import Path
 import functools
 
+# Concurrent pagination
+import copy
+import math
+import queue
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
 # Fetch logic
 
 project_id = CONFIG['project_id']
 
+# Number of pages (and clients) fetched concurrently per region and account
+ALIYUN_CONCURRENCY = CONFIG.get('aliyun_concurrency', 4)
+
+# Page sizes per API action name, for example {'DescribeExposedInstanceList': 100}
+PAGE_SIZES = CONFIG.get('aliyun_page_sizes', {})
+
+
+def page_size(request, default):
+    return PAGE_SIZES.get(request.get_action_name(), default)
+
 
 def _next(client, request, response):
     page = response['PageNumber'] + 1
@@ -82,6 +99,73 @@ def fetch_with_count_3(client, request, fn):
     return result
 
 
+""" Concurrent fetch, the first page tells the total and the following pages are fetched concurrently
+    (over a pool of clients) and reassembled in order """
+
+
+def _count(response):
+    return response['PageNumber'], response['PageRecordCount'], response[
+        'TotalRecordCount']
+
+
+def _count_2(response):
+    info = response['PageInfo']
+    return info['CurrentPage'], info['PageSize'], info['TotalCount']
+
+
+def _count_3(response):
+    return response['CurrentPage'], response['PageSize'], response[
+        'TotalCount']
+
+
+def _fetch_page(pool, request, set_page, page):
+    # Requests are mutable, each page gets its own copy
+    paged = copy.deepcopy(request)
+    set_page(paged, page)
+    with pooled(pool) as client:
+        return deserialize(client.do_action_with_exception(paged))
+
+
+def _fetch_concurrently(region, account, request, fn, position, set_page):
+    # Every request (the first page included) is made over a pooled client, concurrent fetches
+    # of the same account and region never share a client
+    pool = client_pool(region, account)
+    with pooled(pool) as client:
+        response = deserialize(client.do_action_with_exception(request))
+    result = fn(response)
+    current, per_page, total = position(response)
+    if (per_page == 0 or total <= per_page):
+        return result
+
+    pages = range(current + 1, current + math.ceil(total / per_page))
+    with ThreadPoolExecutor(max_workers=ALIYUN_CONCURRENCY) as executor:
+        for response in executor.map(
+                functools.partial(_fetch_page, pool, request, set_page),
+                pages):
+            result.extend(fn(response))
+
+    return result
+
+
+def fetch_with_count_concurrent(region, account, request, fn):
+    request.set_PageSize(page_size(request, 20))
+    return _fetch_concurrently(region, account, request, fn, _count,
+                               lambda paged, page: paged.set_PageNumber(page))
+
+
+def fetch_with_count_2_concurrent(region, account, request, fn):
+    request.set_PageSize(page_size(request, 1000))
+    return _fetch_concurrently(region, account, request, fn, _count_2,
+                               lambda paged, page: paged.set_CurrentPage(page))
+
+
+def fetch_with_count_3_concurrent(region, account, request, fn):
+    request.set_PageSize(page_size(request, 1000))
+    request.set_CurrentPage(0)
+    return _fetch_concurrently(region, account, request, fn, _count_3,
+                               lambda paged, page: paged.set_CurrentPage(page))
+
+
 """ Fetch all in one go (no pagination) """
 
 
@@ -91,7 +175,30 @@ def fetch_all(client, request, fn):
 
 
 # See https://www.alibabacloud.com/help/doc-detail/40654.html for available regions
-@functools.lru_cache(maxsize=None)
-def initialize_client(region='cn-hongkong', account='INT'):
+def new_client(region, account):
     auth = read_config(project_id, 'aliyun')[account]
     return AcsClient(auth['key'], auth['secret'], region, True, 360)
+
+
+# Used by the (one request at a time) fetch_* helpers, concurrent fetches use client_pool
+@functools.lru_cache(maxsize=None)
+def initialize_client(region='cn-hongkong', account='INT'):
+    return new_client(region, account)
+
+
+@functools.lru_cache(maxsize=None)
+def client_pool(region, account):
+    """Clients used by concurrent requests, each client serves a single request at a time"""
+    pool = queue.Queue()
+    for _ in range(ALIYUN_CONCURRENCY):
+        pool.put(new_client(region, account))
+    return pool
+
+
+@contextmanager
+def pooled(pool):
+    client = pool.get()
+    try:
+        yield client
+    finally:
+        pool.put(client)
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 """ Aliyun SAS related findings """
 
-from secops_common.secrets import read_config
+from pipeline.common.secrets import read_config
 
 # Aliyun
 from aliyunsdkcore.acs_exception.exceptions import ClientException
@@ -13,7 +13,7 @@ from aliyunsdksas.request.v20181203 import DescribeExposedInstanceListRequest
 from aliyunsdksas.request.v20181203 import DescribeRiskCheckResultRequest
 from pipeline.common.fetch import last_n_24hours, last_n_minutes, last_from_persisted, mark_last_fetch, Unit, into_unit
 from pipeline.common.time import unix_time_millis
-from pipeline.aliyun.client import fetch_with_count_2, fetch_with_count_3, initialize_client, fetch_with_count, fetch_with_token, fetch_all
+from pipeline.aliyun.client import fetch_with_count_2_concurrent, fetch_with_count_3_concurrent, client_pool, pooled, fetch_all, ALIYUN_CONCURRENCY
 from datetime import datetime
 
 # Logging
@@ -26,22 +26,34 @@ from pipeline.common.config import CONFIG
 
 # dedup
 from pipeline.common.dedup import new_events, mark_events
+from pipeline.common.bigquery import partition_dedup_table
 
 from functools import partial
-
-from pipeline.common.functional import partition
+from itertools import chain
 
 # Splunk
-from pipeline.common.splunk import publish, retryable
+from pipeline.common.splunk import publish_all, retryable, log_byte_counts, HEC_MAX_IN_FLIGHT
 
 # Caching
 import functools
 
+# Concurrent event details
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import product
+
 pp = pprint.PrettyPrinter(indent=4)
 
-BATCH_SIZE = 5000
 project_id = CONFIG['project_id']
 
+# SAS is a global service served out of cn-hangzhou
+SAS_REGION = 'cn-hangzhou'
+
+# Number of account/type/region jobs published concurrently
+SAS_CONCURRENCY = CONFIG.get('sas_concurrency', 4)
+
+# Number of alarm event details kept in memory (across runs of a warm instance)
+EVENT_CACHE_SIZE = CONFIG.get('sas_event_cache_size', 4096)
+
 
 @click.group()
 def cli():
@@ -70,17 +82,21 @@ def _fetch_event(client, id):
     return fetch_all(client, request, lambda response: response)
 
 
-def _get_events(alarm, account):
-    client = initialize_client(region='cn-hangzhou', account=account)
+@functools.lru_cache(maxsize=EVENT_CACHE_SIZE)
+def _get_event(region, account, id):
+    with pooled(client_pool(region, account)) as client:
+        return _fetch_event(client, id)
+
+
+def _event_ids(alarm):
     ids = alarm['SecurityEventIds']
     if (isinstance(ids, list)):
-        return list(map(partial(_fetch_event, client), ids))
+        return ids
     else:
-        return [_fetch_event(client, ids)]
+        return [ids]
 
 
-def _get_alarms(account, start, end):
-    client = initialize_client(region='cn-hangzhou', account=account)
+def _get_alarms(account, start, end, region=SAS_REGION):
     request = DescribeAlarmEventListRequest.DescribeAlarmEventListRequest()
     request.set_From('sas')
     date_format = '%Y-%m-%d %H:%M:%S'
@@ -88,49 +104,55 @@ def _get_alarms(account, start, end):
     request.set_TimeEnd(end.strftime(date_format))
     request.set_CurrentPage(0)
     request.set_Lang('en')
-    return fetch_with_count_2(client, request,
-                              lambda response: response['SuspEvents'])
+    return fetch_with_count_2_concurrent(
+        region, account, request, lambda response: response['SuspEvents'])
 
 
-def _get_leaks(account, start, end):
-    client = initialize_client(region='cn-hangzhou', account=account)
+def _get_leaks(account, start, end, region=SAS_REGION):
     request = DescribeAccesskeyLeakListRequest.DescribeAccesskeyLeakListRequest(
     )
     request.set_StartTs(unix_time_millis(start))
-    return fetch_with_count_3(client, request,
-                              lambda response: response['AccessKeyLeakList'])
+    return fetch_with_count_3_concurrent(
+        region, account, request,
+        lambda response: response['AccessKeyLeakList'])
 
 
 # See https://www.alibabacloud.com/help/en/security-center/latest/api-doc-sas-2018-12-03-api-doc-describeexposedinstancelist
-def _get_exposed(account):
-    client = initialize_client(region='cn-hangzhou', account=account)
+def _get_exposed(account, region=SAS_REGION):
     request = DescribeExposedInstanceListRequest.DescribeExposedInstanceListRequest(
     )
-    return fetch_with_count_2(client, request,
-                              lambda response: response['ExposedInstances'])
+    return fetch_with_count_2_concurrent(
+        region, account, request,
+        lambda response: response['ExposedInstances'])
 
 
-def _get_risks(account):
-    client = initialize_client(region='cn-hangzhou', account=account)
+def _get_risks(account, region=SAS_REGION):
     request = DescribeRiskCheckResultRequest.DescribeRiskCheckResultRequest()
     request.set_Lang('en')
-    return fetch_with_count_3(client, request,
-                              lambda response: response['List'])
+    return fetch_with_count_3_concurrent(region, account, request,
+                                         lambda response: response['List'])
 
 
-def _fetch_exposed(account):
-    exposed = _get_exposed(account)
+def _fetch_exposed(account, region=SAS_REGION):
+    exposed = _get_exposed(account, region)
     return list(map(partial(with_account, account), exposed))
 
 
-def _fetch_risks(account):
-    risks = _get_risks(account)
+def _fetch_risks(account, region=SAS_REGION):
+    risks = _get_risks(account, region)
     return list(map(partial(with_account, account), risks))
 
 
-def add_events(account, alarm):
-    alarm['Events'] = _get_events(alarm, account)
-    return alarm
+def add_events(account, alarms, region=SAS_REGION):
+    """Fetches the distinct event details of the alarms concurrently"""
+    ids = list(dict.fromkeys(chain.from_iterable(map(_event_ids, alarms))))
+    with ThreadPoolExecutor(max_workers=ALIYUN_CONCURRENCY) as executor:
+        events = dict(
+            zip(ids, executor.map(partial(_get_event, region, account), ids)))
+
+    for alarm in alarms:
+        alarm['Events'] = [events[id] for id in _event_ids(alarm)]
+    return alarms
 
 
 @functools.lru_cache(maxsize=None)
@@ -147,38 +169,43 @@ def _get_alert_id(event):
     return event['AlarmUniqueInfo']
 
 
-def _fetch_alerts(num, unit, account):
+def _fetch_alerts(num, unit, account, region=SAS_REGION):
     time_unit = into_unit(unit)
 
     if (time_unit == Unit.days):
-        alarms, _, _ = last_n_24hours(int(num), partial(_get_alarms, account))
+        alarms, _, _ = last_n_24hours(
+            int(num), partial(_get_alarms, account, region=region))
 
     elif (time_unit == Unit.minutes):
-        alarms, _, _ = last_n_minutes(int(num), partial(_get_alarms, account))
+        alarms, _, _ = last_n_minutes(
+            int(num), partial(_get_alarms, account, region=region))
 
-    inc_account = list(map(partial(with_account, account), alarms))
-    with_events = list(map(partial(add_events, account), inc_account))
-    new = new_events(with_events, _get_alert_id, 'aliyun_sas_log_dedup')
+    # Only new alarms are enriched with their events details
+    new = new_events(alarms, _get_alert_id, 'aliyun_sas_log_dedup')
+    inc_account = list(map(partial(with_account, account), new))
+    with_events = add_events(account, inc_account, region)
 
     logger.info(
         f'Total of {len(alarms)} alerts fetched from Aliyun for {account} account out of which {len(new)} are new'
     )
 
-    return new
+    return with_events
 
 
 def _get_leak_id(event):
     return event['Id']
 
 
-def _fetch_leaks(num, unit, account):
+def _fetch_leaks(num, unit, account, region=SAS_REGION):
     time_unit = into_unit(unit)
 
     if (time_unit == Unit.days):
-        leaks, _, _ = last_n_24hours(int(num), partial(_get_leaks, account))
+        leaks, _, _ = last_n_24hours(
+            int(num), partial(_get_leaks, account, region=region))
 
     elif (time_unit == Unit.minutes):
-        leaks, _, _ = last_n_minutes(int(num), partial(_get_leaks, account))
+        leaks, _, _ = last_n_minutes(
+            int(num), partial(_get_leaks, account, region=region))
 
     new = new_events(leaks, _get_leak_id, 'aliyun_sas_leaks_log_dedup')
     inc_account = list(map(partial(with_account, account), new))
@@ -194,15 +221,22 @@ def _get_alarm_id(event):
     return event['AlarmUniqueInfo']
 
 
-def _publish_sas_alerts(num, unit, account):
-    new = _fetch_alerts(num, unit, account)
+def _publish_events(events, account, http=None):
+    """Publishes using a publisher of its own, over the given (shared) session when there is one"""
+    splunk_token = read_config(project_id, 'aliyun_sas')['splunk']
+    name = f'Aliyun SAS {account}' if http == None else None
+    publish_all(events,
+                splunk_token,
+                name,
+                http=http,
+                sourcetype_field='Source')
+
+
+def _publish_sas_alerts(num, unit, account, region=SAS_REGION, http=None):
+    new = _fetch_alerts(num, unit, account, region)
     sourced = list(map(partial(with_source, 'aliyun:sas:alerts'), new))
-    batches = partition(sourced, BATCH_SIZE)
 
-    http = retryable()
-    splunk_token = read_config(project_id, 'aliyun_sas')['splunk']
-    for batch in batches:
-        publish(http, batch, splunk_token, sourcetype_field='Source')
+    _publish_events(sourced, account, http)
 
     if (len(new) > 0):
         logger.info(
@@ -212,15 +246,11 @@ def _publish_sas_alerts(num, unit, account):
     mark_events(new, _get_alarm_id, 'aliyun_sas_log_dedup')
 
 
-def _publish_sas_leaks(num, unit, account):
-    new = _fetch_leaks(num, unit, account)
+def _publish_sas_leaks(num, unit, account, region=SAS_REGION, http=None):
+    new = _fetch_leaks(num, unit, account, region)
     sourced = list(map(partial(with_source, 'aliyun:sas:key_leaks'), new))
-    batches = partition(new, BATCH_SIZE)
 
-    http = retryable()
-    splunk_token = read_config(project_id, 'aliyun_sas')['splunk']
-    for batch in batches:
-        publish(http, batch, splunk_token, sourcetype_field='Source')
+    _publish_events(sourced, account, http)
 
     if (len(new) > 0):
         logger.info(
@@ -230,49 +260,68 @@ def _publish_sas_leaks(num, unit, account):
     mark_events(new, _get_leak_id, 'aliyun_sas_leaks_log_dedup')
 
 
-def _publish_sas_exposed(account):
-    new = _fetch_exposed(account)
+def _publish_sas_exposed(account, region=SAS_REGION, http=None):
+    new = _fetch_exposed(account, region)
     sourced = list(map(partial(with_source, 'aliyun:sas:exposed_assets'), new))
-    batches = partition(sourced, BATCH_SIZE)
 
-    http = retryable()
-    splunk_token = read_config(project_id, 'aliyun_sas')['splunk']
-    for batch in batches:
-        publish(http, batch, splunk_token, sourcetype_field='Source')
+    _publish_events(sourced, account, http)
 
     logger.info(
         f'Total of {len(new)} exposed instances persisted into Splunk from Aliyun SAS {account} account'
     )
 
 
-def _publish_sas_risks(account):
-    new = _fetch_risks(account)
+def _publish_sas_risks(account, region=SAS_REGION, http=None):
+    new = _fetch_risks(account, region)
     sourced = list(map(partial(with_source, 'aliyun:sas:config'), new))
-    batches = partition(sourced, BATCH_SIZE)
 
-    http = retryable()
-    splunk_token = read_config(project_id, 'aliyun_sas')['splunk']
-    for batch in batches:
-        publish(http, batch, splunk_token, sourcetype_field='Source')
+    _publish_events(sourced, account, http)
 
     logger.info(
         f'Total of {len(new)} risk items persisted into Splunk from Aliyun SAS account {account}'
     )
 
 
-def _publish_sas(num, unit, _type, account):
+def _publish_sas(num, unit, _type, account, region=SAS_REGION, http=None):
     if _type == 'alerts':
-        _publish_sas_alerts(num, unit, account)
+        _publish_sas_alerts(num, unit, account, region, http)
     elif _type == 'leaks':
-        _publish_sas_leaks(num, unit, account)
+        _publish_sas_leaks(num, unit, account, region, http)
     elif _type == 'exposed':
-        _publish_sas_exposed(account)
+        _publish_sas_exposed(account, region, http)
     elif _type == 'risks':
-        _publish_sas_risks(account)
+        _publish_sas_risks(account, region, http)
     else:
         raise Exception('no matching sas type found')
 
 
+def _publish_sas_many(num, unit, types, accounts, regions=None):
+    """Publishes every type of every account and region concurrently, each job using a publisher of its
+       own over a shared session so a failing job doesn't stop the others (failures are raised once all
+       jobs are done and marked what they published)"""
+    jobs = list(product(types, accounts, regions or [SAS_REGION]))
+    http = retryable(pool_size=SAS_CONCURRENCY * HEC_MAX_IN_FLIGHT + 1)
+    failed = []
+    with ThreadPoolExecutor(max_workers=SAS_CONCURRENCY) as executor:
+        futures = {
+            executor.submit(_publish_sas, num, unit, _type, account, region,
+                            http): (_type, account, region)
+            for _type, account, region in jobs
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f'Aliyun SAS {futures[future]} failed due to {e}')
+                failed.append(futures[future])
+    log_byte_counts(http, 'Aliyun SAS')
+
+    if (failed):
+        raise Exception(
+            f'Aliyun SAS failed for {len(failed)} out of {len(jobs)} jobs {failed}'
+        )
+
+
 @cli.command()
 @click.option("--num", required=True)
 @click.option("--unit", required=True)
@@ -336,5 +385,22 @@ def publish_risks(account):
     _publish_sas_risks(account)
 
 
+@cli.command()
+def partition_dedup():
+    for table in ['aliyun_sas_log_dedup', 'aliyun_sas_leaks_log_dedup']:
+        partition_dedup_table(table)
+
+
+@cli.command()
+@click.option("--num", required=True)
+@click.option("--unit", required=True)
+@click.option("--types", required=True, help='Comma separated types')
+@click.option("--accounts", required=True, help='Comma separated accounts')
+@click.option("--regions", default=SAS_REGION, help='Comma separated regions')
+def publish_many(num, unit, types, accounts, regions):
+    _publish_sas_many(num, unit, types.split(','), accounts.split(','),
+                      regions.split(','))
+
+
 if __name__ == '__main__':
     cli()
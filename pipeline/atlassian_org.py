@@ -1,19 +1,16 @@
 #!/usr/bin/env python3
 """Atlassian audit logs"""
 
-from secops_common.secrets import read_config
+from pipeline.common.secrets import read_config
 from secops_common.logsetup import logger
-from pipeline.common.splunk import publish, retryable
-from pipeline.common.functional import partition
-from pipeline.common.time import unix_time_millis
-from pipeline.common.fetch import last_n_24hours, last_n_minutes, last_from_persisted, mark_last_fetch, Unit, into_unit
+from pipeline.common.time import parse_millis
+from pipeline.common.fetch import last_n_24hours, last_n_minutes, catch_up, prefetched, Unit, into_unit
+from pipeline.common.window import publish_watermarked
 
-import requests
+from pipeline.common.http import session
+from itertools import chain
 import math
 
-# Timestamp handling
-from datetime import datetime, timedelta, timezone
-
 # UI
 import pprint
 import click
@@ -55,24 +52,23 @@ def from_atlassian_date(created):
     if not stamp.endswith('Z'):
         stamp += 'Z'
 
-    return unix_time_millis(
-        datetime.strptime(stamp,
-                          '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc))
+    return parse_millis(stamp, '%Y-%m-%dT%H:%M:%SZ')
 
 
 def _get_atlassian_audit_logs(params):
+    """Lazily yields the events of each page"""
     logger.info(f'Getting instance audit events')
-    response = requests.get(url, headers=headers, params=params)
+    response = session(url).get(url, headers=headers, params=params)
     logger.info(f'Getting first page for {url}...')
     json_resp = get_results(response)
 
     if not json_resp:
-        return []
+        return
 
     curr_results = json_resp['data']
     logger.debug(f'Got {len(curr_results)} results')
 
-    results = curr_results
+    yield curr_results
     next_url = json_resp['links'].get('next')
     if next_url:
         next_url = next_url.replace('/v1', '', 1)
@@ -80,7 +76,9 @@ def _get_atlassian_audit_logs(params):
     while next_url:
         logger.info('Getting page at {}...'.format(next_url))
 
-        response = requests.get(next_url, headers=headers, params=params)
+        response = session(next_url).get(next_url,
+                                         headers=headers,
+                                         params=params)
         json_resp = get_results(response)
         curr_results = json_resp['data']
         next_url = json_resp['links'].get('next')
@@ -88,9 +86,7 @@ def _get_atlassian_audit_logs(params):
             next_url = next_url.replace('/v1', '', 1)
         logger.info(f'Got {len(curr_results)} results')
 
-        results.extend(curr_results)
-
-    return results
+        yield curr_results
 
 
 def _get_logs(start, end):
@@ -99,11 +95,7 @@ def _get_logs(start, end):
         'from': into_atlassian_date(start),
         'to': into_atlassian_date(end),
     }
-    results = _get_atlassian_audit_logs(params)
-
-    logger.debug(
-        f'Total of {len(results)} logs fetched in _get_logs Atlassian')
-    return results
+    return chain.from_iterable(prefetched(_get_atlassian_audit_logs(params)))
 
 
 def with_time(log):
@@ -111,6 +103,10 @@ def with_time(log):
     return log
 
 
+def _publish_logs(logs):
+    return publish_watermarked(logs, splunk_token, 'Atlassian', with_time)
+
+
 def _publish_atlassian_logs(num, unit):
     time_unit = into_unit(unit)
     if int(num) > 0:
@@ -121,26 +117,18 @@ def _publish_atlassian_logs(num, unit):
         elif time_unit == Unit.minutes:
             logs, _, _ = last_n_minutes(int(num), _get_logs)
 
+        watermark = _publish_logs(logs)
+        count = watermark.count
+
     else:
         logger.info(
             f'Publishing Atlassian logs from last persisted range using time unit of {unit}'
         )
-        logs, start, end = last_from_persisted(time_unit, _get_logs,
-                                               'atlassian_log_fetch')
-
-    logger.info(f'Total of {len(logs)} fetched from Atlassian')
-    timed_logs = list(map(with_time, logs))
-    batches = partition(timed_logs, 50)
-    http = retryable()
-    for batch in batches:
-        publish(http, batch, splunk_token, time_field='timestamp')
-
-    if (len(logs) > 0):
-        logger.info(
-            f'Total of {len(logs)} persisted into Splunk from Atlassian')
+        _, count = catch_up(time_unit, _get_logs, _publish_logs,
+                            'atlassian_log_fetch')
 
-    if int(num) < 0:
-        mark_last_fetch(start, end, True, 'atlassian_log_fetch')
+    if (count > 0):
+        logger.info(f'Total of {count} persisted into Splunk from Atlassian')
 
 
 @click.group()
@@ -159,7 +147,7 @@ def get_logs(num, unit):
     elif time_unit == Unit.minutes:
         logs, _, _ = last_n_minutes(int(num), _get_logs)
 
-    pp.pprint(logs)
+    pp.pprint(list(logs))
 
 
 @cli.command()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""Backfilling a time range for any connector exposing _get_logs(start, end) and _publish_logs(logs),
+   connectors may set their own CHECKPOINT_WINDOW (default sub window) and MIN_SUB_WINDOW"""
+
+import importlib
+from datetime import timedelta, timezone
+from functools import partial
+
+import click
+
+from secops_common.logsetup import logger
+
+from pipeline.common.fetch import backfill, BACKFILL_CONCURRENCY
+from pipeline.common.checkpoint import store
+
+# Sub window size of connectors without a CHECKPOINT_WINDOW of their own
+DEFAULT_STEP = timedelta(hours=1)
+
+CONNECTORS = {
+    'jira': 'pipeline.jira',
+    'confluence': 'pipeline.confluence',
+    'lastpass': 'pipeline.lastpass',
+    'atlassian': 'pipeline.atlassian_org',
+    'gmail': 'pipeline.gmail',
+    'google_workspace': 'pipeline.workspaces',
+}
+
+
+def into_utc(dt):
+    # click.DateTime values are naive, taken as UTC
+    return dt.replace(tzinfo=timezone.utc)
+
+
+def backfill_name(connector, type):
+    if (type != None):
+        return f'{connector}_{type}'
+    return connector
+
+
+def connector_module(connector):
+    return importlib.import_module(CONNECTORS.get(connector, connector))
+
+
+def sub_window_step(connector, hours=None):
+    """The sub window of hours (or the connector default), rejecting sub windows shorter than the
+       connector minimum (gmail queries scan whole partition days)"""
+    module = connector_module(connector)
+    if (hours == None):
+        return getattr(module, 'CHECKPOINT_WINDOW', DEFAULT_STEP)
+    step = timedelta(hours=hours)
+    minimum = getattr(module, 'MIN_SUB_WINDOW', None)
+    if (minimum != None and step < minimum):
+        raise click.BadParameter(
+            f'{connector} sub windows have to be at least {minimum}',
+            param_hint='--hours')
+    return step
+
+
+def load(connector, type):
+    """Returns the connector (name or module path) fetch and publish functions"""
+    module = connector_module(connector)
+    if (type != None):
+        # Typed connectors (Google workspace applications) take the type first
+        return partial(module._get_logs,
+                       type), partial(module._publish_logs, type)
+    return module._get_logs, module._publish_logs
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.option("--connector",
+              required=True,
+              help=f'One of {", ".join(CONNECTORS)} or a connector module')
+@click.option("--start", required=True, type=click.DateTime())
+@click.option("--end", required=True, type=click.DateTime())
+@click.option("--hours",
+              default=None,
+              type=int,
+              help='Sub window size in hours (defaults to the connector one)')
+@click.option("--concurrency", default=BACKFILL_CONCURRENCY)
+@click.option("--type", default=None, help='Google workspace application')
+@click.option("--name",
+              default=None,
+              help='Backfill name completed sub windows are kept under')
+def run(connector, start, end, hours, concurrency, type, name):
+    step = sub_window_step(connector, hours)
+    _get_logs, _publish_logs = load(connector, type)
+    name = name or backfill_name(connector, type)
+    backfill(name,
+             _get_logs,
+             _publish_logs,
+             into_utc(start),
+             into_utc(end),
+             step=step,
+             concurrency=concurrency)
+
+
+@cli.command()
+@click.option("--name", required=True)
+def status(name):
+    completed = sorted(store().completed(name))
+    logger.info(f'{len(completed)} completed sub windows for {name}')
+    for start, end in completed:
+        print(f'{start} - {end}')
+
+
+if __name__ == '__main__':
+    cli()
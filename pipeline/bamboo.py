@@ -3,18 +3,18 @@
 
 import datetime
 import pytz
-import requests
+from pipeline.common.http import session
 from requests.auth import HTTPBasicAuth
 
 # UI
 import pprint
 import click
 
-from secops_common.secrets import read_config
+from pipeline.common.secrets import read_config
 from secops_common.misc import serialize
 
 # Splunk KV
-from pipeline.common.splunk import insert_batch_kv, empty_collection, retryable, publish
+from pipeline.common.splunk import insert_batch_kv, empty_collection, retryable, publish_all
 
 from pipeline.common.functional import partition
 
@@ -67,10 +67,10 @@ def _fetch():
             "terminationDate"
         ]
     }
-    response = requests.post(base_url + reports_endpoint,
-                             headers=headers,
-                             data=serialize(data),
-                             auth=HTTPBasicAuth(bamboo_token, 'x'))
+    response = session(base_url).post(base_url + reports_endpoint,
+                                      headers=headers,
+                                      data=serialize(data),
+                                      auth=HTTPBasicAuth(bamboo_token, 'x'))
 
     employees = response.json()['employees']
 
@@ -92,11 +92,9 @@ def _process(records, destination):
         for batch in batches:
             insert_batch_kv(http, 'kv_hr_info', batch, splunk_api_token)
     elif destination == 'hec':
-        batches = partition(list(records), 500)
         logger.info(f'Ingesting logs through HEC')
 
-        for batch in batches:
-            publish(http, batch, splunk_token)
+        publish_all(records, splunk_token, 'Bamboo', http=http)
 
     logger.info(f'Total of {len(records)} persisted into Splunk from Bamboo')
 
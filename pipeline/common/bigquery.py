@@ -82,6 +82,100 @@ SPREAD = {
     ]
 }
 
-secops_common.bigquery.schema = merge(merge(WORKSPACE, PRODUCTS), SPREAD)
+BACKFILL = {
+    'backfill_windows': [
+        bigquery.SchemaField('name',
+                             'STRING',
+                             mode='REQUIRED',
+                             description='Backfill name'),
+        bigquery.SchemaField('start_date',
+                             'TIMESTAMP',
+                             mode='REQUIRED',
+                             description='Sub window start date'),
+        bigquery.SchemaField('end_date',
+                             'TIMESTAMP',
+                             mode='REQUIRED',
+                             description='Sub window end date'),
+        bigquery.SchemaField('created_at',
+                             'TIMESTAMP',
+                             mode='REQUIRED',
+                             description='Bigquery record creation time')
+    ]
+}
+
+secops_common.bigquery.schema = merge(
+    merge(merge(WORKSPACE, PRODUCTS), SPREAD), BACKFILL)
 secops_common.bigquery.dataset = CONFIG['dataset']
 secops_common.bigquery.project = CONFIG['project']
+
+# Dedup tables are partitioned daily on created_at (expiring partitions past the retention) and
+# clustered on id, so dedup lookups only scan the lookback partitions
+DEDUP_RETENTION_DAYS = CONFIG.get('dedup_retention_days', 90)
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+def table_id(table):
+    return f"{CONFIG['project']}.{CONFIG['dataset']}.{table}"
+
+
+def ensure_dedup_table(table, retention_days=DEDUP_RETENTION_DAYS):
+    expiration_ms = retention_days * DAY_MS
+    try:
+        existing = bigquery_client.get_table(table_id(table))
+    except NotFound:
+        logger.info(f'Creating partitioned dedup table {table}')
+        created = bigquery.Table(table_id(table), schema=DEDUP_SCHEMA)
+        created.time_partitioning = bigquery.TimePartitioning(
+            type_=bigquery.TimePartitioningType.DAY,
+            field='created_at',
+            expiration_ms=expiration_ms)
+        created.clustering_fields = ['id']
+        bigquery_client.create_table(created, exists_ok=True)
+        return
+
+    if (existing.time_partitioning == None):
+        logger.warning(
+            f'{table} is not partitioned, dedup queries scan all of it (see partition_dedup_table)'
+        )
+    elif (existing.time_partitioning.expiration_ms != expiration_ms):
+        existing.time_partitioning.expiration_ms = expiration_ms
+        bigquery_client.update_table(existing, ['time_partitioning'])
+
+
+def count_rows(table, where='TRUE'):
+    query = f'SELECT COUNT(*) AS count FROM `{table_id(table)}` WHERE {where}'
+    return list(bigquery_client.query(query).result())[0]['count']
+
+
+def partition_dedup_table(table, retention_days=DEDUP_RETENTION_DAYS):
+    """Recreates an existing dedup table partitioned and clustered, dropping rows past the retention.
+
+       BigQuery won't replace a table with a different partitioning spec, the rows are copied into a
+       partitioned table (under a temporary name) first, once its row count matches the original is
+       dropped and the partitioned table is copied back under the original name"""
+    retained = f'created_at >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL {int(retention_days)} DAY)'
+    partitioned = f'{table}_partitioned'
+    query = f"""CREATE OR REPLACE TABLE `{table_id(partitioned)}`
+                PARTITION BY DATE(created_at)
+                CLUSTER BY id
+                OPTIONS(partition_expiration_days={int(retention_days)})
+                AS SELECT * FROM `{table_id(table)}`
+                WHERE {retained}"""
+    bigquery_client.query(query).result()
+
+    expected, copied = count_rows(table, retained), count_rows(partitioned)
+    if (expected != copied):
+        raise Exception(
+            f'{partitioned} has {copied} rows instead of the {expected} rows of {table}, keeping {table} as is'
+        )
+
+    bigquery_client.delete_table(table_id(table))
+    job_config = bigquery.CopyJobConfig(
+        write_disposition=bigquery.WriteDisposition.WRITE_EMPTY)
+    bigquery_client.copy_table(table_id(partitioned),
+                               table_id(table),
+                               job_config=job_config).result()
+    bigquery_client.delete_table(table_id(partitioned))
+    logger.info(
+        f'{table} is now partitioned with a {retention_days} days retention')
@@ -0,0 +1,140 @@
+""" Fetch checkpoint (window/id) stores, keyed by the checkpoint table name """
+
+import json
+import sqlite3
+import functools
+import threading
+from datetime import datetime, timezone
+
+from secops_common.logsetup import logger
+
+from pipeline.common.config import CONFIG
+
+# Either bigquery (default) or sqlite (local daemon/server mode)
+CHECKPOINT_STORE = CONFIG.get('checkpoint_store', 'bigquery')
+
+CHECKPOINT_SQLITE_PATH = CONFIG.get('checkpoint_sqlite_path', 'checkpoints.db')
+
+# Completed backfill sub windows, see pipeline.common.fetch.backfill
+BACKFILL_TABLE = 'backfill_windows'
+
+
+class BigQueryStore:
+    """Append only checkpoint tables, the latest row by created_at is the current checkpoint,
+       completed backfill windows are rows of the backfill table"""
+    def __init__(self):
+        # Registering the checkpoint schemas and creating the client only when used
+        import pipeline.common.bigquery
+        from secops_common.bigquery import latest_rows, get_table, insert_rows, run_query
+        from google.cloud import bigquery
+        self.latest_rows = latest_rows
+        self.get_table = get_table
+        self.insert_rows = insert_rows
+        self.run_query = run_query
+        self.bigquery = bigquery
+        self.ensured = set()
+
+    def _ensure(self, table):
+        # Making sure table is set (once per instance)
+        if (table not in self.ensured):
+            self.get_table(table)
+            self.ensured.add(table)
+
+    def latest(self, table):
+        self._ensure(table)
+        rows = self.latest_rows(table)
+        if rows.total_rows == 0:
+            return None
+        return tuple(list(next(rows.pages))[0])
+
+    def mark(self, table, row):
+        self._ensure(table)
+        self.insert_rows([row], table)
+
+    def completed(self, name):
+        self._ensure(BACKFILL_TABLE)
+        query = f"SELECT start_date, end_date FROM `{CONFIG['project']}.{CONFIG['dataset']}.{BACKFILL_TABLE}` WHERE name = @name;"
+        job_config = self.bigquery.QueryJobConfig(query_parameters=[
+            self.bigquery.ScalarQueryParameter("name", "STRING", name),
+        ])
+        return set(
+            map(lambda row: (row['start_date'], row['end_date']),
+                self.run_query(query, config=job_config)))
+
+    def complete(self, name, start, end):
+        self._ensure(BACKFILL_TABLE)
+        stamp = datetime.now(tz=timezone.utc)
+        self.insert_rows([[name, start, end, stamp]], BACKFILL_TABLE)
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {'datetime': value.isoformat()}
+    raise TypeError(f'{type(value)} is not a supported checkpoint value')
+
+
+def _decode(obj):
+    if list(obj) == ['datetime']:
+        return datetime.fromisoformat(obj['datetime'])
+    return obj
+
+
+class SQLiteStore:
+    """A single row per checkpoint table, replaced on each mark, and a row per completed
+       backfill window"""
+    def __init__(self, path=CHECKPOINT_SQLITE_PATH):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS checkpoints '
+                            '(name TEXT PRIMARY KEY, row TEXT NOT NULL)')
+            self.db.execute(
+                f'CREATE TABLE IF NOT EXISTS {BACKFILL_TABLE} '
+                '(name TEXT, start_date TEXT, end_date TEXT, PRIMARY KEY (name, start_date, end_date))'
+            )
+
+    def latest(self, table):
+        with self.lock:
+            found = self.db.execute(
+                'SELECT row FROM checkpoints WHERE name = ?',
+                (table, )).fetchone()
+        if found == None:
+            return None
+        return tuple(json.loads(found[0], object_hook=_decode))
+
+    def mark(self, table, row):
+        encoded = json.dumps(list(row), default=_encode)
+        with self.lock, self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO checkpoints (name, row) VALUES (?, ?)',
+                (table, encoded))
+
+    def completed(self, name):
+        with self.lock:
+            rows = self.db.execute(
+                f'SELECT start_date, end_date FROM {BACKFILL_TABLE} WHERE name = ?',
+                (name, )).fetchall()
+        return set((datetime.fromisoformat(start), datetime.fromisoformat(end))
+                   for start, end in rows)
+
+    def complete(self, name, start, end):
+        with self.lock, self.db:
+            self.db.execute(
+                f'INSERT OR IGNORE INTO {BACKFILL_TABLE} (name, start_date, end_date) VALUES (?, ?, ?)',
+                (name, start.isoformat(), end.isoformat()))
+
+    def close(self):
+        self.db.close()
+
+
+STORES = {'bigquery': BigQueryStore, 'sqlite': SQLiteStore}
+
+
+@functools.lru_cache(maxsize=None)
+def store():
+    if CHECKPOINT_STORE not in STORES:
+        raise Exception(
+            f'checkpoint_store {CHECKPOINT_STORE} is not one of {list(STORES)}'
+        )
+    logger.debug(f'Using the {CHECKPOINT_STORE} checkpoint store')
+    return STORES[CHECKPOINT_STORE]()
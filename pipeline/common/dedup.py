@@ -1,13 +1,21 @@
 """ Fetch event deduplication """
 
-from secops_common.bigquery import get_table, insert_rows, run_query
+from pipeline.common.bigquery import ensure_dedup_table, DEDUP_RETENTION_DAYS
+from secops_common.bigquery import insert_rows, run_query
 from secops_common.functional import merge, compose2, flatten
+from secops_common.logsetup import logger
 
 from google.cloud import bigquery
 
 from pipeline.common.config import CONFIG
+from pipeline.common.bloom import BloomFilter
+from pipeline.common.functional import partition
 
-from datetime import datetime, timezone
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
 
 
 def get_id(row):
@@ -17,24 +25,148 @@ def get_id(row):
 project = CONFIG['project']
 dataset = CONFIG['dataset']
 
+# Number of ids the per table Bloom filter is sized for and its false positive rate
+DEDUP_BLOOM_CAPACITY = CONFIG.get('dedup_bloom_capacity', 1000000)
+DEDUP_BLOOM_ERROR = CONFIG.get('dedup_bloom_error', 0.001)
 
-def new_events(events, fn_id, table):
-    get_table(table)
-    ids = set(map(fn_id, events))
-    query = f"SELECT id FROM `{project}.{dataset}.{table}` WHERE id IN UNNEST(@ids);"
+# Number of seen ids kept exactly (most recently used) per table
+DEDUP_CACHE_SIZE = CONFIG.get('dedup_cache_size', 100000)
+
+# Ids are only looked up in the partitions of the last lookback days (longer than any fetch range)
+DEDUP_LOOKBACK_DAYS = CONFIG.get('dedup_lookback_days', 35)
+
+# Large id sets are looked up in chunks, concurrently
+DEDUP_CHUNK_SIZE = CONFIG.get('dedup_chunk_size', 10000)
+DEDUP_QUERY_CONCURRENCY = CONFIG.get('dedup_query_concurrency', 4)
+
+if (DEDUP_LOOKBACK_DAYS > DEDUP_RETENTION_DAYS):
+    logger.warning(
+        f'dedup_lookback_days ({DEDUP_LOOKBACK_DAYS}) is longer than dedup_retention_days ({DEDUP_RETENTION_DAYS})'
+    )
+
+# Ids inserted around the last refresh may carry an earlier created_at, re-reading an overlap keeps
+# the filter complete
+REFRESH_OVERLAP = timedelta(minutes=10)
+
+
+class SeenIds:
+    """Ids already in a dedup table, kept in a Bloom filter (no false negatives) and an exact LRU
+       cache in front of it, only ids positive in the filter and missing from the cache have to be
+       checked against the table"""
+    def __init__(self, table, capacity, error_rate, cache_size):
+        self.table = table
+        self.bloom = BloomFilter(capacity, error_rate)
+        self.recent = OrderedDict()
+        self.cache_size = cache_size
+        self.since = None
+        self.lock = threading.Lock()
+
+    def _add(self, id):
+        self.bloom.add(id)
+        self.recent[id] = True
+        self.recent.move_to_end(id)
+        if (len(self.recent) > self.cache_size):
+            self.recent.popitem(last=False)
+
+    def add(self, ids):
+        with self.lock:
+            for id in ids:
+                self._add(id)
+
+    def refresh(self):
+        """Loads the ids added to the table since the last refresh (the lookback the first time)"""
+        if (self.since == None):
+            since = lookback_start()
+        else:
+            since = self.since - REFRESH_OVERLAP
+        query = f"SELECT id, created_at FROM `{project}.{dataset}.{self.table}` WHERE created_at >= @since;"
+        job_config = bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ScalarQueryParameter("since", "TIMESTAMP", since),
+        ])
+
+        latest = self.since
+        loaded = 0
+        with self.lock:
+            for row in run_query(query, config=job_config):
+                self._add(row['id'])
+                loaded += 1
+                if (latest == None or row['created_at'] > latest):
+                    latest = row['created_at']
+            self.since = latest
+
+        if (self.bloom.count > self.bloom.capacity):
+            logger.warning(
+                f'{self.table} dedup filter holds {self.bloom.count} ids over its {self.bloom.capacity} capacity, raise dedup_bloom_capacity'
+            )
+        logger.debug(f'Loaded {loaded} ids into the {self.table} dedup filter')
+
+    def split(self, ids):
+        """Returns the ids that are certainly new and the ids that have to be checked"""
+        new, unknown = set(), set()
+        with self.lock:
+            for id in ids:
+                if id not in self.bloom:
+                    new.add(id)
+                elif id in self.recent:
+                    self.recent.move_to_end(id)
+                else:
+                    unknown.add(id)
+        return new, unknown
+
+
+def lookback_start():
+    return datetime.now(tz=timezone.utc) - timedelta(days=DEDUP_LOOKBACK_DAYS)
+
+
+@functools.lru_cache(maxsize=None)
+def seen_ids(table):
+    ensure_dedup_table(table)
+    return SeenIds(table, DEDUP_BLOOM_CAPACITY, DEDUP_BLOOM_ERROR,
+                   DEDUP_CACHE_SIZE)
+
+
+def _existing_ids(table, since, ids):
+    query = f"SELECT id FROM `{project}.{dataset}.{table}` WHERE created_at >= @since AND id IN UNNEST(@ids);"
     # As ID's are provided externally, we prevent injection by using a prep statement
     job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter("since", "TIMESTAMP", since),
         bigquery.ArrayQueryParameter("ids", "STRING", ids),
     ])
     rows = run_query(query, config=job_config)
-    existing = set(map(compose2(get_id, dict), rows))
-    new_items = ids - existing
+    return set(map(compose2(get_id, dict), rows))
+
+
+def existing_ids(ids, table):
+    since = lookback_start()
+    chunks = list(partition(list(ids), DEDUP_CHUNK_SIZE))
+    if (len(chunks) == 1):
+        return _existing_ids(table, since, chunks[0])
+
+    with ThreadPoolExecutor(max_workers=DEDUP_QUERY_CONCURRENCY) as executor:
+        found = executor.map(functools.partial(_existing_ids, table, since),
+                             chunks)
+        return set().union(*found)
+
+
+def new_events(events, fn_id, table):
+    seen = seen_ids(table)
+    seen.refresh()
+    ids = set(map(fn_id, events))
+    new_items, unknown = seen.split(ids)
+    if unknown:
+        existing = existing_ids(unknown, table)
+        seen.add(existing)
+        new_items |= unknown - existing
+    logger.info(
+        f'{len(ids)} ids checked against {table}, {len(unknown)} queried, {len(new_items)} new'
+    )
     return list(filter(lambda event: fn_id(event) in new_items, events))
 
 
 def mark_events(events, fn_id, table):
     if events:
-        get_table(table)
+        seen = seen_ids(table)
         stamp = datetime.now(tz=timezone.utc)
-        insert_rows(list(map(lambda event: [fn_id(event), stamp], events)),
-                    table)
+        ids = list(map(fn_id, events))
+        insert_rows(list(map(lambda id: [id, stamp], ids)), table)
+        seen.add(ids)
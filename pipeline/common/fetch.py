@@ -1,16 +1,32 @@
 """ Common log audit fetching and persistence """
 
+import time
 from datetime import datetime, timedelta, timezone
 
-# Bigquery
-import pipeline.common.bigquery
-from secops_common.bigquery import latest_rows, get_table, insert_rows
+# Checkpoints
+from pipeline.common.checkpoint import store
+
+from pipeline.common.config import CONFIG
+
+# Pages fetched ahead of publishing
+from pipeline.common.functional import prefetch
+
+# Backfill
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from secops_common.logsetup import logger
 
 # Units
 from enum import Enum, auto
 
+# Number of pages a paginated fetch requests ahead of the pages being published
+PREFETCH_PAGES = CONFIG.get('fetch_prefetch_pages', 2)
+
+
+def prefetched(pages):
+    """Fetches pages in the background while the current page is being published"""
+    return prefetch(pages, PREFETCH_PAGES)
+
 
 class Unit(Enum):
     minutes = auto()
@@ -36,37 +52,87 @@ def last_n_minutes(n, _get_logs, tz=timezone.utc):
     return _get_logs(start, end), start, end
 
 
+def window_delta(time_unit):
+    if time_unit == Unit.days:
+        return timedelta(hours=24)
+    elif time_unit == Unit.minutes:
+        return timedelta(minutes=5)
+
+
+def persisted_window(time_unit, table, tz=timezone.utc):
+    """The window following the persisted one (None when fetching for the very first time)"""
+    row = store().latest(table)
+    if row == None:
+        return None
+
+    logger.debug(f'Fetching last start/end values from {table}')
+    start, end, status, _ = row
+    logger.debug(f'Date range is {start} - {end}')
+    # Progressing 5 min on top of the persisted data
+    new_start = end.astimezone(tz)
+    new_end = new_start + window_delta(time_unit)
+    if new_start > datetime.now(tz=tz):
+        raise Exception(f'date range {new_start}-{new_end} is in the future!')
+
+    return new_start, new_end
+
+
 def last_from_persisted(time_unit, _get_logs, table, tz=timezone.utc):
-    # Making sure table is set
-    get_table(table)
-    rows = latest_rows(table)
+    window = persisted_window(time_unit, table, tz=tz)
     # Fetching for the very first time (last 5min)
-    if rows.total_rows == 0:
+    if window == None:
         return last_n_minutes(5, _get_logs, tz=tz)
-    # Progressing 5 min on top of the persisted data
     else:
-        logger.debug(f'Fetching last start/end values from bigquery')
-        start, end, status, _ = tuple(list(next(rows.pages))[0])
-        logger.debug(f'Date range is {start} - {end}')
-        new_start = end.astimezone(tz)
-        if time_unit == Unit.days:
-            delta = timedelta(hours=24)
-        elif time_unit == Unit.minutes:
-            delta = timedelta(minutes=5)
-
-        new_end = new_start + delta
-        if new_start > datetime.now(tz=tz):
-            raise Exception(
-                f'date range {new_start}-{new_end} is in the future!')
-
+        new_start, new_end = window
         return _get_logs(new_start, new_end), new_start, new_end
 
 
+# Catch up budget, a single invocation processes up to max windows, seconds or events
+CATCHUP_MAX_WINDOWS = CONFIG.get('catchup_max_windows', 48)
+CATCHUP_MAX_SECONDS = CONFIG.get('catchup_max_seconds', 240)
+CATCHUP_MAX_EVENTS = CONFIG.get('catchup_max_events', 200000)
+
+
+def catch_up(time_unit, _get_logs, _publish_logs, table, tz=timezone.utc):
+    """Publishes the window following the persisted one, when lagging behind (the next window already
+       ended) consecutive windows are processed until caught up or the catch up budget is spent,
+       each window is marked once published. Returns the number of windows and events published"""
+    logs, start, end = last_from_persisted(time_unit, _get_logs, table, tz=tz)
+    delta = window_delta(time_unit)
+    started = time.monotonic()
+    windows = 0
+    events = 0
+    while True:
+        watermark = _publish_logs(logs)
+        mark_last_fetch(start, end, True, table)
+        windows += 1
+        events += watermark.count
+
+        if (end + delta > datetime.now(tz=tz)):
+            break
+
+        if (windows >= CATCHUP_MAX_WINDOWS
+                or time.monotonic() - started >= CATCHUP_MAX_SECONDS
+                or events >= CATCHUP_MAX_EVENTS):
+            logger.info(
+                f'{table} is lagging from {end}, catch up budget spent after {windows} windows and {events} events'
+            )
+            break
+
+        # Windows follow each other locally, the persisted state isn't read back
+        start, end = end, end + delta
+        logs = _get_logs(start, end)
+
+    if (windows > 1):
+        logger.info(f'{table} caught up {windows} windows')
+    return windows, events
+
+
 def mark_last_fetch(start, end, status, table):
     stamp = datetime.now(tz=timezone.utc)
     start_utc = start.astimezone(timezone.utc)
     end_utc = end.astimezone(timezone.utc)
-    insert_rows([[start_utc, end_utc, status, stamp]], table)
+    store().mark(table, [start_utc, end_utc, status, stamp])
     if (status == True):
         logger.debug(
             f'Fetching of {table} logs was successful for start {start} - {end} range'
@@ -77,20 +143,77 @@ def mark_last_fetch(start, end, status, table):
         )
 
 
+# Backfill
+
+# Number of sub windows fetched and published concurrently
+BACKFILL_CONCURRENCY = CONFIG.get('backfill_concurrency', 4)
+
+
+def sub_windows(start, end, step):
+    while start < end:
+        yield start, min(start + step, end)
+        start += step
+
+
+def backfill(name,
+             _get_logs,
+             _publish_logs,
+             start,
+             end,
+             step=timedelta(hours=1),
+             concurrency=BACKFILL_CONCURRENCY):
+    """Fetches [start, end] split into sub windows of step concurrently, each sub window is published
+       (_publish_logs returns its Watermark) and recorded as completed under name once done, re-running
+       the same backfill skips completed sub windows"""
+    start = start.astimezone(timezone.utc)
+    end = end.astimezone(timezone.utc)
+    completed = store().completed(name)
+    windows = list(
+        filter(lambda window: window not in completed,
+               sub_windows(start, end, step)))
+    logger.info(
+        f'Backfilling {name} for {start} - {end} in {len(windows)} sub windows ({len(completed)} completed before)'
+    )
+
+    def run(window):
+        window_start, window_end = window
+        watermark = _publish_logs(_get_logs(window_start, window_end))
+        store().complete(name, window_start, window_end)
+        return watermark.count
+
+    total = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(run, window): window for window in windows}
+        try:
+            for future in as_completed(futures):
+                window_start, window_end = futures[future]
+                count = future.result()
+                total += count
+                logger.info(
+                    f'Backfilled {count} {name} events for {window_start} - {window_end}'
+                )
+        except Exception:
+            # Sub windows already running are completed, queued ones are picked up on resume
+            for future in futures:
+                future.cancel()
+            raise
+
+    logger.info(f'Total of {total} {name} events backfilled')
+    return total
+
+
 # ID-based fetcher
 
 
 def last_from_id(_get_logs, table):
-    # Making sure table is set
-    get_table(table)
-    rows = latest_rows(table)
+    row = store().latest(table)
     # Fetching for the very first time (first ID)
-    if rows.total_rows == 0:
+    if row == None:
         return _get_logs(0), 0
     # Progressing 5 min on top of the persisted data
     else:
-        logger.debug(f'Fetching last ID value from bigquery')
-        id = list(list(next(rows.pages))[0])[0]
+        logger.debug(f'Fetching last ID value from {table}')
+        id = row[0]
         logger.debug(f'ID is {id}')
 
         return _get_logs(id), id
@@ -100,6 +223,6 @@ def mark_last_fetch_id(id, event_count, table):
     stamp = datetime.now(tz=timezone.utc)
 
     if (event_count == 0):
-        insert_rows([[id, False, stamp]], table)
+        store().mark(table, [id, False, stamp])
     else:
-        insert_rows([[id, True, stamp]], table)
+        store().mark(table, [id, True, stamp])
@@ -1,3 +1,87 @@
+import queue
+import threading
+
+
 def partition(l, n):
     for i in range(0, len(l), n):
         yield l[i:i + n]
+
+
+def partition_by_size(items, max_bytes, max_count, size=len):
+    """Lazily packs items into batches of up to max_bytes (by size) and max_count items,
+       a single item larger than max_bytes is yielded as its own batch"""
+    batch = []
+    total = 0
+    for item in items:
+        item_size = size(item)
+        if (batch and
+            (total + item_size > max_bytes or len(batch) >= max_count)):
+            yield batch
+            batch = []
+            total = 0
+
+        batch.append(item)
+        total += item_size
+
+    if (batch):
+        yield batch
+
+
+class _Failed:
+    def __init__(self, error):
+        self.error = error
+
+
+_DONE = object()
+
+
+def prefetch_all(iterables, size):
+    """Lazily iterates over the items of several iterables, each from its own background thread
+       (up to size items ahead of the consumer, in the order they are produced), errors are raised
+       to the consumer"""
+    items = queue.Queue(maxsize=size)
+    stopped = threading.Event()
+
+    def put(item):
+        # Giving up when the consumer stopped iterating
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce(iterable):
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put(_DONE)
+        except BaseException as e:
+            put(_Failed(e))
+
+    remaining = 0
+    for iterable in iterables:
+        threading.Thread(target=produce, args=(iterable, ),
+                         daemon=True).start()
+        remaining += 1
+
+    try:
+        while remaining > 0:
+            item = items.get()
+            if item is _DONE:
+                remaining -= 1
+            elif isinstance(item, _Failed):
+                raise item.error
+            else:
+                yield item
+    finally:
+        stopped.set()
+
+
+def prefetch(iterable, size):
+    """Lazily iterates over iterable from a background thread (up to size items ahead of the consumer),
+       so producing the next item (fetching a page) overlaps with consuming the current one (publishing),
+       errors are raised to the consumer"""
+    return prefetch_all([iterable], size)
@@ -1,11 +1,38 @@
 from secops_common.misc import is_function
+from secops_common.logsetup import logger
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache.base import Cache
+
+from pipeline.common.config import CONFIG
+
+import requests
+import click
 
 # local token
 import os.path
 
+import json
+import time
+import hashlib
+import tempfile
+import threading
+import functools
+
+# Discovery documents shipped with the pipeline, parsed instead of downloaded on cold starts
+DISCOVERY_DIR = os.path.join(os.path.dirname(__file__), 'discovery')
+
+DISCOVERY_URI = 'https://www.googleapis.com/discovery/v1/apis/{api}/{version}/rest'
+
+# Downloaded discovery documents (of apis which aren't bundled) are kept on disk for this many seconds
+DISCOVERY_CACHE_DIR = CONFIG.get(
+    'google_discovery_cache_dir',
+    os.path.join(tempfile.gettempdir(), 'google_discovery'))
+
+DISCOVERY_CACHE_TTL = CONFIG.get('google_discovery_ttl', 86400)
+
 
 def creds(scopes):
     # We use a service account
@@ -32,3 +59,130 @@ def creds(scopes):
             token.write(creds.to_json())
 
     return creds
+
+
+class DiscoveryCache(Cache):
+    """Discovery documents by url, in memory and on disk (shared by the instances of a host)"""
+    def __init__(self, directory=DISCOVERY_CACHE_DIR, ttl=DISCOVERY_CACHE_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        self.memory = {}
+        self.lock = threading.Lock()
+
+    def _path(self, url):
+        name = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, f'{name}.json')
+
+    def get(self, url):
+        with self.lock:
+            if url in self.memory:
+                return self.memory[url]
+
+        path = self._path(url)
+        try:
+            if (time.time() - os.path.getmtime(path) > self.ttl):
+                return None
+            with open(path, 'r') as f:
+                content = f.read()
+        except OSError:
+            return None
+
+        with self.lock:
+            self.memory[url] = content
+        return content
+
+    def set(self, url, content):
+        if isinstance(content, bytes):
+            content = content.decode('utf-8')
+        with self.lock:
+            self.memory[url] = content
+
+        path = self._path(url)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Written aside and renamed so concurrent readers never see a partial document
+            with open(f'{path}.tmp', 'w') as f:
+                f.write(content)
+            os.replace(f'{path}.tmp', path)
+        except OSError as e:
+            logger.warning(
+                f'Failed to cache discovery document {url} due to {e}')
+
+
+@functools.lru_cache(maxsize=None)
+def discovery_cache():
+    return DiscoveryCache()
+
+
+def bundled_path(api, version):
+    return os.path.join(DISCOVERY_DIR, f'{api}.{version}.json')
+
+
+@functools.lru_cache(maxsize=None)
+def bundled_document(api, version):
+    """The bundled discovery document or None"""
+    path = bundled_path(api, version)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def _build(api, version, credentials):
+    document = bundled_document(api, version)
+    if (document != None):
+        logger.debug(f'Building {api} {version} from its bundled document')
+        return build_from_document(document, credentials=credentials)
+
+    if (is_function() == True):
+        # Deployed packages must not download documents on each cold start
+        raise Exception(
+            f'No bundled discovery document for {api} {version} at {bundled_path(api, version)}, run python -m pipeline.common.google bundle --api {api} --version {version} before deploying'
+        )
+
+    logger.warning(
+        f'No bundled discovery document for {api} {version}, downloading it')
+    return build(api,
+                 version,
+                 credentials=credentials,
+                 cache=discovery_cache())
+
+
+_services = {}
+
+_services_lock = threading.Lock()
+
+
+def service(api, version, credentials=None, subject=None):
+    """A service object per api, version and credentials subject, built once per process (credentials
+       is a function, only called when the service is built)"""
+    key = (api, version, subject)
+    with _services_lock:
+        if key not in _services:
+            _services[key] = _build(api, version,
+                                    credentials() if credentials else None)
+        return _services[key]
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.option("--api", required=True)
+@click.option("--version", required=True)
+def bundle(api, version):
+    """Downloads a discovery document into the bundled documents"""
+    response = requests.get(DISCOVERY_URI.format(api=api, version=version))
+    response.raise_for_status()
+    os.makedirs(DISCOVERY_DIR, exist_ok=True)
+    # Validating the document before writing it as published
+    response.json()
+    with open(bundled_path(api, version), 'w') as f:
+        f.write(response.text)
+    logger.info(f'Bundled {api} {version} into {bundled_path(api, version)}')
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,51 @@
+""" Keep-alive HTTP sessions shared within a run and across warm function invocations """
+
+import functools
+from urllib.parse import urlparse
+
+import requests
+from urllib3.util.retry import Retry
+from requests.adapters import HTTPAdapter
+
+from pipeline.common.config import CONFIG
+
+# Per host connection pool sizes, for example {'api.atlassian.com': 4}
+POOL_SIZES = CONFIG.get('http_pool_sizes', {})
+
+DEFAULT_POOL_SIZE = 10
+
+
+def pool_size(host):
+    return POOL_SIZES.get(host, DEFAULT_POOL_SIZE)
+
+
+@functools.lru_cache(maxsize=None)
+def adapter(host, size, methods, raise_on_status):
+    """A single (cached) connection pool per host and settings, shared between sessions"""
+    retries = Retry(total=5,
+                    backoff_factor=0.1,
+                    status_forcelist=[500, 502, 503, 504],
+                    method_whitelist=list(methods),
+                    raise_on_status=raise_on_status)
+
+    return HTTPAdapter(max_retries=retries,
+                       pool_connections=1,
+                       pool_maxsize=max(size, pool_size(host)))
+
+
+def mount(http, url, size=0, methods=('GET', 'POST'), raise_on_status=False):
+    host = urlparse(url).netloc
+    http.mount(f'https://{host}/',
+               adapter(host, size, tuple(methods), raise_on_status))
+    return http
+
+
+@functools.lru_cache(maxsize=None)
+def _session(host):
+    return mount(requests.Session(), f'https://{host}/')
+
+
+def session(url):
+    """The shared keep-alive session of the url host (failed responses are returned
+       once retries are exhausted, like a bare requests call)"""
+    return _session(urlparse(url).netloc)
@@ -0,0 +1,197 @@
+""" Parallel, resumable ingest of large NDJSON (or gzipped NDJSON) files into Splunk """
+
+import os
+import gzip
+import mmap
+import json
+import time
+import functools
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from secops_common.logsetup import logger
+
+from pipeline.common.config import CONFIG
+from pipeline.common.splunk import publish_all, retryable
+
+# Worker processes parsing and publishing ranges
+INGEST_PROCESSES = CONFIG.get('ingest_processes', os.cpu_count())
+
+# Files are split into ranges of about this many bytes (ending on a line boundary)
+INGEST_RANGE_BYTES = CONFIG.get('ingest_range_bytes', 64 * 1024 * 1024)
+
+
+def line_ranges(path, range_bytes):
+    """Splits a file into (start, end) byte ranges of about range_bytes, each ending on a line boundary"""
+    size = os.path.getsize(path)
+    ranges = []
+    if (size == 0):
+        return ranges
+
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(),
+                                          0,
+                                          access=mmap.ACCESS_READ) as m:
+        start = 0
+        while start < size:
+            end = m.find(b'\n', min(start + range_bytes, size) - 1)
+            end = size if end == -1 else end + 1
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def gzip_ranges(path, range_bytes):
+    """Gzipped files can't be mapped, yields (start, end, data) line aligned ranges of the uncompressed stream"""
+    start = 0
+    with gzip.open(path, 'rb') as f:
+        while True:
+            data = f.read(range_bytes)
+            if not data:
+                return
+            data += f.readline()
+            yield start, start + len(data), data
+            start += len(data)
+
+
+class Offsets:
+    """The completed ranges of a file, persisted next to it so an interrupted ingest resumes where it stopped"""
+    def __init__(self, path, range_bytes):
+        self.path = f'{path}.offsets'
+        self.key = {'size': os.path.getsize(path), 'range_bytes': range_bytes}
+        self.completed = set()
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                saved = json.load(f)
+            if all(saved.get(k) == v for k, v in self.key.items()):
+                self.completed = set(map(tuple, saved['completed']))
+                logger.info(
+                    f'Resuming from {self.path}, {len(self.completed)} ranges already ingested'
+                )
+            else:
+                logger.warning(
+                    f'Ignoring {self.path} which was written for a different file size or range size'
+                )
+
+    def done(self, start, end):
+        self.completed.add((start, end))
+        # Written aside and renamed so an interruption never leaves a partial offsets file
+        with open(f'{self.path}.tmp', 'w') as f:
+            json.dump(dict(self.key, completed=sorted(self.completed)), f)
+        os.replace(f'{self.path}.tmp', self.path)
+
+    def committed(self):
+        """The offset every byte before has been ingested"""
+        ends = dict(self.completed)
+        offset = 0
+        while offset in ends:
+            offset = ends[offset]
+        return offset
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+@functools.lru_cache(maxsize=None)
+def _session():
+    # A Splunk session per worker process
+    return retryable()
+
+
+def _read_range(path, start, end):
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(),
+                                          0,
+                                          access=mmap.ACCESS_READ) as m:
+        return m[start:end]
+
+
+def publish_range(path, start, end, data, transform, token):
+    """Parses and publishes the events of a range (read from the file unless given), run in a worker process,
+       returns once all of them were published (and acknowledged when hec_ack is enabled)"""
+    if (data == None):
+        data = _read_range(path, start, end)
+    lines = (line for line in data.splitlines() if line.strip())
+    count = publish_all(map(transform, lines),
+                        token,
+                        http=_session(),
+                        time_field='timestamp')
+    return start, end, count
+
+
+class Throughput:
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.started = time.monotonic()
+        self.bytes = 0
+        self.events = 0
+
+    def update(self, start, end, count):
+        self.bytes += end - start
+        self.events += count
+
+    def log(self, committed):
+        elapsed = max(time.monotonic() - self.started, 0.001)
+        of = f' of {self.size}' if self.size != None else ''
+        logger.info(
+            f'{self.path}: {self.events} events, {self.bytes}{of} bytes in {elapsed:.0f}s '
+            f'({self.events / elapsed:.0f} events/s, {self.bytes / elapsed / 1024**2:.1f} MB/s), committed offset {committed}'
+        )
+
+
+def ingest(path,
+           transform,
+           token,
+           processes=INGEST_PROCESSES,
+           range_bytes=INGEST_RANGE_BYTES):
+    """Publishes the events of an NDJSON file (.gz files are decompressed) using a process pool,
+       transform turns a line into an event with a timestamp (a module level function or a partial of one),
+       returns the number of events published"""
+    offsets = Offsets(path, range_bytes)
+    if (path.endswith('.gz')):
+        ranges = gzip_ranges(path, range_bytes)
+        throughput = Throughput(path, None)
+    else:
+        ranges = ((start, end, None)
+                  for start, end in line_ranges(path, range_bytes))
+        throughput = Throughput(path, os.path.getsize(path))
+
+    failures = []
+
+    def collect(done):
+        for future in done:
+            try:
+                start, end, count = future.result()
+                # Only committed once Splunk confirmed the range (see publish_range)
+                offsets.done(start, end)
+                throughput.update(start, end, count)
+            except Exception as e:
+                logger.error(f'Failed to ingest a range of {path} due to {e}')
+                failures.append(e)
+        throughput.log(offsets.committed())
+
+    pending = set()
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for start, end, data in ranges:
+            if ((start, end) in offsets.completed):
+                continue
+            if (failures):
+                break
+            pending.add(
+                executor.submit(publish_range, path, start, end, data,
+                                transform, token))
+            # Bounding the ranges in flight (and held in memory for gzipped files)
+            if (len(pending) >= processes * 2):
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+
+        if (pending):
+            done, _ = wait(pending)
+            collect(done)
+
+    if (failures):
+        raise Exception(
+            f'Failed to ingest {path} due to {failures[0]}, rerun to resume from offset {offsets.committed()}'
+        )
+
+    offsets.remove()
+    return throughput.events
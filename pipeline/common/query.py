@@ -0,0 +1,90 @@
+""" Streaming BigQuery query results a page at a time, over the Storage Read API when it is installed """
+
+import functools
+import importlib.util
+from functools import partial
+
+from google.cloud import bigquery
+
+from secops_common.logsetup import logger
+
+from pipeline.common.config import CONFIG
+from pipeline.common.functional import prefetch, prefetch_all
+from pipeline.common.time import unix_time_millis
+
+# Large results are read as Arrow record batches over the Storage Read API (google-cloud-bigquery-storage and pyarrow)
+STORAGE_API = CONFIG.get('bigquery_storage_api', True) and all(
+    importlib.util.find_spec(name) != None
+    for name in ['google.cloud.bigquery_storage', 'pyarrow'])
+
+# Storage Read API streams read in parallel
+READ_STREAMS = CONFIG.get('bigquery_read_streams', 4)
+
+# Rows per page and pages read ahead of the consumer (per stream)
+PAGE_SIZE = CONFIG.get('bigquery_page_size', 10000)
+
+PREFETCH_PAGES = CONFIG.get('bigquery_prefetch_pages', 2)
+
+
+@functools.lru_cache(maxsize=None)
+def client():
+    return bigquery.Client()
+
+
+@functools.lru_cache(maxsize=None)
+def read_client():
+    from google.cloud import bigquery_storage
+    return bigquery_storage.BigQueryReadClient()
+
+
+def _row_page(millis, page):
+    rows = list(map(dict, page))
+    for row in rows:
+        for field in millis:
+            row[field] = unix_time_millis(row[field])
+    return rows
+
+
+def _arrow_page(millis, batch):
+    """Converts the millis timestamp columns of a record batch at once before turning it into rows"""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    table = pa.Table.from_batches([batch])
+    for field in millis:
+        i = table.schema.get_field_index(field)
+        column = pc.cast(table.column(i),
+                         pa.timestamp('ms', tz='UTC'),
+                         safe=False).cast(pa.int64())
+        table = table.set_column(i, field, column)
+    return table.to_pylist()
+
+
+def _storage_pages(table, millis):
+    from google.cloud.bigquery_storage import types
+    session = read_client().create_read_session(
+        parent=f'projects/{client().project}',
+        read_session=types.ReadSession(table=table.to_bqstorage(),
+                                       data_format=types.DataFormat.ARROW),
+        max_stream_count=READ_STREAMS)
+    logger.debug(f'Reading {table} over {len(session.streams)} streams')
+
+    def stream_pages(stream):
+        reader = read_client().read_rows(stream.name)
+        for page in reader.rows(session).pages:
+            yield _arrow_page(millis, page.to_arrow())
+
+    return prefetch_all(map(stream_pages, session.streams),
+                        PREFETCH_PAGES * max(1, len(session.streams)))
+
+
+def query_pages(query, job_config=None, millis=()):
+    """Yields the query result a page (list of row dicts) at a time with the millis timestamp fields
+       converted, only the pages read ahead are held in memory"""
+    job = client().query(query, job_config=job_config)
+    rows = job.result(page_size=PAGE_SIZE)
+    logger.debug(f'Total of {rows.total_rows} rows to be read')
+    if (STORAGE_API and rows.total_rows > PAGE_SIZE):
+        return _storage_pages(job.destination, millis)
+
+    return prefetch(map(partial(_row_page, millis), rows.pages),
+                    PREFETCH_PAGES)
@@ -0,0 +1,107 @@
+""" Secret Manager reads cached in process with a TTL, refreshed in the background before they expire """
+
+import time
+import threading
+
+from secops_common.logsetup import logger
+from secops_common.secrets import read_config as _read_config
+
+from pipeline.common.config import CONFIG
+
+# Seconds a secret is served from memory before it is read again
+SECRETS_TTL = CONFIG.get('secrets_ttl', 3600)
+
+# Secrets read within this many seconds of expiring are refreshed in the background
+SECRETS_REFRESH_AHEAD = CONFIG.get('secrets_refresh_ahead', 300)
+
+# (project_id, name) -> (value, expires at)
+_cache = {}
+
+_lock = threading.Lock()
+
+_key_locks = {}
+
+_refreshing = set()
+
+counters = {'hits': 0, 'misses': 0, 'refreshes': 0, 'refresh_errors': 0}
+
+
+def _key_lock(key):
+    with _lock:
+        return _key_locks.setdefault(key, threading.Lock())
+
+
+def _store(key, value):
+    with _lock:
+        _cache[key] = (value, time.monotonic() + SECRETS_TTL)
+
+
+def _refresh(key):
+    try:
+        _store(key, _read_config(*key))
+        with _lock:
+            counters['refreshes'] += 1
+    except Exception as e:
+        # The cached value stays valid until it expires, the next read will block and retry
+        logger.warning(f'Failed to refresh secret {key[1]} due to {e}')
+        with _lock:
+            counters['refresh_errors'] += 1
+    finally:
+        with _lock:
+            _refreshing.discard(key)
+
+
+def _cached(key):
+    """Returns the cached value or None, starting a background refresh when it is close to expiry"""
+    now = time.monotonic()
+    with _lock:
+        entry = _cache.get(key)
+        if (entry == None or now >= entry[1]):
+            return None
+
+        counters['hits'] += 1
+        value, expires = entry
+        if (now >= expires - SECRETS_REFRESH_AHEAD and key not in _refreshing):
+            _refreshing.add(key)
+            threading.Thread(target=_refresh, args=(key, ),
+                             daemon=True).start()
+
+    return value
+
+
+def read_config(project_id, name):
+    """Drop in replacement for secops_common.secrets.read_config"""
+    key = (project_id, name)
+    value = _cached(key)
+    if (value != None):
+        return value
+
+    # A single Secret Manager read per secret when concurrent callers miss together
+    with _key_lock(key):
+        value = _cached(key)
+        if (value != None):
+            return value
+
+        with _lock:
+            counters['misses'] += 1
+        value = _read_config(project_id, name)
+        _store(key, value)
+        return value
+
+
+def invalidate(project_id=None, name=None):
+    """Drops cached secrets (all of them when no name is given), used after a secret rotation"""
+    with _lock:
+        for key in list(_cache):
+            if ((project_id == None or key[0] == project_id)
+                    and (name == None or key[1] == name)):
+                del _cache[key]
+
+
+def stats():
+    with _lock:
+        return dict(counters, cached=len(_cache))
+
+
+def log_stats():
+    logger.info(f'Secrets cache {stats()}')
@@ -7,29 +7,58 @@ from secops_common.logsetup import logger
 from secops_common.misc import serialize
 from functools import partial
 import json
+import gzip
 import click
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
 
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 # Fixing warning message see https://stackoverflow.com/questions/27981545/suppress-insecurerequestwarning-unverified-https-request-is-being-made-in-python
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
 from pipeline.common.config import CONFIG
+from pipeline.common.functional import partition_by_size
+from pipeline.common.http import mount
 
 company = CONFIG['company']
 
 SPLUNK_HEC_URL = f'https://http-inputs.{company}.splunkcloud.com/services/collector/event'
 
+SPLUNK_HEC_ACK_URL = f'https://http-inputs.{company}.splunkcloud.com/services/collector/ack'
+
 APP = 'INFOSEC-app'
 
 SPLUNK_REST_URL = f'https://{company}.splunkcloud.com:8089/servicesNS/nobody/{APP}/'
 
+# Opt-in gzip compression of HEC payloads (None disables it), see
+# https://docs.splunk.com/Documentation/Splunk/latest/Data/FormateventsforHTTPEventCollector
+HEC_COMPRESS_LEVEL = CONFIG.get('hec_compress_level')
+
+# HEC batch limits, the byte budget is measured on the raw (uncompressed) payload
+# and should stay under the HEC max_content_length
+HEC_MAX_BYTES = CONFIG.get('hec_max_bytes', 1000000)
+HEC_MAX_EVENTS = CONFIG.get('hec_max_events', 5000)
+
+# Number of HEC batches a Publisher sends concurrently
+HEC_MAX_IN_FLIGHT = CONFIG.get('hec_max_in_flight', 4)
+
+# Indexer acknowledgement (requires the HEC tokens to have it enabled), see
+# https://docs.splunk.com/Documentation/Splunk/latest/Data/AboutHECIDXAck
+HEC_ACK = CONFIG.get('hec_ack', False)
+HEC_ACK_INTERVAL = CONFIG.get('hec_ack_interval', 5)
+HEC_ACK_TIMEOUT = CONFIG.get('hec_ack_timeout', 300)
+
 
 def logging_hook(response, *args, **kwargs):
     if (response.status_code != 200):
         logger.info(f'{response.status_code}')
 
 
-def retryable():
+def retryable(compress_level=HEC_COMPRESS_LEVEL, pool_size=10):
+    """A new session (holding its own publishing settings and byte counters) on top of
+       the shared keep-alive connection pools of the Splunk endpoints"""
     http = requests.Session()
     http.hooks["response"] = [logging_hook]
     retries = Retry(total=5,
@@ -38,9 +67,43 @@ def retryable():
                     method_whitelist=['POST'])
 
     http.mount('https://', HTTPAdapter(max_retries=retries))
+    for url in [SPLUNK_HEC_URL, SPLUNK_REST_URL]:
+        mount(http,
+              url,
+              size=pool_size,
+              methods=('POST', 'DELETE'),
+              raise_on_status=True)
+
+    # Publishing settings and byte counters (see publish)
+    http.compress_level = compress_level
+    http.raw_bytes = 0
+    http.sent_bytes = 0
+    http.counters_lock = threading.Lock()
     return http
 
 
+def encode_payload(payload, compress_level=None):
+    raw = str.encode(payload)
+    if (compress_level == None):
+        return raw, raw, {}
+    else:
+        compressed = gzip.compress(raw, compresslevel=int(compress_level))
+        return raw, compressed, {'Content-Encoding': 'gzip'}
+
+
+def byte_counts(http):
+    """Total raw and sent (possibly compressed) bytes published using this session"""
+    return getattr(http, 'raw_bytes', 0), getattr(http, 'sent_bytes', 0)
+
+
+def log_byte_counts(http, name):
+    raw, sent = byte_counts(http)
+    if (raw > 0):
+        logger.info(
+            f'{name} published {raw} raw bytes as {sent} bytes ({sent / raw:.1%})'
+        )
+
+
 def get_clear_sourcetype(record, sourcetype_field):
     #grabs the sourcetype value and unsets it in the record to be then set in event metadata
     if (sourcetype_field):
@@ -63,20 +126,238 @@ def into_event(time_field, sourcetype_field, record):
     return json.dumps(event)
 
 
+def into_events(events, time_field=None, sourcetype_field=None):
+    return map(partial(into_event, time_field, sourcetype_field), events)
+
+
+def hec_batches(events,
+                time_field=None,
+                sourcetype_field=None,
+                max_bytes=HEC_MAX_BYTES,
+                max_count=HEC_MAX_EVENTS):
+    """Lazily serializes events (list or generator) into batches bounded by bytes and count"""
+    return partition_by_size(into_events(events, time_field, sourcetype_field),
+                             max_bytes, max_count)
+
+
+def publish_batch(http, batch, token, channel=None):
+    """Publishes a batch of already serialized events (see hec_batches),
+       returns the batch ack id when published using a channel"""
+    raw, data, encoding = encode_payload(''.join(batch),
+                                         getattr(http, 'compress_level', None))
+    authHeader = {'Authorization': f'Splunk {token}', **encoding}
+    if (channel != None):
+        authHeader['X-Splunk-Request-Channel'] = channel
+    logger.debug(
+        f'payload consists of {len(batch)} events, {len(raw)} raw bytes sent as {len(data)} bytes'
+    )
+
+    r = http.post(SPLUNK_HEC_URL, headers=authHeader, data=data, verify=False)
+
+    if (r.status_code != 200):
+        raise Exception(
+            f'failed to persist event to Splunk HEC endpoint {r.status_code}')
+
+    if (hasattr(http, 'counters_lock')):
+        with http.counters_lock:
+            http.raw_bytes += len(raw)
+            http.sent_bytes += len(data)
+
+    if (channel != None):
+        return r.json()['ackId']
+
+
 def publish(http, events, token, time_field=None, sourcetype_field=None):
-    authHeader = {'Authorization': f'Splunk {token}'}
-    payload = ''.join(
-        list(map(partial(into_event, time_field, sourcetype_field), events)))
-    logger.debug(f'payload consists of {len(events)} events')
-
-    r = http.post(SPLUNK_HEC_URL,
-                  headers=authHeader,
-                  data=str.encode(payload),
+    return publish_batch(
+        http, list(into_events(events, time_field, sourcetype_field)), token)
+
+
+def publish_all(events, token, name=None, http=None, **batch_kwargs):
+    """Publishes events (list or generator) in hec_batches (see batch_kwargs) using a Publisher,
+       logging the published bytes under name, returns the number of published events"""
+    with Publisher(token, http=http) as publisher:
+        for batch in hec_batches(events, **batch_kwargs):
+            publisher.submit(batch)
+    if (name != None):
+        log_byte_counts(publisher.http, name)
+    return publisher.events
+
+
+def query_acks(http, token, channel, ack_ids):
+    """Returns the subset of ack_ids which were indexed"""
+    headers = {
+        'Authorization': f'Splunk {token}',
+        'X-Splunk-Request-Channel': channel
+    }
+    r = http.post(SPLUNK_HEC_ACK_URL,
+                  headers=headers,
+                  json={'acks': list(ack_ids)},
                   verify=False)
 
     if (r.status_code != 200):
         raise Exception(
-            f'failed to persist event to Splunk HEC endpoint {r.status_code}')
+            f'failed to query Splunk HEC acknowledgements {r.status_code}')
+
+    acks = r.json()['acks']
+    return set(
+        map(int, filter(lambda ack_id: acks[ack_id] == True, acks.keys())))
+
+
+class Acknowledger:
+    """Polls indexer acknowledgements of a HEC channel in the background,
+       batching all the pending ack ids into a single request per interval"""
+    def __init__(self, http, token, channel, interval=HEC_ACK_INTERVAL):
+        self.http = http
+        self.token = token
+        self.channel = channel
+        self.interval = interval
+        self.pending = set()
+        self.acked = 0
+        self.error = None
+        self.closed = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._poll, daemon=True)
+        self.thread.start()
+
+    def add(self, ack_id):
+        with self.condition:
+            self.pending.add(ack_id)
+            self.condition.notify_all()
+
+    def _poll(self):
+        while True:
+            with self.condition:
+                while (not self.closed and not self.pending):
+                    self.condition.wait()
+                if (self.closed):
+                    return
+                ack_ids = set(self.pending)
+
+            time.sleep(self.interval)
+            try:
+                indexed = query_acks(self.http, self.token, self.channel,
+                                     ack_ids)
+            except Exception as e:
+                logger.info(f'failed to poll HEC acknowledgements due to {e}')
+                indexed = set()
+
+            with self.condition:
+                self.pending -= indexed
+                self.acked += len(indexed)
+                self.condition.notify_all()
+
+    def wait(self, timeout=HEC_ACK_TIMEOUT):
+        """Blocks until all the pending batches were indexed (or timeout is reached)"""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while (self.pending):
+                remaining = deadline - time.monotonic()
+                if (remaining <= 0):
+                    raise Exception(
+                        f'{len(self.pending)} HEC batches were not acknowledged by Splunk within {timeout} seconds'
+                    )
+                self.condition.wait(remaining)
+
+        logger.debug(f'Total of {self.acked} HEC batches acknowledged')
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class Publisher:
+    """Publishes batches (see hec_batches) concurrently over a shared pooled session,
+       submit blocks once max_in_flight batches are pending and the first failure
+       is raised back on the next submit/flush/close.
+
+       With ack enabled flush/close also wait for Splunk to acknowledge that all the
+       batches were indexed, callers should only move their checkpoint after that"""
+    def __init__(self,
+                 token,
+                 http=None,
+                 max_in_flight=HEC_MAX_IN_FLIGHT,
+                 ack=HEC_ACK):
+        self.token = token
+        self.http = http if http != None else retryable(
+            pool_size=max_in_flight + 1)
+        if (ack):
+            self.channel = str(uuid.uuid4())
+            self.acknowledger = Acknowledger(self.http, token, self.channel)
+        else:
+            self.channel = None
+            self.acknowledger = None
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.error = None
+        self.events = 0
+
+    def _publish(self, batch):
+        try:
+            ack_id = publish_batch(self.http, batch, self.token, self.channel)
+            if (self.acknowledger != None):
+                self.acknowledger.add(ack_id)
+        finally:
+            self.slots.release()
+
+    def _done(self, future):
+        with self.lock:
+            self.pending.discard(future)
+            if (self.error == None and not future.cancelled()
+                    and future.exception() != None):
+                self.error = future.exception()
+
+    def _raise_error(self):
+        if (self.error != None):
+            raise Exception(
+                f'failed to publish batch into Splunk HEC: {self.error}'
+            ) from self.error
+
+    def submit(self, batch):
+        self._raise_error()
+        self.slots.acquire()
+        future = self.executor.submit(self._publish, batch)
+        with self.lock:
+            self.pending.add(future)
+            self.events += len(batch)
+        future.add_done_callback(self._done)
+        return future
+
+    def flush(self):
+        """Waits for all the submitted batches to be published"""
+        with self.lock:
+            pending = list(self.pending)
+        wait(pending)
+        self._raise_error()
+        if (self.acknowledger != None):
+            self.acknowledger.wait()
+
+    def _shutdown(self):
+        self.executor.shutdown(wait=True)
+        if (self.acknowledger != None):
+            self.acknowledger.close()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if (exc_type == None):
+            self.close()
+        else:
+            # Failing fast, the original error is the one worth raising
+            with self.lock:
+                pending = list(self.pending)
+            for future in pending:
+                future.cancel()
+            self._shutdown()
 
 
 # See https://dev.splunk.com/enterprise/docs/developapps/manageknowledge/kvstore/usetherestapitomanagekv/
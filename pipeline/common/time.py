@@ -1,12 +1,73 @@
-from datetime import datetime
-import pytz
+from datetime import datetime, timedelta, timezone
+import functools
+
+from dateutil import parser
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+MILLISECOND = timedelta(milliseconds=1)
+
+# strptime formats datetime.fromisoformat parses (much faster), values it rejects fall back to strptime
+ISO_FORMATS = {
+    '%Y-%m-%d',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%dT%H:%M:%SZ',
+    '%Y-%m-%dT%H:%M:%S.%f',
+    '%Y-%m-%dT%H:%M:%S.%fZ',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%d %H:%M:%S.%f',
+}
 
 
 def unix_time_millis(dt):
-    epoch = datetime.utcfromtimestamp(0)
-    aware = pytz.utc.localize(epoch)
-    return int((dt - aware).total_seconds() * 1000.0)
+    return (dt - EPOCH) // MILLISECOND
 
 
 def microseconds(dt):
     return int(unix_time_millis(dt) * 1000.0)
+
+
+def _fromisoformat(value):
+    # Z suffixes are only accepted from Python 3.11
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    return datetime.fromisoformat(value)
+
+
+def parse_datetime(value, fmt=None):
+    """Parses an ISO-8601 string (any format dateutil understands) or a string in the strptime format"""
+    if (fmt == None or fmt in ISO_FORMATS):
+        try:
+            return _fromisoformat(value)
+        except ValueError:
+            pass
+
+    if (fmt != None):
+        return datetime.strptime(value, fmt)
+    return parser.parse(value)
+
+
+@functools.lru_cache(maxsize=4096)
+def _utcoffset(tz, year, month, day, hour):
+    # Timezone offsets change on the hour, a single lookup per local hour
+    local = datetime(year, month, day, hour)
+    if hasattr(tz, 'localize'):
+        # pytz, ambiguous and non existent times raise
+        return tz.localize(local, is_dst=None).utcoffset()
+    return local.replace(tzinfo=tz).utcoffset()
+
+
+def local_millis(dt, tz):
+    """The millis of a naive datetime in tz"""
+    if (tz == timezone.utc):
+        return unix_time_millis(dt.replace(tzinfo=timezone.utc))
+    offset = _utcoffset(tz, dt.year, dt.month, dt.day, dt.hour)
+    return unix_time_millis(dt.replace(tzinfo=timezone.utc) - offset)
+
+
+def parse_millis(value, fmt=None, tz=timezone.utc):
+    """The millis of an ISO-8601 (or strptime fmt) string, times without an offset are taken in tz"""
+    dt = parse_datetime(value, fmt)
+    if (dt.tzinfo == None):
+        return local_millis(dt, tz)
+    return unix_time_millis(dt)
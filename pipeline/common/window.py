@@ -2,9 +2,14 @@
 
 from datetime import datetime, timedelta, timezone
 
-# Bigquery
-import pipeline.common.bigquery
-from secops_common.bigquery import latest_rows, get_table, insert_rows
+# Checkpoints
+from pipeline.common.checkpoint import store
+from pipeline.common.fetch import sub_windows
+from pipeline.common.splunk import publish_all
+
+from pipeline.common.config import CONFIG
+
+import time
 
 from secops_common.logsetup import logger
 
@@ -19,27 +24,103 @@ def last_n_minutes(n, _get_logs, tz=timezone.utc):
     return _get_logs(start, end), start, end
 
 
-def last_from_persisted_windowed(_get_logs, table):
-    # Making sure table is set
-    get_table(table)
-    rows = latest_rows(table)
+def persisted_window(table):
+    row = store().latest(table)
     # Fetching for the very first time (no prior state)
-    if rows.total_rows == 0:
-        return last_n_minutes(5, _get_logs)
+    if row == None:
+        end = datetime.now(tz=timezone.utc)
+        return end - timedelta(minutes=5), end
     else:
-        logger.debug(f'Fetching last start/end values from bigquery')
-        start, end, status, _ = tuple(list(next(rows.pages))[0])
+        logger.debug(f'Fetching last start/end values from {table}')
+        start, end, status, _ = row
         logger.debug(f'Date range is {start} - {end}')
-        return _get_logs(start, end), start, end
+        return start, end
+
+
+def last_from_persisted_windowed(_get_logs, table):
+    start, end = persisted_window(table)
+    return _get_logs(start, end), start, end
 
 
 def mark_last_fetch_windowed(start, event_count, last_event_date, table):
     stamp = datetime.now(tz=timezone.utc)
     # No events found (yet) moving end to current time
     if (event_count == 0):
-        insert_rows([[start, stamp, False, stamp]], table)
+        store().mark(table, [start, stamp, False, stamp])
     # Events found, window is moving ahead
     else:
         # Making the next fetch non inclusive adding one mili second
-        plus_1 = last_event_date + 1
-        insert_rows([[plus_1, stamp, True, stamp]], table)
+        plus_1 = datetime.fromtimestamp(last_event_date + 1, tz=timezone.utc)
+        store().mark(table, [plus_1, stamp, True, stamp])
+
+
+# Windows longer than this are fetched in consecutive sub windows, checkpointed as they are published
+CHECKPOINT_WINDOW = timedelta(
+    minutes=CONFIG.get('checkpoint_window_minutes', 60))
+
+# Minimal number of seconds between checkpoint writes within a window
+CHECKPOINT_MIN_INTERVAL = CONFIG.get('checkpoint_min_interval', 60)
+
+
+def publish_windowed(_get_logs, _publish_logs, table, step=CHECKPOINT_WINDOW):
+    """Publishes the persisted window oldest sub window (of step) first, moving the checkpoint past the
+       latest published event as sub windows complete (so a run that is cut short doesn't start over),
+       the window is marked as a whole at the end. Returns the window Watermark, start and end"""
+    start, end = persisted_window(table)
+    watermark = Watermark(None)
+    written = time.monotonic()
+    for sub_start, sub_end in sub_windows(start, end, step):
+        watermark.update(_publish_logs(_get_logs(sub_start, sub_end)))
+        if (watermark.count > 0 and sub_end < end
+                and time.monotonic() - written >= CHECKPOINT_MIN_INTERVAL):
+            logger.debug(f'Moving {table} checkpoint up to {sub_end}')
+            mark_last_fetch_windowed(start, watermark.count,
+                                     watermark.last_date(), table)
+            written = time.monotonic()
+
+    mark_last_fetch_windowed(start, watermark.count, watermark.last_date(),
+                             table)
+    return watermark, start, end
+
+
+class Watermark:
+    """Counts events and tracks the latest event time (millis) of a lazily consumed
+       stream, used as map(watermark, events) in front of the publisher"""
+    def __init__(self, fn_time):
+        self.fn_time = fn_time
+        self.count = 0
+        self.last = None
+
+    def __call__(self, event):
+        stamp = self.fn_time(event)
+        self.count += 1
+        if (self.last == None or stamp > self.last):
+            self.last = stamp
+        return event
+
+    def update(self, other):
+        """Adds the events tracked by another watermark"""
+        self.count += other.count
+        if (other.last != None
+                and (self.last == None or other.last > self.last)):
+            self.last = other.last
+
+    def last_date(self):
+        if (self.last == None):
+            return None
+        else:
+            return self.last / 1000.0
+
+
+def publish_watermarked(logs,
+                        token,
+                        name,
+                        with_time=None,
+                        time_field='timestamp'):
+    """Publishes the logs (lazily, with_time applied to each one) into Splunk, returning their
+       watermark, used as the _publish_logs of windowed connectors"""
+    watermark = Watermark(lambda event: event[time_field])
+    if (with_time != None):
+        logs = map(with_time, logs)
+    publish_all(map(watermark, logs), token, name, time_field=time_field)
+    return watermark
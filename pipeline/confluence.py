@@ -1,16 +1,15 @@
 #!/usr/bin/env python3
 """Confluence audit logs"""
 
-from secops_common.secrets import read_config
+from pipeline.common.secrets import read_config
 from secops_common.logsetup import logger, enable_logfile
-from pipeline.common.splunk import publish, retryable
-from pipeline.common.functional import partition
 from pipeline.common.time import unix_time_millis
-from pipeline.common.fetch import last_n_24hours, last_n_minutes, Unit, into_unit
+from pipeline.common.fetch import last_n_24hours, last_n_minutes, prefetched, Unit, into_unit
 
-from pipeline.common.window import last_from_persisted_windowed, mark_last_fetch_windowed
+from pipeline.common.window import last_from_persisted_windowed, publish_windowed, publish_watermarked
 
-import requests
+from pipeline.common.http import session
+from itertools import chain
 
 # Timestamp handling
 from datetime import datetime
@@ -58,41 +57,40 @@ def next_page(response, params):
     data = response.json()
     if ('next' in data['_links']):
         _next = data['_links']['next']
-        response = requests.get(base + _next,
-                                headers=headers,
-                                auth=(user, token),
-                                params=params)
+        response = session(base).get(base + _next,
+                                     headers=headers,
+                                     auth=(user, token),
+                                     params=params)
         return response
     else:
         return None
 
 
-def _get_logs(start, end):
-
-    logger.debug(f'Getting logs from confluence for {start} - {end}')
+def _get_pages(start, end):
+    """Lazily yields the results of each page"""
     url = base + '/rest/api/audit'
     params = {
         'startDate': unix_time_millis(start),
         'endDate': unix_time_millis(end)
     }
-    results = []
-    response = requests.get(url,
-                            headers=headers,
-                            auth=(user, token),
-                            params=params)
+    response = session(url).get(url,
+                                headers=headers,
+                                auth=(user, token),
+                                params=params)
     result = get_result(response)
     if (result != None):
-        results.extend(result)
+        yield result
 
     while (result != None):
         response = next_page(response, params)
         result = get_result(response)
         if (result != None):
-            results.extend(result)
+            yield result
 
-    logger.debug(
-        f'Total of {len(results)} logs fetched in _get_logs Confluence')
-    return results
+
+def _get_logs(start, end):
+    logger.debug(f'Getting logs from confluence for {start} - {end}')
+    return chain.from_iterable(prefetched(_get_pages(start, end)))
 
 
 def readable_date(event):
@@ -102,6 +100,13 @@ def readable_date(event):
     return event
 
 
+def _publish_logs(logs):
+    return publish_watermarked(logs,
+                               splunk_token,
+                               'Confluence',
+                               time_field='creationDate')
+
+
 def _publish_confluence_logs(num, unit):
     time_unit = into_unit(unit)
     if (int(num) > 0):
@@ -112,34 +117,19 @@ def _publish_confluence_logs(num, unit):
         elif (time_unit == Unit.minutes):
             logs, _, _ = last_n_minutes(int(num), _get_logs)
 
+        watermark = _publish_logs(logs)
+
     else:
         logger.info(
             f'Publishing Confluence logs from last persisted range using time unit of {unit}'
         )
-        logs, start, end = last_from_persisted_windowed(
-            _get_logs, 'confluence_log_fetch')
+        watermark, start, end = publish_windowed(_get_logs, _publish_logs,
+                                                 'confluence_log_fetch')
 
-    logger.info(f'Total of {len(logs)} fetched from Confluence')
-    batches = partition(logs, 50)
-    http = retryable()
-    for batch in batches:
-        publish(http, batch, splunk_token, time_field='creationDate')
-
-    if (len(logs) > 0):
+    if (watermark.count > 0):
         logger.info(
-            f'Total of {len(logs)} persisted into Splunk from Confluence')
-
-    if (int(num) < 0):
-        event_count = len(logs)
-        if (event_count > 0):
-            last_date = max(
-                list(map(lambda event: event['creationDate'], logs))) / 1000.0
-
-        else:
-            last_date = None
-
-        mark_last_fetch_windowed(start, event_count, last_date,
-                                 'confluence_log_fetch')
+            f'Total of {watermark.count} persisted into Splunk from Confluence'
+        )
 
 
 @cli.command()
@@ -168,7 +158,7 @@ def get_logs(num, unit):
         logs, start, end = last_from_persisted_windowed(
             _get_logs, 'confluence_log_fetch')
 
-    logger.info(f'Total of {len(logs)} fetched from Confluence')
+    logger.info(f'Total of {len(list(logs))} fetched from Confluence')
 
 
 if __name__ == '__main__':
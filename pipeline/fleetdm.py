@@ -1,16 +1,15 @@
 from secops_common.logsetup import logger
+import pipeline.common.bigquery
 from secops_common.bigquery import delete_table_and_view
-from secops_common.secrets import read_config
+from pipeline.common.secrets import read_config
 
 from pipeline.common.config import CONFIG
-from pipeline.common.functional import partition
-from pipeline.common.time import unix_time_millis
-from pipeline.common.splunk import publish, retryable
+from pipeline.common.time import parse_millis
+from pipeline.common.splunk import publish_all
 from pipeline.common.fetch import last_from_id, mark_last_fetch_id
 
-from datetime import datetime, timezone
 from functools import partial
-import requests
+from pipeline.common.http import session
 import uuid
 
 # UI
@@ -62,9 +61,7 @@ def from_id(result, id):
 
 # Add Splunk event metadata
 def _extras_into_event(sourcetype, batch_id, value):
-    timestamp = unix_time_millis(
-        datetime.strptime(value['created_at'],
-                          '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc))
+    timestamp = parse_millis(value['created_at'], '%Y-%m-%dT%H:%M:%SZ')
 
     value['sourcetype_override'] = sourcetype
     value['timestamp'] = timestamp
@@ -82,7 +79,7 @@ def _get_logs(id):
     index = 0
 
     url = base + endpoint.format(index=index)
-    http = retryable()
+    http = session(base)
     response = http.get(url, headers=headers)
 
     result = get_result(response)
@@ -127,12 +124,9 @@ def _publish_fleetdm_logs(id):
     events = list(
         map(partial(_extras_into_event, 'fleetdm_activity_logs', batch_id),
             logs))
-    batches = partition(events, 50)
-    http = retryable()
-    for batch in batches:
-        publish(http,
-                batch,
+    publish_all(events,
                 splunk_token,
+                'FleetDM',
                 time_field='timestamp',
                 sourcetype_field='sourcetype_override')
 
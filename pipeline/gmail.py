@@ -1,26 +1,29 @@
 #!/usr/bin/env python3
 """Google workspace logs"""
 
-from pipeline.common.time import microseconds, unix_time_millis
+from pipeline.common.time import microseconds
 
-from pipeline.common.splunk import publish, retryable
-from pipeline.common.functional import partition
-from pipeline.common.fetch import last_n_24hours, last_n_minutes, Unit, into_unit
-from pipeline.common.window import last_from_persisted_windowed, mark_last_fetch_windowed
+from pipeline.common.fetch import last_n_24hours, last_n_minutes, sub_windows, Unit, into_unit
+from pipeline.common.window import publish_windowed, publish_watermarked
 
 from secops_common.logsetup import logger, enable_logfile
 
-from secops_common.secrets import read_config
+from pipeline.common.secrets import read_config
 
 # Bigquery
 import pipeline.common.bigquery
-from secops_common.bigquery import run_query
+from pipeline.common.query import query_pages, client
+from google.cloud import bigquery
+
+from itertools import chain
+from functools import partial
 
 # UI
 import pprint
 import click
 
 import datetime
+from datetime import timedelta, timezone
 
 from pipeline.common.config import CONFIG
 
@@ -37,31 +40,92 @@ def cli():
 project = CONFIG['workspace_project']
 dataset = CONFIG['workspace_dataset']
 
+# The export activity table is partitioned by day of export (never before the event and at most the
+# export lag days after it), only the partitions of the window days (and the lag after them) are
+# scanned (set to null for unpartitioned tables)
+PARTITION_COLUMN = CONFIG.get('gmail_partition_column', '_PARTITIONTIME')
+
+EXPORT_LAG = timedelta(days=CONFIG.get('gmail_export_lag_days', 2))
+
+# The gmail record fields published
+FIELDS = CONFIG.get('gmail_fields', ['event_info', 'message_info'])
+
+# Each query scans whole partitions, a lagging window is fetched in sub windows of at least a partition
+# day (instead of checkpoint_window_minutes) so the same partitions aren't scanned by several queries
+MIN_SUB_WINDOW = timedelta(days=1)
+
+CHECKPOINT_WINDOW = max(
+    timedelta(hours=CONFIG.get('gmail_checkpoint_window_hours', 24)),
+    MIN_SUB_WINDOW)
+
+# Queries that would scan more than this fail instead of being billed
+MAXIMUM_BYTES_BILLED = CONFIG.get('gmail_maximum_bytes_billed', 10 * 1024**3)
+
+
+def partition_start(start):
+    return start.astimezone(timezone.utc).replace(hour=0,
+                                                  minute=0,
+                                                  second=0,
+                                                  microsecond=0)
+
+
+def partition_end(end):
+    """Exclusive, the day after the window end day and the export lag"""
+    return partition_start(end) + timedelta(days=1) + EXPORT_LAG
+
 
 def query(start, end):
+    """The window query and its parameters"""
     # See https://support.google.com/a/answer/7234657?product_name=UnuFlow&hl=en&visit_id=637885264241168345-3671120257&rd=1&src=supportwidget0&hl=en
     # Note the timestamp_usec has to be converted using a BQ function! (it won't work otherwise)
-    return f"""SELECT TIMESTAMP_MICROS(gmail.event_info.timestamp_usec) as timestamp, gmail.event_info, gmail.message_info FROM `{project}.{dataset}.activity` where
+    columns = ', '.join(map(lambda field: f'gmail.{field}', FIELDS))
+    parameters = [
+        bigquery.ScalarQueryParameter("start", "INT64", microseconds(start)),
+        bigquery.ScalarQueryParameter("end", "INT64", microseconds(end)),
+    ]
+    partition = ''
+    if (PARTITION_COLUMN != None):
+        partition = f'{PARTITION_COLUMN} >= @partition_start AND {PARTITION_COLUMN} < @partition_end AND'
+        parameters += [
+            bigquery.ScalarQueryParameter("partition_start", "TIMESTAMP",
+                                          partition_start(start)),
+            bigquery.ScalarQueryParameter("partition_end", "TIMESTAMP",
+                                          partition_end(end)),
+        ]
+
+    return f"""SELECT TIMESTAMP_MICROS(gmail.event_info.timestamp_usec) as timestamp, {columns} FROM `{project}.{dataset}.activity` where
+                  {partition}
                   record_type='gmail'
                      AND
-                  gmail.event_info.timestamp_usec > {microseconds(start)}
+                  gmail.event_info.timestamp_usec > @start
                      AND
-                  gmail.event_info.timestamp_usec <= {microseconds(end)}"""
+                  gmail.event_info.timestamp_usec <= @end""", parameters
 
 
-def _get_logs(start, end):
-    rows = run_query(query(start, end))
-    results = list(map(dict, rows))
-    logger.debug(f'Total of {len(results)} logs fetched in _get_logs Gmail')
-    return results
+def job_config(parameters, dry_run=False):
+    return bigquery.QueryJobConfig(query_parameters=parameters,
+                                   maximum_bytes_billed=MAXIMUM_BYTES_BILLED,
+                                   dry_run=dry_run,
+                                   use_query_cache=not dry_run)
 
 
-def with_time(log):
-    log['timestamp'] = unix_time_millis(log['timestamp'])
-    return log
+def bytes_scanned(start, end):
+    """The bytes the window query would scan (a dry run isn't billed)"""
+    sql, parameters = query(start, end)
+    job = client().query(sql, job_config=job_config(parameters, dry_run=True))
+    return job.total_bytes_processed
 
 
-BATCH_SIZE = 5000
+def _get_logs(start, end):
+    # Result pages are streamed (timestamps converted to millis per page) as they are published
+    sql, parameters = query(start, end)
+    return chain.from_iterable(
+        query_pages(sql, job_config(parameters), millis=['timestamp']))
+
+
+def _publish_logs(logs):
+    splunk_token = read_config(project_id, 'gmail')['splunk']
+    return publish_watermarked(logs, splunk_token, 'Gmail')
 
 
 def _publish_gmail_logs(num, unit):
@@ -74,36 +138,20 @@ def _publish_gmail_logs(num, unit):
         elif (time_unit == Unit.minutes):
             logs, _, _ = last_n_minutes(int(num), _get_logs)
 
+        watermark = _publish_logs(logs)
+
     else:
         logger.info(
             f'Publishing Gmail logs from last persisted range using time unit of {unit}'
         )
-        logs, start, end = last_from_persisted_windowed(
-            _get_logs, 'gmail_log_fetch')
-
-    logger.info(f'Total of {len(logs)} fetched from Gmail')
-    timed_logs = list(map(with_time, logs))
-    batches = partition(timed_logs, BATCH_SIZE)
-    http = retryable()
-    splunk_token = read_config(project_id, 'gmail')['splunk']
-    for batch in batches:
-        publish(http, batch, splunk_token, time_field='timestamp')
-
-    if (len(logs) > 0):
-        logger.info(f'Total of {len(logs)} persisted into Splunk from Gmail')
+        watermark, start, end = publish_windowed(_get_logs,
+                                                 _publish_logs,
+                                                 'gmail_log_fetch',
+                                                 step=CHECKPOINT_WINDOW)
 
-    if (int(num) < 0):
-        event_count = len(timed_logs)
-        if (event_count > 0):
-            last_date = max(
-                list(map(lambda event: event['timestamp'],
-                         timed_logs))) / 1000.0
-
-        else:
-            last_date = None
-
-        mark_last_fetch_windowed(start, event_count, last_date,
-                                 'gmail_log_fetch')
+    if (watermark.count > 0):
+        logger.info(
+            f'Total of {watermark.count} persisted into Splunk from Gmail')
 
 
 @cli.command()
@@ -117,7 +165,7 @@ def get_logs(num, unit):
     elif (time_unit == Unit.minutes):
         logs, _, _ = last_n_minutes(int(num), _get_logs)
 
-    pp.pprint(logs)
+    pp.pprint(list(logs))
 
 
 @cli.command()
@@ -127,5 +175,48 @@ def publish_logs(num, unit):
     _publish_gmail_logs(num, unit)
 
 
+@cli.command()
+@click.option("--num", default=None, help='Range of the last num units')
+@click.option("--unit", default=None)
+@click.option("--start",
+              default=None,
+              type=click.DateTime(),
+              help='Historical range start (UTC)')
+@click.option("--end",
+              default=None,
+              type=click.DateTime(),
+              help='Historical range end (UTC)')
+@click.option("--window", default=5, help='Window size in minutes')
+def dry_run(num, unit, start, end, window):
+    """Reports the bytes each window query of the range (the last num units or start - end) would scan"""
+    into_windows = partial(sub_windows, step=timedelta(minutes=window))
+    if (start != None and end != None):
+        start = start.replace(tzinfo=timezone.utc)
+        end = end.replace(tzinfo=timezone.utc)
+        windows = into_windows(start, end)
+
+    elif (num != None and unit != None):
+        time_unit = into_unit(unit)
+        if (time_unit == Unit.days):
+            windows, start, end = last_n_24hours(int(num), into_windows)
+
+        elif (time_unit == Unit.minutes):
+            windows, start, end = last_n_minutes(int(num), into_windows)
+
+    else:
+        raise click.UsageError(
+            'Either --num and --unit or --start and --end are required')
+
+    total = 0
+    for window_start, window_end in windows:
+        scanned = bytes_scanned(window_start, window_end)
+        total += scanned
+        print(f'{window_start} - {window_end} {scanned} bytes')
+
+    logger.info(
+        f'Total of {total} bytes would be scanned for {start} - {end} (maximum billed per query {MAXIMUM_BYTES_BILLED})'
+    )
+
+
 if __name__ == '__main__':
     cli()
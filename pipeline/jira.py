@@ -2,30 +2,30 @@
 """Jira audit logs"""
 
 from secops_common.logsetup import logger, enable_logfile
-from secops_common.secrets import read_config
-from pipeline.common.splunk import publish, retryable
-from pipeline.common.functional import partition
-from pipeline.common.time import unix_time_millis
-from pipeline.common.fetch import last_n_24hours, last_n_minutes, last_from_persisted, mark_last_fetch, Unit, into_unit
-from pipeline.common.window import last_from_persisted_windowed, mark_last_fetch_windowed
+from pipeline.common.secrets import read_config
+from pipeline.common.time import parse_millis
+from pipeline.common.fetch import last_n_24hours, last_n_minutes, prefetched, Unit, into_unit
+from pipeline.common.window import last_from_persisted_windowed, publish_windowed, publish_watermarked
 
+import pipeline.common.bigquery
 from secops_common.bigquery import delete_table_and_view
 
 from pipeline.common.config import CONFIG
 
-import requests
+from pipeline.common.http import session
+from itertools import chain
 
-# Timestamp handling
+# Concurrent pagination
+import time
+from email.utils import parsedate_to_datetime
 from datetime import datetime, timezone
-import pytz
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 # UI
 import pprint
 import click
 
-# Units
-from enum import Enum, auto
-
 company = CONFIG['company']
 
 pp = pprint.PrettyPrinter(indent=4)
@@ -37,6 +37,12 @@ token = read_config(project_id, 'jira')['token']
 splunk_token = read_config(project_id, 'jira')['splunk']
 LIMIT = 1000
 
+# Number of audit pages requested concurrently once the total is known
+PAGE_CONCURRENCY = CONFIG.get('jira_page_concurrency', 4)
+
+# Attempts of a rate limited (429) page request
+RATE_LIMIT_ATTEMPTS = 5
+
 
 @click.group()
 def cli():
@@ -48,25 +54,54 @@ headers = {'Accept': 'application/json'}
 url = base + '/rest/api/3/auditing/record'
 
 
-def get_result(response):
-    if (response == None):
-        return None
-    elif (response.status_code != 200):
-        return None
-    else:
-        return response.json()['records']
+def retry_after(response, attempt):
+    """Seconds to wait before retrying, Retry-After is either seconds or an HTTP date"""
+    value = response.headers.get('Retry-After')
+    if (value == None):
+        return 2**attempt
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) -
+                         datetime.now(tz=timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return 2**attempt
+
+
+def get_page(params, offset, attempt=0):
+    """A page of records, failed pages raise (so their window isn't checkpointed)"""
+    response = session(url).get(url,
+                                headers=headers,
+                                auth=(user, token),
+                                params=dict(params, offset=offset))
+    if (response.status_code == 429 and attempt < RATE_LIMIT_ATTEMPTS):
+        delay = retry_after(response, attempt)
+        logger.info(
+            f'Jira rate limited offset {offset}, retrying in {delay} seconds')
+        time.sleep(delay)
+        return get_page(params, offset, attempt + 1)
+
+    if (response.status_code != 200):
+        raise Exception(
+            f'Failed to fetch Jira audit records at offset {offset} {response.status_code}'
+        )
+    return response.json()
 
 
-def next_page(response, params, index):
-    data = response.json()
-    if (len(data['records']) == data['limit']):
-        params['offset'] = params['limit'] * index
-        return requests.get(url,
-                            headers=headers,
-                            auth=(user, token),
-                            params=params)
-    else:
-        return None
+def ordered_pages(params, offsets):
+    """Fetches the pages of the offsets concurrently, yielding them in order (at most
+       PAGE_CONCURRENCY pages are requested ahead)"""
+    with ThreadPoolExecutor(max_workers=PAGE_CONCURRENCY) as executor:
+        pending = deque()
+        for offset in offsets:
+            pending.append(executor.submit(get_page, params, offset))
+            if (len(pending) >= PAGE_CONCURRENCY):
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
 
 
 def into_jira_date(dt):
@@ -77,38 +112,44 @@ def into_jira_date(dt):
 
 def from_jira_date(created):
     stamp = created.split('.')[0]
-    return unix_time_millis(
-        datetime.strptime(stamp,
-                          '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc))
+    return parse_millis(stamp, '%Y-%m-%dT%H:%M:%S')
 
 
-def _get_logs(start, end):
-    logger.debug(f'Getting logs from Jira for {start} - {end}')
+def unseen(records, seen):
+    """Drops records already yielded, new records arriving while paginating shift older ones
+       into the following page"""
+    fresh = [record for record in records if record['id'] not in seen]
+    seen.update(map(lambda record: record['id'], fresh))
+    return fresh
+
+
+def _get_pages(start, end):
+    """Lazily yields the records of each page, the pages following the first one (which tells the total)
+       are fetched concurrently"""
     params = {
         'from': into_jira_date(start),
         'to': into_jira_date(end),
-        'limit': 1000,
-        'offset': 0
+        'limit': LIMIT,
     }
-    results = []
-    idx = 1
-    response = requests.get(url,
-                            headers=headers,
-                            auth=(user, token),
-                            params=params)
-    result = get_result(response)
-    if (result != None):
-        results.extend(result)
-
-    while (result != None):
-        response = next_page(response, params, idx)
-        result = get_result(response)
-        if (result != None):
-            idx += 1
-            results.extend(result)
-
-    logger.debug(f'Total of {len(results)} logs fetched in _get_logs Jira')
-    return results
+    data = get_page(params, 0)
+    seen = set()
+    yield unseen(data['records'], seen)
+
+    offsets = range(LIMIT, data.get('total', 0), LIMIT)
+    for data in ordered_pages(params, offsets):
+        yield unseen(data['records'], seen)
+
+    # Records that arrived while paginating pushed older records past the total
+    offset = max(offsets, default=0)
+    while (len(data['records']) == data['limit']):
+        offset += LIMIT
+        data = get_page(params, offset)
+        yield unseen(data['records'], seen)
+
+
+def _get_logs(start, end):
+    logger.debug(f'Getting logs from Jira for {start} - {end}')
+    return chain.from_iterable(prefetched(_get_pages(start, end)))
 
 
 def with_time(log):
@@ -116,6 +157,10 @@ def with_time(log):
     return log
 
 
+def _publish_logs(logs):
+    return publish_watermarked(logs, splunk_token, 'Jira', with_time)
+
+
 def _publish_jira_logs(num, unit):
     time_unit = into_unit(unit)
     if (int(num) > 0):
@@ -126,35 +171,18 @@ def _publish_jira_logs(num, unit):
         elif (time_unit == Unit.minutes):
             logs, _, _ = last_n_minutes(int(num), _get_logs)
 
+        watermark = _publish_logs(logs)
+
     else:
         logger.info(
             f'Publishing Jira logs from last persisted range using time unit of {unit}'
         )
-        logs, start, end = last_from_persisted_windowed(
-            _get_logs, 'jira_log_fetch')
-
-    logger.info(f'Total of {len(logs)} fetched from Jira')
-    timed_logs = list(map(with_time, logs))
-    batches = partition(timed_logs, 50)
-    http = retryable()
-    for batch in batches:
-        publish(http, batch, splunk_token, time_field='timestamp')
-
-    if (len(logs) > 0):
-        logger.info(f'Total of {len(logs)} persisted into Splunk from Jira')
+        watermark, start, end = publish_windowed(_get_logs, _publish_logs,
+                                                 'jira_log_fetch')
 
-    if (int(num) < 0):
-        event_count = len(logs)
-        if (event_count > 0):
-            last_date = max(
-                list(map(lambda event: from_jira_date(event['created']),
-                         logs))) / 1000.0
-
-        else:
-            last_date = None
-
-        mark_last_fetch_windowed(start, event_count, last_date,
-                                 'jira_log_fetch')
+    if (watermark.count > 0):
+        logger.info(
+            f'Total of {watermark.count} persisted into Splunk from Jira')
 
 
 @cli.command()
@@ -186,7 +214,7 @@ def get_logs(num, unit):
         logs, start, end = last_from_persisted_windowed(
             _get_logs, 'jira_log_fetch')
 
-    logger.info(f'Total of {len(logs)} fetched from Jira')
+    logger.info(f'Total of {len(list(logs))} fetched from Jira')
 
 
 if __name__ == '__main__':
@@ -2,18 +2,17 @@
 """LastPass audit logs"""
 
 from pipeline.common.config import CONFIG
-from secops_common.secrets import read_config
+from pipeline.common.secrets import read_config
 from secops_common.logsetup import logger
-from pipeline.common.splunk import publish, retryable
-from pipeline.common.functional import partition
-from pipeline.common.time import unix_time_millis
-from pipeline.common.fetch import last_n_24hours, last_n_minutes, last_from_persisted, mark_last_fetch, Unit, into_unit
+from pipeline.common.time import parse_millis
+from pipeline.common.fetch import last_n_24hours, last_n_minutes, catch_up, prefetched, Unit, into_unit
+from pipeline.common.window import publish_watermarked
 
-import requests
+from pipeline.common.http import session
+from itertools import chain
 import math
 
 # Timestamp handling
-from datetime import datetime, timedelta, timezone
 import pytz
 
 # UI
@@ -47,23 +46,22 @@ def get_results(response):
 
 
 def into_lastpass_date(dt):
-    return dt.strftime("%Y-%m-%d %H:%M:%S")
+    return dt.astimezone(lastpass_tz).strftime("%Y-%m-%d %H:%M:%S")
 
 
 def from_lastpass_date(created):
-    dt = datetime.strptime(created, '%Y-%m-%d %H:%M:%S')
-    local_dt = lastpass_tz.localize(dt, is_dst=None)
-    return unix_time_millis(local_dt.astimezone(timezone.utc))
+    return parse_millis(created, '%Y-%m-%d %H:%M:%S', lastpass_tz)
 
 
 def _get_lastpass_audit_logs(data):
+    """Lazily yields the events of each page"""
     logger.debug(f'Getting instance audit events')
-    response = requests.post(url, headers=headers, json=data)
+    response = session(url).post(url, headers=headers, json=data)
     logger.debug(f'Getting first page for {url}...')
     json_resp = get_results(response)
 
     if not json_resp:
-        return []
+        return
 
     # lastpass has a list represented as a dict with keys "Event1", "Event2", etc..
     # this is a gross hack on their end, so we implement a hack to more nicely format the events
@@ -71,22 +69,20 @@ def _get_lastpass_audit_logs(data):
     curr_results = [curr_results_lp_hack[x] for x in curr_results_lp_hack]
     logger.debug(f'Got {len(curr_results)} results')
 
-    results = curr_results
+    yield curr_results
     next_id = json_resp['next']
 
     while next_id:
         logger.info('Getting next page with ID {}...'.format(next_id))
         data['data']['next'] = next_id
-        response = requests.post(url, headers=headers, json=data)
+        response = session(url).post(url, headers=headers, json=data)
         json_resp = get_results(response)
         curr_results_lp_hack = json_resp['data']
         curr_results = [curr_results_lp_hack[x] for x in curr_results_lp_hack]
         next_id = json_resp['next']
         logger.debug(f'Got {len(curr_results)} results')
 
-        results.extend(curr_results)
-
-    return results
+        yield curr_results
 
 
 def _get_logs(start, end):
@@ -100,10 +96,7 @@ def _get_logs(start, end):
             'to': into_lastpass_date(end),
         }
     }
-    results = _get_lastpass_audit_logs(data)
-
-    logger.debug(f'Total of {len(results)} logs fetched in _get_logs LastPass')
-    return results
+    return chain.from_iterable(prefetched(_get_lastpass_audit_logs(data)))
 
 
 def with_time(log):
@@ -111,6 +104,10 @@ def with_time(log):
     return log
 
 
+def _publish_logs(logs):
+    return publish_watermarked(logs, splunk_token, 'LastPass', with_time)
+
+
 def _publish_lastpass_logs(num, unit):
     time_unit = into_unit(unit)
     if int(num) > 0:
@@ -121,28 +118,21 @@ def _publish_lastpass_logs(num, unit):
         elif time_unit == Unit.minutes:
             logs, _, _ = last_n_minutes(int(num), _get_logs, tz=lastpass_tz)
 
+        watermark = _publish_logs(logs)
+        count = watermark.count
+
     else:
         logger.info(
             f'Publishing LastPass logs from last persisted range using time unit of {unit}'
         )
-        logs, start, end = last_from_persisted(time_unit,
-                                               _get_logs,
-                                               'lastpass_log_fetch',
-                                               tz=lastpass_tz)
-
-    logger.info(f'Total of {len(logs)} fetched from LastPass')
-    timed_logs = list(map(with_time, logs))
-    batches = partition(timed_logs, 50)
-    http = retryable()
-    for batch in batches:
-        publish(http, batch, splunk_token, time_field='timestamp')
-
-    if (len(logs) > 0):
-        logger.info(
-            f'Total of {len(logs)} persisted into Splunk from Lastpass')
-
-    if int(num) < 0:
-        mark_last_fetch(start, end, True, 'lastpass_log_fetch')
+        _, count = catch_up(time_unit,
+                            _get_logs,
+                            _publish_logs,
+                            'lastpass_log_fetch',
+                            tz=lastpass_tz)
+
+    if (count > 0):
+        logger.info(f'Total of {count} persisted into Splunk from Lastpass')
 
 
 @click.group()
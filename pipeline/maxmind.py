@@ -12,7 +12,7 @@ import glob
 import csv
 
 from secops_common.logsetup import logger
-from secops_common.secrets import read_config
+from pipeline.common.secrets import read_config
 from pipeline.common.functional import partition
 
 # Splunk KV
@@ -9,18 +9,19 @@ from azure.identity import ClientSecretCredential
 
 # beta roadmap here: https://github.com/microsoftgraph/msgraph-sdk-design
 from msgraph.core import APIVersion, GraphClient, NationalClouds
-from pipeline.common.splunk import publish, retryable
+from pipeline.common.splunk import publish_all
 from pipeline.common.config import CONFIG
-from pipeline.common.functional import partition
-from secops_common.secrets import read_config
+from pipeline.common.secrets import read_config
 from functools import reduce, partial
 
 from secops_common.logsetup import logger
-from secops_common.functional import merge, compose2, flatten
+from secops_common.functional import merge, compose2
 
 from datetime import datetime, timezone
+from itertools import chain
 
 import uuid
+import functools
 # UI
 import pprint
 import click
@@ -35,9 +36,9 @@ splunk_token = auth_map['splunk']
 Write_File = False
 scope = 'https://graph.microsoft.com/.default'
 
-BATCH_SIZE = 5000
-
 
+# Credentials (and their access tokens) are reused across warm invocations
+@functools.lru_cache(maxsize=None)
 def init_clients_creds():
     logger.debug("setting v1 graph client")
     tenant_id = auth_map["tenant_id"]
@@ -105,7 +106,6 @@ def query_items_all(graph_client,
                     page_size=500,
                     extra_args=None):
     # ref: https://docs.microsoft.com/en-us/graph/query-parameters
-    api_result_list = []
     url = make_base_url(base_url, page_size, extra_args)
     paging_is_enabled = page_size > 0
 
@@ -114,13 +114,10 @@ def query_items_all(graph_client,
         f'paging_enabled: {paging_is_enabled}, max_page: {max_page}, page_size {page_size}'
     )
 
-    graph_results = graph_generator_f(graph_client=graph_client,
-                                      endpoint=url,
-                                      max_page=max_page)
-
-    for gen_values in graph_results:
-        api_result_list.append(gen_values)
-    return api_result_list
+    # Pages are lazily fetched as the items are consumed
+    return graph_generator_f(graph_client=graph_client,
+                             endpoint=url,
+                             max_page=max_page)
 
 
 def get_az_devices(graph_client):
@@ -128,7 +125,6 @@ def get_az_devices(graph_client):
                                    base_url="/devices",
                                    max_page=0,
                                    page_size=500)
-    logger.debug(f'collected device objects {len(api_ret_list)}')
     return api_ret_list
 
 
@@ -137,7 +133,6 @@ def get_az_users(graph_client):
                                    base_url="/users",
                                    max_page=0,
                                    page_size=500)
-    logger.debug(f'collected user objects {len(api_ret_list)}')
     return api_ret_list
 
 
@@ -149,7 +144,6 @@ def get_az_groups(graph_client, expand=False):
                                    max_page=0,
                                    page_size=500,
                                    extra_args="$expand=members")
-    logger.debug(f'collected group objects {len(api_ret_list)}')
     return api_ret_list
 
 
@@ -159,7 +153,6 @@ def get_intune_managed_devices(graph_client):
                                    base_url="/deviceManagement/managedDevices",
                                    max_page=0,
                                    page_size=500)
-    logger.debug(f'collected managed device objects {len(api_ret_list)}')
     return api_ret_list
 
 
@@ -186,27 +179,29 @@ def extras_into_event(sourcetype, timestamp, batch_id, value):
     return value
 
 
+@functools.lru_cache(maxsize=None)
+def graph_client(api_version):
+    return GraphClient(credential=init_clients_creds(),
+                       api_version=api_version,
+                       NationalClouds=NationalClouds.Global,
+                       max_retries=3,
+                       retry_backoff_factor=0.5)
+
+
 def _fetch():
-    creds = init_clients_creds()  #
-    graph_client_beta = GraphClient(credential=creds,
-                                    api_version=APIVersion.beta,
-                                    NationalClouds=NationalClouds.Global,
-                                    max_retries=3,
-                                    retry_backoff_factor=0.5)
+    graph_client_beta = graph_client(APIVersion.beta)
 
     # for when you need endpoints that are only in beta eg intune auditEvents (log  not inventory though)
-    graph_client_v1 = GraphClient(credential=creds,
-                                  api_version=APIVersion.v1,
-                                  NationalClouds=NationalClouds.Global,
-                                  max_retries=3,
-                                  retry_backoff_factor=0.5)
+    graph_client_v1 = graph_client(APIVersion.v1)
 
     az_devices = get_az_devices(graph_client_v1)
     if (Write_File):
+        az_devices = list(az_devices)
         write_to_json_file(az_devices, 'devices.json', Format=True)
 
     az_users = get_az_users(graph_client_v1)
     if (Write_File):
+        az_users = list(az_users)
         write_to_json_file(az_users, 'users.json', Format=True)
 
     # as is you should define a sourcetype called "az:graph_groups"
@@ -214,11 +209,13 @@ def _fetch():
     az_groups = get_az_groups(graph_client_v1, expand=True)
 
     if (Write_File):
+        az_groups = list(az_groups)
         write_to_json_file(az_groups, 'groups.json', Format=True)
 
     intune_managed_devices = get_intune_managed_devices(graph_client_v1)
 
     if (Write_File):
+        intune_managed_devices = list(intune_managed_devices)
         write_to_json_file(intune_managed_devices,
                            'intune_managed_devices.json',
                            Format=True)
@@ -237,34 +234,25 @@ def _fetch():
     intune_managed_devices_m = map(
         partial(extras_into_event, 'intune:graph_managed_devices', timestamp,
                 batch_id), intune_managed_devices)
-    return flatten(
-        [az_devices_m, az_users_m, az_groups_m, intune_managed_devices_m])
+    return chain(az_devices_m, az_users_m, az_groups_m,
+                 intune_managed_devices_m)
 
 
 def _process(records):
-    logger.info(
-        f'Total of {len(records)} fetched from az and intune, about to publish to splunk'
-    )
-    batches = partition(list(records), BATCH_SIZE)
-    http = retryable()
-    batch_count = 1
-    total_event_count = len(records)
-    sum_event_count = 0
-    for batch in batches:
-        publish(http,
-                batch,
-                splunk_token,
-                time_field="time",
-                sourcetype_field='sourcetype_override')
-        sum_event_count += len(batch)
-        batch_count += 1
+    logger.info('Fetching from az and intune while publishing pages to splunk')
+    sum_event_count = publish_all(records,
+                                  splunk_token,
+                                  'MS Graph',
+                                  time_field="time",
+                                  sourcetype_field='sourcetype_override')
 
     logger.debug(
-        f'Published a total of {len(records)} from az and intune into splunk')
+        f'Published a total of {sum_event_count} from az and intune into splunk'
+    )
 
 
 def _publish_and_download_intune():
-    _process(list(_fetch()))
+    _process(_fetch())
 
 
 @click.group()
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 import json
-import requests
+
+from pipeline.common.http import session
 
 from secops_common.logsetup import logger
 
@@ -49,9 +50,9 @@ class SnipeIT:
             'Authorization': 'Bearer ' + self.token
         }
 
-        response = requests.get(self.server + uri,
-                                params=params,
-                                headers=headers)
+        response = session(self.server).get(self.server + uri,
+                                            params=params,
+                                            headers=headers)
         data = json.loads(response.content)
 
         if 'rows' not in data:
@@ -7,11 +7,10 @@ import uuid
 from datetime import datetime, timezone
 from functools import partial
 
-from secops_common.secrets import read_config
+from pipeline.common.secrets import read_config
 from secops_common.logsetup import logger
 from secops_common.functional import flatten
-from pipeline.common.splunk import publish, retryable
-from pipeline.common.functional import partition
+from pipeline.common.splunk import publish_all
 from pipeline.common.config import CONFIG
 
 pp = pprint.PrettyPrinter(indent=4)
@@ -22,8 +21,6 @@ server = read_config(project_id, 'snipeit')['server']
 token = read_config(project_id, 'snipeit')['token']
 splunk_token = read_config(project_id, 'snipeit')['splunk']
 
-BATCH_SIZE = 2000
-
 
 def _get_users(client):
     uri = '/api/v1/users'
@@ -80,18 +77,11 @@ def _process(records):
         f'Total of {total_event_count} fetched SnipeIT, about to publish to Splunk'
     )
 
-    batches = partition(list(records), BATCH_SIZE)
-    http = retryable()
-    batch_count = 1
-    sum_event_count = 0
-    for batch in batches:
-        publish(http,
-                batch,
+    publish_all(records,
                 splunk_token,
+                'SnipeIT',
                 time_field="time",
                 sourcetype_field='sourcetype_override')
-        sum_event_count += len(batch)
-        batch_count += 1
 
     logger.info(
         f'Published a total of {total_event_count} from SnipeIT into Splunk')
@@ -1,10 +1,10 @@
 #!/usr/bin/env python3
 """Uploading a Google drive spreadsheet into a Splunk index"""
 
-from secops_common.secrets import read_config
+from pipeline.common.secrets import read_config
 from secops_common.logsetup import logger
-from pipeline.common.google import creds
-from pipeline.common.splunk import publish, retryable
+from pipeline.common.google import creds, service
+from pipeline.common.splunk import publish_all
 
 from pipeline.common.config import CONFIG
 
@@ -14,9 +14,7 @@ from secops_common.bigquery import latest_rows, get_table, insert_rows
 
 from pipeline.common.time import unix_time_millis
 
-from pipeline.common.functional import partition
-
-from googleapiclient.discovery import build
+from functools import partial
 
 # UI
 import pprint
@@ -40,8 +38,7 @@ SCOPES = ['https://www.googleapis.com/auth/spreadsheets.readonly']
 
 
 def _read_spreadsheet(_id, _range):
-    service = build('sheets', 'v4', credentials=creds(SCOPES))
-    sheet = service.spreadsheets()
+    sheet = service('sheets', 'v4', partial(creds, SCOPES)).spreadsheets()
     hashlib.md5("".encode('utf-8')).hexdigest()
     result = sheet.values().get(spreadsheetId=_id, range=_range).execute()
     return result.get('values', [])
@@ -90,10 +87,7 @@ def _publish_spreadsheet(_id, _range):
             f'spreadsheet {_id} has changed, publishing changes to Splunk')
         meta = rows.pop(0) + ['created']
         events = list(map(lambda row: dict(zip(meta, row + [now])), rows))
-        http = retryable()
-        batches = partition(events, 50)
-        for batch in batches:
-            publish(http, batch, splunk_token, time_field='created')
+        publish_all(events, splunk_token, 'Spreadsheet', time_field='created')
 
         stamp = datetime.now(tz=timezone.utc)
         insert_rows([[_id, curr_sum, stamp]], 'spreadsheet_tracking')
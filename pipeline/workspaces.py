@@ -4,38 +4,42 @@
 # Common functions
 from pipeline.common.config import CONFIG
 from secops_common.misc import serialize, file_deserialize
-from secops_common.secrets import read_config
+from pipeline.common.secrets import read_config
 from secops_common.logsetup import logger
-from secops_common.functional import compose2
 
-from pipeline.common.google import creds
-from googleapiclient.discovery import build
+from pipeline.common.google import creds, service
 
-from pipeline.common.time import unix_time_millis
-from pipeline.common.functional import partition
+from pipeline.common.time import parse_millis
 
 # Bigquery
 from pipeline.common.bigquery import AUDITS
 from secops_common.bigquery import delete_table_and_view
 
-from dateutil import parser
-
 # UI
 import pprint
 import click
 
 # publishing to splunk
-from pipeline.common.splunk import publish, retryable
 
-from pipeline.common.fetch import last_n_24hours, last_n_minutes, Unit, into_unit
+from pipeline.common.ingest import ingest, INGEST_PROCESSES
+
+from pipeline.common.fetch import last_n_24hours, last_n_minutes, prefetched, Unit, into_unit
 
-from pipeline.common.window import last_from_persisted_windowed, mark_last_fetch_windowed
+from pipeline.common.window import last_from_persisted_windowed, publish_windowed, publish_watermarked
 
 from functools import partial
+from itertools import chain
 
 from google.oauth2 import service_account
+from google_auth_httplib2 import AuthorizedHttp
+import httplib2
 
+import json
 import time
+import queue
+import functools
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 pp = pprint.PrettyPrinter(indent=4)
 
@@ -46,82 +50,115 @@ project_id = CONFIG['project_id']
 # If modifying these scopes, delete the file token.json.
 SCOPES = ['https://www.googleapis.com/auth/admin.reports.audit.readonly']
 
+# Number of applications fetched and published at the same time
+WORKSPACE_CONCURRENCY = CONFIG.get('workspace_concurrency', 4)
+
 
 @click.group()
 def cli():
     pass
 
 
+@functools.lru_cache(maxsize=1)
+def _credentials(info):
+    return service_account.Credentials.from_service_account_info(
+        json.loads(info), scopes=SCOPES, subject=subject)
+
+
+def credentials():
+    """The service account credentials of the current service_info secret (read through the secrets
+       cache), the same credentials (and their access token) are reused until the key is rotated"""
+    info = read_config(project_id, 'service_info')
+    return _credentials(json.dumps(info, sort_keys=True))
+
+
+def reports_service():
+    """A single Reports service shared by all applications (and threads)"""
+    return service('admin', 'reports_v1', credentials, subject)
+
+
+@functools.lru_cache(maxsize=None)
+def http_pool():
+    """httplib2 isn't thread safe, the shared service requests are executed over authorized connections
+       lent to a single request at a time (pages are fetched by short lived prefetch threads)"""
+    pool = queue.Queue()
+    for _ in range(WORKSPACE_CONCURRENCY):
+        pool.put(AuthorizedHttp(credentials(), http=httplib2.Http()))
+    return pool
+
+
+@contextmanager
+def pooled_http():
+    pool = http_pool()
+    http = pool.get()
+    # The service_info key may have been rotated since the connection was created
+    http.credentials = credentials()
+    try:
+        yield http
+    finally:
+        pool.put(http)
+
+
 def get_activities(service, type, start, end, token=None, attempt=0):
     if (attempt > 10):
         raise Exception(f'Failed to get activities for {attempt} times')
 
     try:
-        return service.activities().list(userKey='all',
-                                         applicationName=type,
-                                         startTime=start.isoformat(),
-                                         endTime=end.isoformat(),
-                                         pageToken=token).execute()
+        with pooled_http() as http:
+            return service.activities().list(
+                userKey='all',
+                applicationName=type,
+                startTime=start.isoformat(),
+                endTime=end.isoformat(),
+                pageToken=token).execute(http=http)
     except Exception as e:
         logger.info(f'failed to fetch activities due to {e} retry {attempt}')
         time.sleep(1)
         return get_activities(service, type, start, end, token, attempt + 1)
 
 
-def _get_logs(type, start, end):
-    logger.info(
-        f'Getting logs from Google workspace {type} for {start} - {end}')
-    info = read_config(project_id, 'service_info')
-    cs = service_account.Credentials.from_service_account_info(info,
-                                                               scopes=SCOPES,
-                                                               subject=subject)
-    service = build('admin', 'reports_v1', credentials=cs)
+def _get_pages(type, start, end):
+    """Lazily yields the activities of each page"""
+    service = reports_service()
     activities = get_activities(service, type, start, end)
-    results = activities.get('items', [])
+    yield activities.get('items', [])
     token = activities.get('nextPageToken', None)
 
     while (token != None):
         activities = get_activities(service, type, start, end, token)
-        results.extend(activities.get('items', []))
+        yield activities.get('items', [])
         token = activities.get('nextPageToken', None)
 
-    logger.debug(
-        f'Total of {len(results)} logs fetched in _get_logs Google Workspace {type}'
-    )
-    return results
 
+def _get_logs(type, start, end):
+    logger.info(
+        f'Getting logs from Google workspace {type} for {start} - {end}')
+    return chain.from_iterable(prefetched(_get_pages(type, start, end)))
 
-def _write_activities(file_object, activities):
-    for activity in activities.get('items', []):
+
+def _write_activities(file_object, items):
+    for activity in items:
         file_object.write(serialize(activity))
         file_object.write('\n')
 
 
 def _persist_logs(type, start, end):
-    file_object = open('logs.json', 'a')
-    info = read_config(project_id, 'service_info')
-    cs = service_account.Credentials.from_service_account_info(info,
-                                                               scopes=SCOPES,
-                                                               subject=subject)
-    service = build('admin', 'reports_v1', credentials=cs)
-    activities = get_activities(service, type, start, end)
-    _write_activities(file_object, activities)
-    token = activities.get('nextPageToken', None)
-
-    while (token != None):
-        activities = get_activities(service, type, start, end, token)
-        _write_activities(file_object, activities)
-        token = activities.get('nextPageToken', None)
-
-    file_object.close()
+    with open('logs.json', 'a') as file_object:
+        for items in _get_pages(type, start, end):
+            _write_activities(file_object, items)
 
 
 def with_time(log):
-    log['timestamp'] = unix_time_millis(parser.parse((log['id']['time'])))
+    log['timestamp'] = parse_millis(log['id']['time'])
     return log
 
 
-BATCH_SIZE = 5000
+def _publish_logs(type, logs):
+    # Logs are fetched lazily page by page while being published
+    splunk_token = read_config(project_id,
+                               f'google_workspace_{type}')['splunk']
+    return publish_watermarked(logs, splunk_token, f'Google workspace {type}',
+                               with_time)
 
 
 def _publish_workspace_logs(num, unit, type):
@@ -130,45 +167,55 @@ def _publish_workspace_logs(num, unit, type):
         logger.info(
             f'Publishing Google workspace logs for {num} {unit} {type}')
         if (time_unit == Unit.days):
-            logs, _, _ = last_n_24hours(int(num), partial(_get_logs, type))
+            logs, start, end = last_n_24hours(int(num),
+                                              partial(_get_logs, type))
 
         elif (time_unit == Unit.minutes):
-            logs, _, _ = last_n_minutes(int(num), partial(_get_logs, type))
+            logs, start, end = last_n_minutes(int(num),
+                                              partial(_get_logs, type))
+
+        watermark = _publish_logs(type, logs)
 
     else:
         logger.info(f'Fetching last persisted logs from window for {type}')
-        logs, start, end = last_from_persisted_windowed(
-            partial(_get_logs, type), f'workspace_{type}_log_fetch')
+        watermark, start, end = publish_windowed(
+            partial(_get_logs, type), partial(_publish_logs, type),
+            f'workspace_{type}_log_fetch')
 
     logger.info(
-        f'Total of {len(logs)} fetched from Google workspace {type} for {start} - {end} range'
+        f'Total of {watermark.count} persisted into Splunk from Google workspaces {type} for {start} - {end} range'
     )
 
-    timed_logs = list(map(with_time, logs))
-    batches = partition(timed_logs, BATCH_SIZE)
-    http = retryable()
-    splunk_token = read_config(project_id,
-                               f'google_workspace_{type}')['splunk']
-    for batch in batches:
-        publish(http, batch, splunk_token, time_field='timestamp')
-
-    logger.info(
-        f'Total of {len(logs)} persisted into Splunk from Google workspaces {type} using provided time range'
-    )
 
-    if (int(num) < 0):
-
-        event_count = len(timed_logs)
-        if (event_count > 0):
-            last_date = max(
-                list(map(lambda event: event['timestamp'],
-                         timed_logs))) / 1000.0
-
-        else:
-            last_date = None
+def into_types(types):
+    """All the audit applications for all"""
+    if ('all' in types):
+        return AUDITS
+    return types
+
+
+def _publish_workspace_logs_many(num, unit, types):
+    """Publishes several applications (or all) concurrently, each keeping its own window and token,
+       a failing application doesn't stop the others (failures are raised once all are done)"""
+    types = into_types(types)
+    failed = []
+    with ThreadPoolExecutor(max_workers=WORKSPACE_CONCURRENCY) as executor:
+        futures = {
+            executor.submit(_publish_workspace_logs, num, unit, type): type
+            for type in types
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(
+                    f'Google workspace {futures[future]} failed due to {e}')
+                failed.append(futures[future])
 
-        mark_last_fetch_windowed(start, event_count, last_date,
-                                 f'workspace_{type}_log_fetch')
+    if (failed):
+        raise Exception(
+            f'Google workspace failed for {len(failed)} out of {len(types)} applications {failed}'
+        )
 
 
 @cli.command()
@@ -179,6 +226,16 @@ def publish_logs(num, unit, type):
     _publish_workspace_logs(num, unit, type)
 
 
+@cli.command()
+@click.option("--num", required=True)
+@click.option("--unit", required=True)
+@click.option("--types",
+              required=True,
+              help='Comma separated applications or all')
+def publish_many(num, unit, types):
+    _publish_workspace_logs_many(num, unit, types.split(','))
+
+
 @cli.command()
 def purge_all():
     for audit in AUDITS:
@@ -191,32 +248,20 @@ def purge_single(type):
     delete_table_and_view(f'workspace_{type}_log_fetch')
 
 
-from itertools import islice
+def file_event(line):
+    return with_time(file_deserialize(line))
 
 
 @cli.command()
 @click.option("--type", required=True)
-@click.option("--file", required=True)
-def publish_file(type, file):
-    """ Persisting large sized files (multi GB in size) into Splunk """
+@click.option("--file", required=True, help='NDJSON file (or .gz)')
+@click.option("--processes", default=INGEST_PROCESSES)
+def publish_file(type, file, processes):
+    """ Persisting large sized files (multi GB in size) into Splunk, an interrupted run resumes where it stopped """
     splunk_token = read_config(project_id,
                                f'google_workspace_{type}')['splunk']
-    http = retryable()
-    total = 0
-    n = BATCH_SIZE
-    with open(file, 'rb') as f:
-        for lines in iter(lambda: tuple(islice(f, n)), ()):
-            try:
-                batch = list(map(compose2(with_time, file_deserialize), lines))
-                publish(http, batch, splunk_token, time_field='timestamp')
-                total += len(lines)
-                logger.info(
-                    f'Total of {total} logs were persisted into Splunk')
-            except Exception as e:
-                for line in lines:
-                    print(line)
-                    print(file_deserialize(line))
-                raise SystemExit(1)
+    total = ingest(file, file_event, splunk_token, processes=processes)
+    logger.info(f'Total of {total} logs were persisted into Splunk')
 
 
 @cli.command()
@@ -224,11 +269,6 @@ def publish_file(type, file):
 @click.option("--num", required=True)
 @click.option("--unit", required=True)
 def persist_logs(type, num, unit):
-    info = read_config(project_id, 'service_info')
-    cs = service_account.Credentials.from_service_account_info(info,
-                                                               scopes=SCOPES,
-                                                               subject=subject)
-    service = build('admin', 'reports_v1', credentials=cs)
     time_unit = into_unit(unit)
     if (time_unit == Unit.days):
         last_n_24hours(int(num), partial(_persist_logs, type))
@@ -242,28 +282,26 @@ def persist_logs(type, num, unit):
 @click.option("--num", required=True)
 @click.option("--unit", required=True)
 def get_logs(type, num, unit):
-    info = read_config(project_id, 'service_info')
-    cs = service_account.Credentials.from_service_account_info(info,
-                                                               scopes=SCOPES,
-                                                               subject=subject)
-    service = build('admin', 'reports_v1', credentials=cs)
     time_unit = into_unit(unit)
 
     if (int(num) > 0):
         if (time_unit == Unit.days):
-            logs, _, _ = last_n_24hours(int(num), partial(_get_logs, type))
+            logs, start, end = last_n_24hours(int(num),
+                                              partial(_get_logs, type))
 
         elif (time_unit == Unit.minutes):
-            logs, _, _ = last_n_minutes(int(num), partial(_get_logs, type))
+            logs, start, end = last_n_minutes(int(num),
+                                              partial(_get_logs, type))
 
     else:
         logger.info(f'Fetching last persisted logs from window for {type}')
         logs, start, end = last_from_persisted_windowed(
             partial(_get_logs, type), f'workspace_{type}_log_fetch')
 
-        logger.info(
-            f'Total of {len(logs)} fetched from Google workspace {type} for {start} - {end} range'
-        )
+    # Logs are fetched lazily, counting them consumes all the pages
+    logger.info(
+        f'Total of {len(list(logs))} fetched from Google workspace {type} for {start} - {end} range'
+    )
 
 
 if __name__ == '__main__':
@@ -1,3 +1,6 @@
 from setuptools import setup, find_packages
 
-setup(name='pipeline', version='1.0', packages=find_packages())
+setup(name='pipeline',
+      version='1.0',
+      packages=find_packages(),
+      package_data={'pipeline.common': ['discovery/*.json']})
@@ -0,0 +1,82 @@
+""" Test setup, the pipeline reads pipeline.yaml from the working directory when its config is first imported """
+
+import os
+import sys
+import json
+import types
+import logging
+import tempfile
+import importlib.util
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+CONFIG = '''
+project: test-project
+project_id: test-project
+dataset: test_dataset
+company: example
+subject: admin@example.com
+'''
+
+_cwd = os.getcwd()
+_workdir = tempfile.mkdtemp()
+with open(os.path.join(_workdir, 'pipeline.yaml'), 'w') as f:
+    f.write(CONFIG)
+os.chdir(_workdir)
+try:
+    import pipeline.common.config  # CONFIG is read once, on first import
+finally:
+    os.chdir(_cwd)
+
+# The pure functions under test only need the logger, (de)serialize and read_config (patched by the tests)
+# of secops_common, a minimal stand in is registered when it isn't installed
+if importlib.util.find_spec('secops_common') == None:
+    secops_common = types.ModuleType('secops_common')
+    logsetup = types.ModuleType('secops_common.logsetup')
+    logsetup.logger = logging.getLogger('pipeline')
+    misc = types.ModuleType('secops_common.misc')
+    misc.serialize = json.dumps
+    misc.deserialize = json.loads
+    secrets = types.ModuleType('secops_common.secrets')
+
+    def read_config(project_id, name):
+        raise Exception('Secret Manager is not available in tests')
+
+    secrets.read_config = read_config
+    secops_common.logsetup = logsetup
+    secops_common.misc = misc
+    secops_common.secrets = secrets
+    sys.modules.update({
+        'secops_common': secops_common,
+        'secops_common.logsetup': logsetup,
+        'secops_common.misc': misc,
+        'secops_common.secrets': secrets,
+    })
+
+from pipeline.common import fetch, window
+from pipeline.common.checkpoint import SQLiteStore
+from pipeline.common.window import Watermark
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """A local checkpoint store in place of the configured one"""
+    store = SQLiteStore(str(tmp_path / 'checkpoints.db'))
+    monkeypatch.setattr(fetch, 'store', lambda: store)
+    monkeypatch.setattr(window, 'store', lambda: store)
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def published():
+    """A _publish_logs which only tracks the events watermark"""
+    def published(events):
+        watermark = Watermark(lambda event: event['timestamp'])
+        list(map(watermark, events))
+        return watermark
+
+    return published
@@ -0,0 +1,147 @@
+import json
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip('aliyunsdkcore')
+
+from pipeline.aliyun import client
+
+
+class Request:
+    def __init__(self, action='DescribeSuspEvents'):
+        self.action = action
+        self.page = 1
+        self.size = None
+
+    def get_action_name(self):
+        return self.action
+
+    def set_PageSize(self, size):
+        self.size = size
+
+    def set_PageNumber(self, page):
+        self.page = page
+
+    def set_CurrentPage(self, page):
+        self.page = page
+
+
+class Client:
+    """Serves pages of records, paginated like DescribeSuspEvents (PageNumber) or like
+       DescribeAlarmEventList (PageInfo.CurrentPage), later pages answer first. Each client
+       serves a single request at a time"""
+    def __init__(self, records, style, requested):
+        self.records = records
+        self.style = style
+        self.requested = requested
+        self.busy = threading.Lock()
+
+    def do_action_with_exception(self, request):
+        assert self.busy.acquire(blocking=False)
+        try:
+            time.sleep(0.05 / request.page)
+            self.requested.append(request.page)
+            start = (request.page - 1) * request.size
+            page = self.records[start:start + request.size]
+            if (self.style == 'count'):
+                response = {
+                    'PageNumber': request.page,
+                    'PageRecordCount': len(page),
+                    'TotalRecordCount': len(self.records),
+                    'Items': page
+                }
+            else:
+                response = {
+                    'PageInfo': {
+                        'CurrentPage': request.page,
+                        'PageSize': len(page),
+                        'TotalCount': len(self.records)
+                    },
+                    'Items': page
+                }
+            return json.dumps(response)
+        finally:
+            self.busy.release()
+
+
+@pytest.fixture
+def served(monkeypatch):
+    def served(records, style):
+        requested = []
+        pool = queue.Queue()
+        for _ in range(client.ALIYUN_CONCURRENCY):
+            pool.put(Client(records, style, requested))
+        monkeypatch.setattr(client, 'client_pool',
+                            lambda region, account: pool)
+        return requested, pool
+
+    return served
+
+
+def items(response):
+    return response['Items']
+
+
+def test_count_pages_are_fetched_and_kept_in_order(served):
+    requested, pool = served(list(range(95)), 'count')
+    request = Request()
+    result = client.fetch_with_count_concurrent('cn-hangzhou', 'INT', request,
+                                                items)
+    assert result == list(range(95))
+    assert sorted(requested) == [1, 2, 3, 4, 5]
+    # Pages are requested on copies, the clients are back in the pool
+    assert request.page == 1
+    assert pool.qsize() == client.ALIYUN_CONCURRENCY
+
+
+def test_count_2_pages_are_fetched_and_kept_in_order(served):
+    requested, _ = served(list(range(2500)), 'count_2')
+    result = client.fetch_with_count_2_concurrent('cn-hangzhou', 'INT',
+                                                  Request(), items)
+    assert result == list(range(2500))
+    assert sorted(requested) == [1, 2, 3]
+
+
+def test_single_page_is_fetched_once(served):
+    requested, _ = served(list(range(5)), 'count')
+    assert client.fetch_with_count_concurrent('cn-hangzhou', 'INT', Request(),
+                                              items) == list(range(5))
+    assert requested == [1]
+
+
+def test_page_size_per_action(served, monkeypatch):
+    monkeypatch.setattr(client, 'PAGE_SIZES', {'DescribeSuspEvents': 50})
+    requested, _ = served(list(range(95)), 'count')
+    assert client.fetch_with_count_concurrent('cn-hangzhou', 'INT', Request(),
+                                              items) == list(range(95))
+    assert sorted(requested) == [1, 2]
+
+
+def test_failed_page_raises_and_returns_its_client(served):
+    _, pool = served(list(range(95)), 'count')
+
+    def fail(request):
+        raise Exception('SAS throttled')
+
+    failing = pool.get()
+    failing.do_action_with_exception = fail
+    pool.put(failing)
+    with pytest.raises(Exception, match='SAS throttled'):
+        client.fetch_with_count_concurrent('cn-hangzhou', 'INT', Request(),
+                                           items)
+    assert pool.qsize() == client.ALIYUN_CONCURRENCY
+
+
+def test_concurrent_fetches_of_an_account_never_share_a_client(served):
+    # Like SAS jobs of several types for the same account and region
+    served(list(range(95)), 'count')
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(
+            executor.map(
+                lambda _: client.fetch_with_count_concurrent(
+                    'cn-hangzhou', 'INT', Request(), items), range(8)))
+    assert results == [list(range(95))] * 8
@@ -0,0 +1,35 @@
+import sys
+import types
+from datetime import timedelta
+
+import click
+import pytest
+
+from pipeline.backfill import sub_window_step, DEFAULT_STEP
+
+
+@pytest.fixture
+def connector(monkeypatch):
+    """A partitioned connector module, with a default and a minimal sub window like gmail"""
+    module = types.ModuleType('partitioned')
+    module.CHECKPOINT_WINDOW = timedelta(days=2)
+    module.MIN_SUB_WINDOW = timedelta(days=1)
+    monkeypatch.setitem(sys.modules, 'partitioned', module)
+    return 'partitioned'
+
+
+def test_sub_window_step_defaults_to_the_connector_window(connector):
+    assert sub_window_step(connector) == timedelta(days=2)
+    assert sub_window_step(connector, 24) == timedelta(days=1)
+
+
+def test_sub_window_step_rejects_windows_below_the_connector_minimum(
+        connector):
+    with pytest.raises(click.BadParameter, match='at least 1 day'):
+        sub_window_step(connector, 1)
+
+
+def test_sub_window_step_of_a_connector_without_a_window(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'hourly', types.ModuleType('hourly'))
+    assert sub_window_step('hourly') == DEFAULT_STEP
+    assert sub_window_step('hourly', 3) == timedelta(hours=3)
@@ -0,0 +1,26 @@
+from pipeline.common.bloom import BloomFilter
+
+
+def test_no_false_negatives():
+    bloom = BloomFilter(1000, 0.01)
+    keys = [f'id-{i}' for i in range(1000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+    assert bloom.count <= 1000
+
+
+def test_false_positive_rate_is_bounded():
+    bloom = BloomFilter(10000, 0.01)
+    for i in range(10000):
+        bloom.add(f'seen-{i}')
+    positives = sum(f'new-{i}' in bloom for i in range(10000))
+    # Three times the configured rate leaves room for the variance of 10000 lookups
+    assert positives < 10000 * 0.01 * 3
+
+
+def test_sized_for_capacity_and_error_rate():
+    small = BloomFilter(1000, 0.01)
+    assert BloomFilter(10000, 0.01).memory() > small.memory()
+    assert BloomFilter(1000, 0.0001).memory() > small.memory()
+    assert 'missing' not in small
@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from pipeline.common.checkpoint import SQLiteStore
+
+START = datetime(2024, 3, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SQLiteStore(str(tmp_path / 'checkpoints.db'))
+    yield store
+    store.close()
+
+
+def test_latest_of_an_unknown_table(store):
+    assert store.latest('last_fetch') == None
+
+
+def test_mark_round_trips_datetimes_and_scalars(store):
+    stamp = datetime(2024, 3, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+    offset = datetime(2024, 3, 1, 20, 30, tzinfo=timezone(timedelta(hours=8)))
+    store.mark('last_fetch', [START, offset, True, stamp])
+    assert store.latest('last_fetch') == (START, offset, True, stamp)
+
+    store.mark('last_id', ['10042', 3, None])
+    assert store.latest('last_id') == ('10042', 3, None)
+
+
+def test_mark_replaces_the_checkpoint(store):
+    store.mark('last_fetch', [START, START + timedelta(hours=1), True])
+    store.mark('last_fetch',
+               [START + timedelta(hours=1), START + timedelta(hours=2), False])
+    assert store.latest('last_fetch') == (START + timedelta(hours=1),
+                                          START + timedelta(hours=2), False)
+
+
+def test_mark_rejects_unsupported_values(store):
+    with pytest.raises(TypeError):
+        store.mark('last_fetch', [object()])
+
+
+def test_completed_windows_per_name(store):
+    window = (START, START + timedelta(days=1))
+    store.complete('gmail', *window)
+    store.complete('gmail', *window)
+    store.complete('jira', START, START + timedelta(hours=1))
+    assert store.completed('gmail') == {window}
+    assert store.completed('lastpass') == set()
+
+
+def test_persisted_across_connections(tmp_path):
+    path = str(tmp_path / 'checkpoints.db')
+    store = SQLiteStore(path)
+    store.mark('last_fetch', [START, True])
+    store.complete('gmail', START, START + timedelta(days=1))
+    store.close()
+
+    store = SQLiteStore(path)
+    assert store.latest('last_fetch') == (START, True)
+    assert store.completed('gmail') == {(START, START + timedelta(days=1))}
+    store.close()
@@ -0,0 +1,24 @@
+import pytest
+
+pytest.importorskip('google.cloud.bigquery')
+pytest.importorskip('secops_common.bigquery')
+
+from pipeline.common.dedup import SeenIds
+
+
+def test_recent_ids_are_evicted_least_recently_used_first():
+    seen = SeenIds('dedup', 1000, 0.001, cache_size=3)
+    seen.add(['a', 'b', 'c'])
+    # Touching a keeps it, b is the least recently used
+    seen.split(['a'])
+    seen.add(['d'])
+    assert list(seen.recent) == ['c', 'a', 'd']
+
+
+def test_split_by_filter_and_cache():
+    seen = SeenIds('dedup', 1000, 0.001, cache_size=2)
+    seen.add(['a', 'b', 'c'])
+    new, unknown = seen.split(['a', 'b', 'c', 'never-seen'])
+    assert new == {'never-seen'}
+    # a was evicted from the cache but is still in the filter, it has to be checked against the table
+    assert unknown == {'a'}
@@ -0,0 +1,141 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from pipeline.common import fetch, window
+from pipeline.common.fetch import Unit, sub_windows, backfill, catch_up
+from pipeline.common.window import publish_watermarked
+
+START = datetime(2024, 3, 1, tzinfo=timezone.utc)
+
+
+def test_sub_windows_cover_the_range():
+    windows = list(
+        sub_windows(START, START + timedelta(hours=2, minutes=30),
+                    timedelta(hours=1)))
+    assert windows == [
+        (START, START + timedelta(hours=1)),
+        (START + timedelta(hours=1), START + timedelta(hours=2)),
+        (START + timedelta(hours=2), START + timedelta(hours=2, minutes=30)),
+    ]
+    assert list(sub_windows(START, START, timedelta(hours=1))) == []
+
+
+def test_backfill_publishes_every_sub_window(store, published):
+    fetched = []
+
+    def get_logs(start, end):
+        fetched.append((start, end))
+        return [{'timestamp': 1}, {'timestamp': 2}]
+
+    total = backfill('jira', get_logs, published, START,
+                     START + timedelta(hours=4))
+    assert total == 8
+    assert sorted(fetched) == list(
+        sub_windows(START, START + timedelta(hours=4), timedelta(hours=1)))
+    assert store.completed('jira') == set(fetched)
+
+
+def test_backfill_resumes_from_the_completed_sub_windows(store, published):
+    end = START + timedelta(hours=4)
+    failing = START + timedelta(hours=2)
+
+    def get_logs(start, end):
+        if (start == failing):
+            raise Exception('fetch failed')
+        return [{'timestamp': 1}]
+
+    with pytest.raises(Exception, match='fetch failed'):
+        backfill('jira', get_logs, published, START, end, concurrency=1)
+    completed = store.completed('jira')
+    assert (START, START + timedelta(hours=1)) in completed
+    assert (failing, failing + timedelta(hours=1)) not in completed
+
+    fetched = []
+
+    def get_logs(start, end):
+        fetched.append((start, end))
+        return [{'timestamp': 1}]
+
+    # Only the sub windows missing from the first run are fetched again
+    backfill('jira', get_logs, published, START, end)
+    windows = set(sub_windows(START, end, timedelta(hours=1)))
+    assert sorted(fetched) == sorted(windows - completed)
+    assert store.completed('jira') == windows
+
+
+def test_backfill_of_another_name_starts_over(store, published):
+    store.complete('lastpass', START, START + timedelta(hours=1))
+    fetched = []
+
+    def get_logs(start, end):
+        fetched.append((start, end))
+        return []
+
+    backfill('jira', get_logs, published, START, START + timedelta(hours=1))
+    assert fetched == [(START, START + timedelta(hours=1))]
+
+
+def test_publish_watermarked_tracks_the_published_events(monkeypatch):
+    published = []
+
+    def publish_all(events, token, name, time_field):
+        published.extend(events)
+
+    monkeypatch.setattr(window, 'publish_all', publish_all)
+
+    def with_time(log):
+        return dict(log, timestamp=log['at'] * 1000)
+
+    logs = [{'at': 3}, {'at': 9}, {'at': 5}]
+    watermark = publish_watermarked(logs, 'token', 'Jira', with_time)
+    assert [event['timestamp'] for event in published] == [3000, 9000, 5000]
+    assert watermark.count == 3 and watermark.last_date() == 9.0
+
+
+def test_catch_up_stops_at_now(store, published):
+    now = datetime.now(tz=timezone.utc)
+    store.mark(
+        'last_fetch',
+        [now - timedelta(minutes=22), now - timedelta(minutes=17), True, now])
+    fetched = []
+
+    def get_logs(start, end):
+        fetched.append((start, end))
+        return [{'timestamp': 1}]
+
+    windows, events = catch_up(Unit.minutes, get_logs, published, 'last_fetch')
+    assert windows == 3 and events == 3
+    # Consecutive five minute windows, the last one ends before now and the next one wouldn't
+    assert fetched[0][0] == now - timedelta(minutes=17)
+    assert all(previous[1] == following[0]
+               for previous, following in zip(fetched, fetched[1:]))
+    last = fetched[-1][1]
+    assert last <= datetime.now(tz=timezone.utc)
+    assert last + timedelta(minutes=5) > now
+    assert store.latest('last_fetch')[:3] == (fetched[-1][0], last, True)
+
+
+def test_catch_up_of_an_up_to_date_table_is_a_single_window(store, published):
+    now = datetime.now(tz=timezone.utc)
+    store.mark(
+        'last_fetch',
+        [now - timedelta(minutes=7), now - timedelta(minutes=2), True, now])
+    windows, _ = catch_up(Unit.minutes, lambda start, end: [], published,
+                          'last_fetch')
+    assert windows == 1
+
+
+def test_catch_up_stops_when_the_budget_is_spent(store, published,
+                                                 monkeypatch):
+    monkeypatch.setattr(fetch, 'CATCHUP_MAX_WINDOWS', 2)
+    now = datetime.now(tz=timezone.utc)
+    store.mark('last_fetch', [
+        now - timedelta(hours=2, minutes=5), now - timedelta(hours=2), True,
+        now
+    ])
+    windows, _ = catch_up(Unit.minutes, lambda start, end: [], published,
+                          'last_fetch')
+    assert windows == 2
+    assert store.latest('last_fetch')[1] == now - timedelta(hours=1,
+                                                            minutes=50)
@@ -0,0 +1,76 @@
+import threading
+
+import pytest
+
+from pipeline.common.functional import partition, partition_by_size, prefetch, prefetch_all
+
+
+def test_partition():
+    assert list(partition(list(range(5)), 2)) == [[0, 1], [2, 3], [4]]
+
+
+def test_partition_by_size_bounds_bytes_and_count():
+    batches = list(partition_by_size(['aa', 'bb', 'cc', 'dd', 'e'], 5, 10))
+    assert batches == [['aa', 'bb'], ['cc', 'dd', 'e']]
+
+    batches = list(partition_by_size(list('abcdefg'), 100, 3))
+    assert batches == [['a', 'b', 'c'], ['d', 'e', 'f'], ['g']]
+
+
+def test_partition_by_size_oversized_item_is_its_own_batch():
+    batches = list(partition_by_size(['a', 'x' * 20, 'b'], 5, 10))
+    assert batches == [['a'], ['x' * 20], ['b']]
+
+    assert list(partition_by_size(['x' * 20], 5, 10)) == [['x' * 20]]
+
+
+def test_partition_by_size_is_lazy():
+    assert list(partition_by_size([], 5, 10)) == []
+
+    def items():
+        yield 'aaa'
+        yield 'bbb'
+        raise AssertionError('consumed past the first batch')
+
+    assert next(partition_by_size(items(), 3, 10)) == ['aaa']
+
+
+def test_prefetch_keeps_the_order():
+    assert list(prefetch(iter(range(100)), 3)) == list(range(100))
+
+
+def test_prefetch_raises_producer_errors():
+    def pages():
+        yield 1
+        raise ValueError('page 2 failed')
+
+    items = prefetch(pages(), 2)
+    assert next(items) == 1
+    with pytest.raises(ValueError, match='page 2 failed'):
+        next(items)
+
+
+def test_prefetch_all_yields_every_item():
+    streams = [range(i * 100, i * 100 + 50) for i in range(4)]
+    assert sorted(prefetch_all(streams, 5)) == sorted(item
+                                                      for stream in streams
+                                                      for item in stream)
+
+
+def test_prefetch_stops_producing_when_the_consumer_stops():
+    produced = []
+    stopped = threading.Event()
+
+    def pages():
+        try:
+            for i in range(1000):
+                produced.append(i)
+                yield i
+        finally:
+            stopped.set()
+
+    items = prefetch(pages(), 2)
+    assert next(items) == 0
+    items.close()
+    assert stopped.wait(timeout=5)
+    assert len(produced) < 1000
@@ -0,0 +1,118 @@
+import gzip
+import json
+
+import pytest
+
+from pipeline.common import ingest, splunk
+from pipeline.common.ingest import line_ranges, gzip_ranges, Offsets, publish_range
+
+LINES = [
+    f'{{"id": {i}, "message": "{"x" * (i % 17)}"}}\n'.encode()
+    for i in range(500)
+]
+
+
+@pytest.fixture
+def ndjson(tmp_path):
+    path = tmp_path / 'events.json'
+    path.write_bytes(b''.join(LINES))
+    return str(path)
+
+
+@pytest.mark.parametrize('range_bytes', [1, 100, 1000, 10**6])
+def test_line_ranges_are_contiguous_and_line_aligned(ndjson, range_bytes):
+    with open(ndjson, 'rb') as f:
+        data = f.read()
+    ranges = line_ranges(ndjson, range_bytes)
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(data)
+    assert all(previous[1] == following[0]
+               for previous, following in zip(ranges, ranges[1:]))
+    assert all(data[end - 1:end] == b'\n' for _, end in ranges)
+    assert b''.join(data[start:end] for start, end in ranges) == data
+
+
+def test_line_ranges_of_a_file_without_a_trailing_newline(tmp_path):
+    path = tmp_path / 'events.json'
+    path.write_bytes(b'{"id": 1}\n{"id": 2}')
+    assert line_ranges(str(path), 4) == [(0, 10), (10, 19)]
+
+
+def test_line_ranges_of_an_empty_file(tmp_path):
+    path = tmp_path / 'events.json'
+    path.write_bytes(b'')
+    assert line_ranges(str(path), 100) == []
+
+
+def test_gzip_ranges_are_line_aligned(tmp_path):
+    path = tmp_path / 'events.json.gz'
+    with gzip.open(path, 'wb') as f:
+        f.write(b''.join(LINES))
+    ranges = list(gzip_ranges(str(path), 1000))
+    assert len(ranges) > 1
+    assert b''.join(data for _, _, data in ranges) == b''.join(LINES)
+    assert all(data.endswith(b'\n') for _, _, data in ranges)
+    assert all(end - start == len(data) for start, end, data in ranges)
+    assert all(previous[1] == following[0]
+               for previous, following in zip(ranges, ranges[1:]))
+
+
+def test_offsets_committed_is_the_contiguous_prefix(ndjson):
+    offsets = Offsets(ndjson, 100)
+    assert offsets.committed() == 0
+    offsets.done(100, 200)
+    assert offsets.committed() == 0
+    offsets.done(0, 100)
+    offsets.done(300, 400)
+    assert offsets.committed() == 200
+
+
+def test_offsets_resume(ndjson):
+    offsets = Offsets(ndjson, 100)
+    offsets.done(0, 100)
+    offsets.done(200, 300)
+
+    resumed = Offsets(ndjson, 100)
+    assert resumed.completed == {(0, 100), (200, 300)}
+    assert resumed.committed() == 100
+
+    resumed.remove()
+    assert Offsets(ndjson, 100).completed == set()
+
+
+def test_offsets_of_another_range_size_or_file_are_ignored(ndjson):
+    Offsets(ndjson, 100).done(0, 100)
+    assert Offsets(ndjson, 200).completed == set()
+
+    with open(ndjson, 'ab') as f:
+        f.write(b'{"id": 500}\n')
+    assert Offsets(ndjson, 100).completed == set()
+
+
+def test_publish_range_returns_once_the_publisher_is_closed(
+        ndjson, monkeypatch):
+    events = []
+
+    class Publisher:
+        """Records the events, closing (flushing and waiting for acks) is when they count as published"""
+        def __init__(self, token, http=None):
+            self.batches = []
+            self.events = 0
+
+        def submit(self, batch):
+            self.batches.append(batch)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            for batch in self.batches:
+                events.extend(batch)
+                self.events += len(batch)
+
+    monkeypatch.setattr(splunk, 'Publisher', Publisher)
+    monkeypatch.setattr(ingest, '_session', lambda: object())
+    start, end = line_ranges(ndjson, 1000)[1]
+    transform = lambda line: dict(json.loads(line), timestamp=1)
+    assert publish_range(ndjson, start, end, None, transform,
+                         'token') == (start, end, len(events))
+    assert len(events) > 0
@@ -0,0 +1,129 @@
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+
+pytest.importorskip('google.cloud.bigquery')
+pytest.importorskip('secops_common.bigquery')
+
+from pipeline.common import secrets
+
+
+def read_config(project_id, name):
+    return {'user': 'user', 'token': 'token', 'splunk': 'splunk'}
+
+
+# The connector reads its secrets on import
+with pytest.MonkeyPatch.context() as patch:
+    patch.setattr(secrets, '_read_config', read_config)
+    from pipeline import jira
+
+START = datetime(2024, 3, 1, tzinfo=timezone.utc)
+
+
+class Response:
+    def __init__(self, status_code, data=None, headers=None):
+        self.status_code = status_code
+        self.data = data
+        self.headers = headers or {}
+
+    def json(self):
+        return self.data
+
+
+class Session:
+    """Audit records pages served by offset, responses (by offset) are served first when given"""
+    def __init__(self, records, responses=None, delays=None):
+        self.records = records
+        self.responses = responses or {}
+        self.delays = delays or {}
+        self.offsets = []
+
+    def get(self, url, headers, auth, params):
+        offset = params['offset']
+        self.offsets.append(offset)
+        time.sleep(self.delays.get(offset, 0))
+        if (self.responses.get(offset)):
+            return self.responses[offset].pop(0)
+        return Response(
+            200, {
+                'records': self.records[offset:offset + params['limit']],
+                'limit': params['limit'],
+                'total': len(self.records)
+            })
+
+
+@pytest.fixture
+def records():
+    return [{'id': i} for i in range(25)]
+
+
+@pytest.fixture
+def session(monkeypatch, records):
+    session = Session(records)
+    monkeypatch.setattr(jira, 'session', lambda url: session)
+    monkeypatch.setattr(jira, 'LIMIT', 10)
+    return session
+
+
+def test_retry_after_seconds_date_or_backoff():
+    assert jira.retry_after(Response(429, headers={'Retry-After': '7'}),
+                            0) == 7.0
+    later = datetime.now(tz=timezone.utc) + timedelta(seconds=30)
+    delay = jira.retry_after(
+        Response(429, headers={'Retry-After': format_datetime(later)}), 0)
+    assert 25 < delay <= 30
+    past = datetime.now(tz=timezone.utc) - timedelta(seconds=30)
+    assert jira.retry_after(
+        Response(429, headers={'Retry-After': format_datetime(past)}), 0) == 0
+    assert jira.retry_after(Response(429), 3) == 8
+    assert jira.retry_after(Response(429, headers={'Retry-After': 'soon'}),
+                            2) == 4
+
+
+def test_ordered_pages_keep_the_offsets_order(session, monkeypatch):
+    monkeypatch.setattr(jira, 'PAGE_CONCURRENCY', 3)
+    # Earlier pages answer last
+    session.delays = {0: 0.2, 10: 0.1}
+    pages = list(jira.ordered_pages({'limit': 10}, [0, 10, 20]))
+    assert [record['id'] for page in pages
+            for record in page['records']] == list(range(25))
+
+
+def test_unseen_drops_records_already_yielded():
+    seen = set()
+    assert jira.unseen([{'id': 1}, {'id': 2}], seen) == [{'id': 1}, {'id': 2}]
+    assert jira.unseen([{'id': 2}, {'id': 3}], seen) == [{'id': 3}]
+
+
+def test_get_pages_yields_every_record_once(session, records):
+    pages = list(jira._get_pages(START, START + timedelta(hours=1)))
+    assert [record['id'] for page in pages
+            for record in page] == list(range(25))
+    assert sorted(session.offsets) == [0, 10, 20]
+
+
+def test_records_shifted_by_new_ones_are_not_repeated(session, records):
+    # A record arriving after the first page shifts the following pages by one
+    first = Response(200, {'records': records[:10], 'limit': 10, 'total': 25})
+    records.insert(0, {'id': 'new'})
+    session.responses = {0: [first]}
+    pages = list(jira._get_pages(START, START + timedelta(hours=1)))
+    ids = [record['id'] for page in pages for record in page]
+    assert sorted(ids[:25]) == list(range(25))
+    assert len(ids) == len(set(ids))
+
+
+def test_rate_limited_page_is_retried(session, monkeypatch):
+    monkeypatch.setattr(jira.time, 'sleep', lambda seconds: None)
+    session.responses = {10: [Response(429, headers={'Retry-After': '1'})]}
+    pages = list(jira._get_pages(START, START + timedelta(hours=1)))
+    assert sum(map(len, pages)) == 25
+    assert session.offsets.count(10) == 2
+
+
+def test_failed_page_raises(session):
+    session.responses = {20: [Response(500)]}
+    with pytest.raises(Exception, match='at offset 20 500'):
+        list(jira._get_pages(START, START + timedelta(hours=1)))
@@ -0,0 +1,121 @@
+import queue
+import threading
+from itertools import product
+
+import pytest
+
+pytest.importorskip('aliyunsdksas')
+pytest.importorskip('google.cloud.bigquery')
+pytest.importorskip('secops_common.bigquery')
+
+from pipeline.aliyun import sas
+
+
+@pytest.fixture
+def details(monkeypatch):
+    """Event detail requests, counted per id"""
+    fetched = []
+    lock = threading.Lock()
+
+    def fetch_event(client, id):
+        with lock:
+            fetched.append(id)
+        return {'Id': id}
+
+    pool = queue.Queue()
+    for _ in range(2):
+        pool.put(object())
+    monkeypatch.setattr(sas, '_fetch_event', fetch_event)
+    monkeypatch.setattr(sas, 'client_pool', lambda region, account: pool)
+    sas._get_event.cache_clear()
+    yield fetched
+    sas._get_event.cache_clear()
+
+
+def alarm(unique, ids):
+    return {'AlarmUniqueInfo': unique, 'SecurityEventIds': ids}
+
+
+def test_add_events_fetches_each_distinct_event_once(details):
+    alarms = [alarm('a', [1, 2]), alarm('b', [2, 3]), alarm('c', 3)]
+    sas.add_events('INT', alarms)
+    assert sorted(details) == [1, 2, 3]
+    assert [[event['Id'] for event in alarm['Events']]
+            for alarm in alarms] == [[1, 2], [2, 3], [3]]
+
+
+def test_event_details_are_cached_across_runs(details):
+    sas.add_events('INT', [alarm('a', [1, 2])])
+    sas.add_events('INT', [alarm('b', [2, 3])])
+    assert sorted(details) == [1, 2, 3]
+    # Cached per account
+    sas.add_events('CN', [alarm('c', [1])])
+    assert sorted(details) == [1, 1, 2, 3]
+
+
+def test_only_new_alarms_are_enriched(details, monkeypatch):
+    alarms = [alarm('a', [1]), alarm('b', [2]), alarm('c', [3])]
+    monkeypatch.setattr(sas, '_get_alarms',
+                        lambda account, start, end, region: alarms)
+    monkeypatch.setattr(
+        sas, 'new_events', lambda events, get_id, table:
+        [event for event in events if get_id(event) != 'b'])
+    monkeypatch.setattr(sas, 'accound_id', lambda account: '1234')
+    new = sas._fetch_alerts(5, 'minutes', 'INT')
+    assert [alarm['AlarmUniqueInfo'] for alarm in new] == ['a', 'c']
+    assert sorted(details) == [1, 3]
+    assert all(alarm['CloudAccountId'] == '1234' for alarm in new)
+
+
+@pytest.fixture
+def jobs(monkeypatch):
+    """The account/type/region jobs run, jobs of the failing account raise"""
+    jobs = []
+    lock = threading.Lock()
+
+    def publish_sas(num, unit, _type, account, region, http):
+        with lock:
+            jobs.append((_type, account, region, http))
+        if (account == 'failing'):
+            raise Exception('SAS throttled')
+
+    monkeypatch.setattr(sas, '_publish_sas', publish_sas)
+    monkeypatch.setattr(sas, 'retryable', lambda pool_size: 'session')
+    return jobs
+
+
+def test_every_type_account_and_region_is_published(jobs):
+    sas._publish_sas_many(30, 'days', ['alerts', 'leaks'], ['INT', 'CN'],
+                          ['cn-hangzhou', 'ap-southeast-1'])
+    assert len(jobs) == 8
+    expected = product(['alerts', 'leaks'], ['INT', 'CN'],
+                       ['cn-hangzhou', 'ap-southeast-1'])
+    assert set(job[:3] for job in jobs) == set(expected)
+    # Over a single shared session
+    assert set(http for _, _, _, http in jobs) == {'session'}
+
+
+def test_regions_default_to_the_sas_region(jobs):
+    sas._publish_sas_many(30, 'days', ['exposed'], ['INT'])
+    assert jobs == [('exposed', 'INT', sas.SAS_REGION, 'session')]
+
+
+def test_failing_job_does_not_stop_the_others(jobs):
+    with pytest.raises(Exception, match='failed for 2 out of 6 jobs'):
+        sas._publish_sas_many(30, 'days', ['alerts', 'leaks'],
+                              ['INT', 'failing', 'CN'])
+    assert len(jobs) == 6
+
+
+def test_shared_session_bytes_are_logged_once(monkeypatch):
+    published = []
+    monkeypatch.setattr(sas, 'read_config',
+                        lambda project_id, name: {'splunk': 'token'})
+
+    def publish_all(events, token, name, http, **batch_kwargs):
+        published.append((name, http))
+
+    monkeypatch.setattr(sas, 'publish_all', publish_all)
+    sas._publish_events([], 'INT')
+    sas._publish_events([], 'INT', http='session')
+    assert published == [('Aliyun SAS INT', None), (None, 'session')]
@@ -0,0 +1,105 @@
+import time
+import types
+
+import pytest
+
+from pipeline.common import secrets
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(secrets, 'time',
+                        types.SimpleNamespace(monotonic=clock.monotonic))
+    monkeypatch.setattr(secrets, 'SECRETS_TTL', 100)
+    monkeypatch.setattr(secrets, 'SECRETS_REFRESH_AHEAD', 10)
+    monkeypatch.setattr(secrets, 'counters',
+                        dict.fromkeys(secrets.counters, 0))
+    secrets.invalidate()
+    yield clock
+    secrets.invalidate()
+
+
+@pytest.fixture
+def reads(monkeypatch):
+    """Secret Manager reads, each one returning a new version"""
+    reads = []
+
+    def read_config(project_id, name):
+        reads.append((project_id, name))
+        return {'token': f'v{len(reads)}'}
+
+    monkeypatch.setattr(secrets, '_read_config', read_config)
+    return reads
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_cached_until_the_ttl_expires(clock, reads):
+    assert secrets.read_config('project', 'jira') == {'token': 'v1'}
+    clock.now += 50
+    assert secrets.read_config('project', 'jira') == {'token': 'v1'}
+    assert len(reads) == 1
+
+    clock.now += 50
+    assert secrets.read_config('project', 'jira') == {'token': 'v2'}
+    assert len(reads) == 2
+    assert secrets.stats() == dict(hits=1,
+                                   misses=2,
+                                   refreshes=0,
+                                   refresh_errors=0,
+                                   cached=1)
+
+
+def test_refreshed_in_the_background_before_expiring(clock, reads):
+    secrets.read_config('project', 'jira')
+    clock.now += 95
+    # Served from the cache while the refresh runs
+    assert secrets.read_config('project', 'jira') == {'token': 'v1'}
+    wait_for(lambda: secrets.stats()['refreshes'] == 1)
+    assert secrets.read_config('project', 'jira') == {'token': 'v2'}
+
+    # The refreshed value is valid for a whole ttl
+    clock.now += 80
+    assert secrets.read_config('project', 'jira') == {'token': 'v2'}
+    assert len(reads) == 2
+
+
+def test_failed_refresh_keeps_the_cached_value(clock, reads, monkeypatch):
+    secrets.read_config('project', 'jira')
+
+    def read_config(project_id, name):
+        raise Exception('Secret Manager unavailable')
+
+    monkeypatch.setattr(secrets, '_read_config', read_config)
+    clock.now += 95
+    assert secrets.read_config('project', 'jira') == {'token': 'v1'}
+    wait_for(lambda: secrets.stats()['refresh_errors'] == 1)
+    assert secrets.read_config('project', 'jira') == {'token': 'v1'}
+
+    clock.now += 10
+    with pytest.raises(Exception, match='Secret Manager unavailable'):
+        secrets.read_config('project', 'jira')
+
+
+def test_invalidate_by_name(clock, reads):
+    secrets.read_config('project', 'jira')
+    secrets.read_config('project', 'gmail')
+    secrets.invalidate(name='jira')
+    secrets.read_config('project', 'jira')
+    secrets.read_config('project', 'gmail')
+    assert reads == [('project', 'jira'), ('project', 'gmail'),
+                     ('project', 'jira')]
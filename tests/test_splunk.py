@@ -0,0 +1,148 @@
+import json
+import threading
+
+import pytest
+
+from pipeline.common import splunk
+from pipeline.common.splunk import hec_batches, Publisher, Acknowledger
+
+
+def test_hec_batches_respect_the_byte_budget():
+    events = [{'i': i, 'timestamp': 1000 + i} for i in range(100)]
+    size = len(splunk.into_event('timestamp', None, dict(events[0])))
+    batches = list(
+        hec_batches(events,
+                    time_field='timestamp',
+                    max_bytes=size * 10,
+                    max_count=1000))
+    assert sum(map(len, batches)) == 100
+    assert all(sum(map(len, batch)) <= size * 10 for batch in batches)
+
+    first = json.loads(batches[0][0])
+    assert first == {'event': {'i': 0, 'timestamp': 1000}, 'time': 1000}
+
+
+def test_hec_batches_single_event_over_the_byte_budget():
+    events = [{'i': 0}, {'i': 1, 'blob': 'x' * 5000}, {'i': 2}]
+    batches = list(hec_batches(events, max_bytes=1000, max_count=10))
+    assert list(map(len, batches)) == [1, 1, 1]
+    assert len(batches[1][0]) > 1000
+
+
+def test_hec_batches_sourcetype_moved_to_metadata():
+    event = json.loads(
+        list(
+            hec_batches([{
+                'a': 1,
+                'Source': 'aliyun:sas:alerts'
+            }],
+                        sourcetype_field='Source'))[0][0])
+    assert event == {'event': {'a': 1}, 'sourcetype': 'aliyun:sas:alerts'}
+
+
+@pytest.fixture
+def published(monkeypatch):
+    """Batches published (by publish_batch) instead of sending them"""
+    batches = []
+    lock = threading.Lock()
+
+    def publish_batch(http, batch, token, channel=None):
+        if any('fail' in event for event in batch):
+            raise Exception('HEC returned 400')
+        with lock:
+            batches.append(batch)
+        if (channel != None):
+            return len(batches)
+
+    monkeypatch.setattr(splunk, 'publish_batch', publish_batch)
+    return batches
+
+
+def test_publisher_publishes_every_batch(published):
+    with Publisher('token', http=object(), max_in_flight=2,
+                   ack=False) as publisher:
+        for i in range(10):
+            publisher.submit([f'event {i}'])
+    assert sorted(map(tuple,
+                      published)) == [(f'event {i}', ) for i in range(10)]
+    assert publisher.events == 10
+
+
+def test_publisher_raises_a_failed_batch_on_close(published):
+    with pytest.raises(Exception, match='HEC returned 400'):
+        with Publisher('token', http=object(), max_in_flight=2,
+                       ack=False) as publisher:
+            publisher.submit(['fail'])
+
+
+def test_publisher_error_is_raised_on_later_submits(published):
+    publisher = Publisher('token', http=object(), max_in_flight=1, ack=False)
+    publisher.submit(['fail']).exception()
+    with pytest.raises(Exception, match='failed to publish batch'):
+        publisher.submit(['ok'])
+    with pytest.raises(Exception, match='failed to publish batch'):
+        publisher.flush()
+    publisher._shutdown()
+
+
+def test_publisher_error_inside_the_block_wins(published):
+    with pytest.raises(ValueError, match='fetch failed'):
+        with Publisher('token', http=object(), ack=False) as publisher:
+            publisher.submit(['fail'])
+            raise ValueError('fetch failed')
+
+
+def test_publisher_waits_for_acks(published, monkeypatch):
+    queried = []
+
+    def query_acks(http, token, channel, ack_ids):
+        queried.append(set(ack_ids))
+        return set(ack_ids)
+
+    monkeypatch.setattr(splunk, 'query_acks', query_acks)
+    monkeypatch.setattr(splunk, 'HEC_ACK_INTERVAL', 0)
+    publisher = Publisher('token', http=object(), ack=True)
+    publisher.acknowledger.interval = 0
+    with publisher:
+        publisher.submit(['a'])
+        publisher.submit(['b'])
+    assert set().union(*queried) == {1, 2}
+    assert publisher.acknowledger.acked == 2
+
+
+def test_acknowledger_times_out_on_missing_acks(monkeypatch):
+    monkeypatch.setattr(splunk, 'query_acks',
+                        lambda http, token, channel, ack_ids: set())
+    acknowledger = Acknowledger(object(), 'token', 'channel', interval=0)
+    acknowledger.add(7)
+    try:
+        with pytest.raises(Exception, match='1 HEC batches were not'):
+            acknowledger.wait(timeout=0.2)
+    finally:
+        acknowledger.close()
+
+
+def test_acknowledger_keeps_polling_after_a_failed_query(monkeypatch):
+    calls = []
+
+    def query_acks(http, token, channel, ack_ids):
+        calls.append(ack_ids)
+        if (len(calls) == 1):
+            raise Exception('503')
+        return set(ack_ids)
+
+    monkeypatch.setattr(splunk, 'query_acks', query_acks)
+    acknowledger = Acknowledger(object(), 'token', 'channel', interval=0)
+    acknowledger.add(1)
+    try:
+        acknowledger.wait(timeout=5)
+    finally:
+        acknowledger.close()
+    assert len(calls) >= 2
+
+
+def test_publish_all_publishes_every_event(published, monkeypatch):
+    monkeypatch.setattr(splunk, 'retryable', lambda pool_size: object())
+    events = [{'i': i} for i in range(10)]
+    assert splunk.publish_all(events, 'token', max_count=3) == 10
+    assert sorted(map(len, published)) == [1, 3, 3, 3]
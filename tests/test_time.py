@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import pytz
+from dateutil import parser
+
+from pipeline.common.time import unix_time_millis, parse_datetime, parse_millis
+
+SINGAPORE = pytz.timezone('Asia/Singapore')
+
+NEW_YORK = pytz.timezone('America/New_York')
+
+
+def previous_unix_time_millis(dt):
+    epoch = pytz.utc.localize(datetime.utcfromtimestamp(0))
+    return int((dt - epoch).total_seconds() * 1000.0)
+
+
+def previous_parse_millis(value):
+    """The dateutil parsing parse_millis replaced"""
+    dt = parser.parse(value)
+    if (dt.tzinfo == None):
+        dt = dt.replace(tzinfo=timezone.utc)
+    return previous_unix_time_millis(dt)
+
+
+@pytest.mark.parametrize('value', [
+    '2024-03-01T12:30:15Z',
+    '2024-03-01T12:30:15.1Z',
+    '2024-03-01T12:30:15.12Z',
+    '2024-03-01T12:30:15.123Z',
+    '2024-03-01T12:30:15.123456Z',
+    '2024-03-01T12:30:15.123456789Z',
+    '2024-03-01T12:30:15.999Z',
+    '2024-03-01T12:30:15+00:00',
+    '2024-03-01T12:30:15.123+08:00',
+    '2024-03-01T12:30:15.123-05:00',
+    '2024-03-01T12:30:15.5+05:30',
+    '2024-03-01T00:00:00.000-11:00',
+    '2024-03-01T12:30:15',
+    '2024-03-01 12:30:15.250',
+    '2024-03-01',
+    '1970-01-01T00:00:00Z',
+])
+def test_parse_millis_agrees_with_dateutil(value):
+    assert parse_millis(value) == previous_parse_millis(value)
+
+
+def test_parse_millis_of_a_strptime_format():
+    value = '01/03/2024 12:30:15'
+    assert parse_millis(value,
+                        '%d/%m/%Y %H:%M:%S') == previous_unix_time_millis(
+                            datetime(2024,
+                                     3,
+                                     1,
+                                     12,
+                                     30,
+                                     15,
+                                     tzinfo=timezone.utc))
+
+
+@pytest.mark.parametrize('value', [
+    '2024-03-01 12:30:15',
+    '2024-01-01 00:00:00',
+    '2024-07-15 23:59:59',
+])
+@pytest.mark.parametrize('tz', [SINGAPORE, NEW_YORK])
+def test_parse_millis_of_local_times(value, tz):
+    # The lastpass parsing, naive times localized in the account timezone
+    local = tz.localize(datetime.strptime(value, '%Y-%m-%d %H:%M:%S'),
+                        is_dst=None)
+    assert parse_millis(value, '%Y-%m-%d %H:%M:%S',
+                        tz) == previous_unix_time_millis(local)
+
+
+def test_parse_millis_of_a_non_existent_local_time():
+    with pytest.raises(pytz.NonExistentTimeError):
+        parse_millis('2024-03-10 02:30:00', '%Y-%m-%d %H:%M:%S', NEW_YORK)
+
+
+def test_parse_datetime_falls_back_to_dateutil():
+    assert parse_datetime('March 1 2024 12:30') == datetime(2024, 3, 1, 12, 30)
+
+
+def test_unix_time_millis_truncates_micros():
+    dt = datetime(2024, 3, 1, 12, 30, 15, 999999, tzinfo=timezone.utc)
+    assert unix_time_millis(dt) == 1709296215999
+    assert unix_time_millis(dt.astimezone(timezone(
+        timedelta(hours=8)))) == 1709296215999
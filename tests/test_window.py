@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from pipeline.common import window
+from pipeline.common.window import publish_windowed
+
+TABLE = 'jira_log_fetch'
+
+
+@pytest.fixture(autouse=True)
+def checkpoint_every_sub_window(monkeypatch):
+    monkeypatch.setattr(window, 'CHECKPOINT_MIN_INTERVAL', 0)
+
+
+def millis(dt):
+    return int(dt.timestamp() * 1000)
+
+
+def test_cut_short_run_keeps_the_published_sub_windows(store, published):
+    now = datetime.now(tz=timezone.utc)
+    start = now - timedelta(hours=4)
+    store.mark(TABLE, [start, now, True, now])
+    failing = start + timedelta(hours=2)
+
+    def get_logs(sub_start, sub_end):
+        if (sub_start == failing):
+            raise Exception('fetch failed')
+        return [{'timestamp': millis(sub_start)}]
+
+    with pytest.raises(Exception, match='fetch failed'):
+        publish_windowed(get_logs, published, TABLE, step=timedelta(hours=1))
+
+    # Moved past the latest event published before the failure (instead of starting over)
+    resumed, _, success, _ = store.latest(TABLE)
+    last = start + timedelta(hours=1)
+    assert success
+    assert resumed == datetime.fromtimestamp(millis(last) / 1000.0 + 1,
+                                             tz=timezone.utc)
+
+    fetched = []
+
+    def get_logs(sub_start, sub_end):
+        fetched.append(sub_start)
+        return [{'timestamp': millis(sub_start)}]
+
+    watermark, next_start, _ = publish_windowed(get_logs,
+                                                published,
+                                                TABLE,
+                                                step=timedelta(hours=1))
+    assert next_start == resumed
+    assert fetched[0] == resumed
+    assert watermark.count == len(fetched)
+
+
+def test_window_without_events_moves_its_end_only(store, published):
+    now = datetime.now(tz=timezone.utc)
+    start = now - timedelta(minutes=5)
+    store.mark(TABLE, [start, now, True, now])
+    watermark, _, _ = publish_windowed(lambda sub_start, sub_end: [],
+                                       published, TABLE)
+    assert watermark.count == 0
+    same_start, end, success, _ = store.latest(TABLE)
+    assert same_start == start and end >= now and not success
@@ -0,0 +1,113 @@
+import time
+import types
+import threading
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip('google_auth_httplib2')
+pytest.importorskip('google.cloud.bigquery')
+pytest.importorskip('secops_common.bigquery')
+
+from pipeline import workspaces
+
+
+@pytest.fixture
+def secret(monkeypatch):
+    """The service_info secret, credentials are built out of it"""
+    secret = {'private_key_id': 'v1'}
+
+    def from_service_account_info(info, scopes, subject):
+        return types.SimpleNamespace(key=info['private_key_id'])
+
+    monkeypatch.setattr(workspaces, 'read_config',
+                        lambda project_id, name: dict(secret))
+    monkeypatch.setattr(
+        workspaces, 'service_account',
+        types.SimpleNamespace(Credentials=types.SimpleNamespace(
+            from_service_account_info=from_service_account_info)))
+    workspaces._credentials.cache_clear()
+    yield secret
+    workspaces._credentials.cache_clear()
+
+
+def test_credentials_are_reused_until_the_key_rotates(secret):
+    first = workspaces.credentials()
+    assert workspaces.credentials() is first
+
+    secret['private_key_id'] = 'v2'
+    rotated = workspaces.credentials()
+    assert rotated.key == 'v2'
+    assert workspaces.credentials() is rotated
+
+
+class Activities:
+    """A Reports service, executing requests over the given http (which serves a single request
+       at a time, a shared use is recorded since get_activities retries on errors)"""
+    def __init__(self):
+        self.used = []
+        self.shared = []
+        self.lock = threading.Lock()
+
+    def activities(self):
+        return self
+
+    def list(self, **params):
+        return self
+
+    def execute(self, http):
+        if not http.busy.acquire(blocking=False):
+            self.shared.append(http)
+            return {'items': []}
+        try:
+            time.sleep(0.01)
+            with self.lock:
+                self.used.append(http)
+            return {'items': []}
+        finally:
+            http.busy.release()
+
+
+@pytest.fixture
+def connections(secret, monkeypatch):
+    """The authorized connections created"""
+    created = []
+
+    class AuthorizedHttp:
+        def __init__(self, credentials, http):
+            self.credentials = credentials
+            self.busy = threading.Lock()
+            created.append(self)
+
+    monkeypatch.setattr(workspaces, 'AuthorizedHttp', AuthorizedHttp)
+    workspaces.http_pool.cache_clear()
+    yield created
+    workspaces.http_pool.cache_clear()
+
+
+def test_connections_are_reused_across_threads(connections):
+    service = Activities()
+    start = datetime(2024, 3, 1, tzinfo=timezone.utc)
+
+    def fetch(_):
+        # Each call on a new thread, like the prefetch producers
+        thread = threading.Thread(target=workspaces.get_activities,
+                                  args=(service, 'login', start, start))
+        thread.start()
+        thread.join()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(fetch, range(20)))
+    assert not service.shared
+    assert len(service.used) == 20
+    assert len(connections) == workspaces.WORKSPACE_CONCURRENCY
+    assert set(map(id, service.used)) <= set(map(id, connections))
+
+
+def test_lent_connections_use_the_current_credentials(connections, secret):
+    with workspaces.pooled_http() as http:
+        assert http.credentials.key == 'v1'
+    secret['private_key_id'] = 'v2'
+    with workspaces.pooled_http() as http:
+        assert http.credentials.key == 'v2'